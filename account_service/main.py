@@ -1,15 +1,81 @@
-from fastapi import FastAPI, HTTPException, Depends
-import requests
-from sqlalchemy import create_engine
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import List
+
+from fastapi import FastAPI, HTTPException, Depends, Header, Response
+from pydantic_core import to_json
 from sqlalchemy.orm import sessionmaker, Session
-from models import Account, Client, Base
-
-app = FastAPI()
-
-SQLALCHEMY_DATABASE_URL = "sqlite:///./account.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+from models import Account, Client
+from common import migrations
+from common.db import create_engines, database_url
+from common.token_verifier import jwks_sync, verify_token
+from common.identity_cache import get_identity, invalidate_identity
+from common import http_client
+from common.rate_limit import RateLimitMiddleware
+from common import logging_setup
+from common import tracing
+from common.tracing import TracingMiddleware
+from common.revocations import RevocationSync
+from common.pagination import list_rows, PAGE_SIZE_DEFAULT
+from common.cache import TTLCache
+from common.change_feed import track_changes, backfill_changes, changes_response, mark_change
+from common.schemas import AccountOut, columns
+from common.outbox import OutboxDispatcher
+from common import query_profiler
+from common import service_stats
+from common import ledger
+
+
+logging_setup.configure("account_service")
+logger = logging.getLogger("account_service")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    account_events.start()
+    jwks_sync.start()
+    revocation_sync.start()
+    snapshots = asyncio.create_task(ledger.run_snapshots(engine))
+    yield
+    snapshots.cancel()
+    await account_events.stop()
+    await revocation_sync.stop()
+    await jwks_sync.stop()
+    await http_client.close_clients()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RateLimitMiddleware, concurrency={"GET /accounts/all": 2, "GET /ledger/reconcile": 1})
+# Зовнішній шар: трасування бачить і відмови обмежувача
+app.add_middleware(TracingMiddleware)
+app.add_route("/metrics", tracing.metrics, include_in_schema=False)
+
+SQLALCHEMY_DATABASE_URL = database_url("ACCOUNT", "sqlite:///./account.db")
+engine, read_engine = create_engines(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-AUTH_SERVICE_URL = "http://auth_service:8000"
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+migrations.upgrade(engine)
+migrations.check_schema(engine)
+track_changes(SessionLocal, Account)
+backfill_changes(engine, Account)
+AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth_service:8000")
+auth_service = http_client.get_client("auth_service", AUTH_SERVICE_URL)
+revocation_sync = RevocationSync(auth_service, "account_service")
+ACCOUNT_CACHE_SIZE = int(os.getenv("ACCOUNT_CACHE_SIZE", "10000"))
+ACCOUNT_CACHE_TTL = float(os.getenv("ACCOUNT_CACHE_TTL", "30"))
+
+# Знімки рахунків клієнта разом з ETag, ключ — owner_id
+account_cache = TTLCache(maxsize=ACCOUNT_CACHE_SIZE, ttl=ACCOUNT_CACHE_TTL)
+# Сервіси з локальними копіями рахунків, яким надсилаються події змін
+ACCOUNT_EVENT_SUBSCRIBERS = os.getenv(
+    "ACCOUNT_EVENT_SUBSCRIBERS", "http://payment_service:8005,http://credit_card_service:8004"
+).split(",")
+account_events = OutboxDispatcher(SessionLocal, Account.__tablename__, ACCOUNT_EVENT_SUBSCRIBERS,
+                                  "/internal/events/accounts", "account_service")
 
 
 def get_db():
@@ -19,68 +85,120 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
-def get_current_client(token: str, db: Session = Depends(get_db)):
-    # Перевірка токена через auth_service
-    response = requests.get(f"{AUTH_SERVICE_URL}/verify", headers={"Authorization": f"Bearer {token}"})
 
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.json())
+def get_account_snapshot(db: Session, owner_id: int):
+    snapshot = account_cache.get(owner_id)
+    if snapshot is None:
+        accounts = [row._asdict() for row in db.query(*columns(AccountOut, Account)).filter(Account.owner_id == owner_id)]
+        etag = '"' + hashlib.sha1(json.dumps(accounts, sort_keys=True).encode()).hexdigest() + '"'
+        snapshot = (accounts, etag)
+        account_cache.set(owner_id, snapshot)
+    return snapshot
 
-    user_data = response.json()
 
-    # Отримання детальної інформації про клієнта
-    client_response = requests.get(f"{AUTH_SERVICE_URL}/clients/me", headers={"Authorization": f"Bearer {token}"})
+def find_client(db: Session, username: str):
+    return db.query(Client).filter(Client.username == username).first()
 
-    if client_response.status_code != 200:
-        raise HTTPException(status_code=client_response.status_code, detail=client_response.json())
 
-    client_data = client_response.json()
+def add_client(db: Session, username: str):
+    client = Client(username=username)
+    db.add(client)
+    db.commit()
+    db.refresh(client)
+    return client
+
+
+# Запити до БД синхронні й можуть чекати на блокування SQLite, тому йдуть у потік;
+# у циклі подій очікуємо лише auth_service
+async def get_current_client(token: str, db: Session = Depends(get_db)):
+    # Перевірка токена локально, без звернення до auth_service
+    user_data = verify_token(token)
 
     # Перевіряємо, чи клієнт є в локальній БД account.db
-    client = db.query(Client).filter(Client.username == user_data["username"]).first()
+    client = await asyncio.to_thread(find_client, db, user_data["username"])
 
     if not client:
+        # Профіль клієнта потрібен лише для першого запиту, береться з кешу ідентичностей
+        client_data = (await get_identity(token, auth_service))["profile"]
+
         # Якщо клієнта немає, створюємо його в локальній БД
-        client = Client(username=client_data["username"], hashed_password=client_data["hashed_password"])
-        db.add(client)
-        db.commit()
-        db.refresh(client)
+        client = await asyncio.to_thread(add_client, db, client_data["username"])
 
     return client
 
 
+# Auth_service повідомляє про зміну користувача
+@app.post("/internal/identity/invalidate")
+def invalidate_client_identity(username: str, token: str, new_username: str = None, db: Session = Depends(get_db)):
+    if verify_token(token)["role"] != "service":
+        raise HTTPException(status_code=403, detail="Only services can invalidate identities")
+
+    invalidate_identity(username)
+    if new_username and new_username != username:
+        db.query(Client).filter(Client.username == username).update({"username": new_username})
+        db.commit()
+    return {"message": "Identity invalidated"}
+
+
 @app.post("/accounts/")
-def create_account(token: str, db: Session = Depends(get_db)):
-    client = get_current_client(token, db)
+def create_account(client: Client = Depends(get_current_client), db: Session = Depends(get_db)):
     existing_account = db.query(Account).filter(Account.owner_id == client.id).first()
     if existing_account:
         raise HTTPException(status_code=400, detail="Client already has an account")
 
     account = Account(owner_id=client.id, balance=0.0, blocked=False)
     db.add(account)
+    db.flush()
+    # Рядок балансу відкривається разом з рахунком, а не першим поповненням
+    ledger.open_accounts(db.connection(), [account.id])
     db.commit()
     db.refresh(account)
+    account_cache.pop(client.id)
+    account_events.notify()
 
     return {"message": "Account created", "account_id": account.id}
 
 
 @app.get("/account")
-def get_client_account(client: Client = Depends(get_current_client), db: Session = Depends(get_db)):
-    accounts = db.query(Account).filter(Account.owner_id == client.id).all()
-    return accounts
+def get_client_account(client: Client = Depends(get_current_client), db: Session = Depends(get_db),
+                       if_none_match: str = Header(None)):
+    accounts, etag = get_account_snapshot(db, client.id)
+    # Викликач уже має актуальну версію — тіло не потрібне
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(to_json(accounts), media_type="application/json", headers={"ETag": etag})
 
 
 @app.put("/accounts/{account_id}/account_top_up")
 def account_top_up(account_id: int, amount: float, client: Client = Depends(get_current_client),
-            db: Session = Depends(get_db)):
+                   db: Session = Depends(get_db)):
+    # Поповнення лише додатне: від'ємна сума була б списанням, а подія topped_up реплікується без перевірки коштів
+    minor = ledger.exact_minor(amount)
+    if minor is None or minor <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be a positive whole number of cents")
+
     account = db.query(Account).filter(Account.id == account_id, Account.owner_id == client.id).first()
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
 
-    account.balance += amount
+    _, new_balances = ledger.post_transfer(db.connection(), [
+        {"account_id": ledger.EXTERNAL_ACCOUNT_ID, "amount": -minor},
+        {"account_id": account.id, "amount": minor},
+    ])
+
+    account.balance = ledger.from_minor(new_balances[account.id])
+    mark_change(db, "topped_up", amount=ledger.from_minor(minor))
     db.commit()
     db.refresh(account)
+    account_cache.pop(client.id)
+    account_events.notify()
 
     return {"message": "Deposit successful", "new_balance": account.balance}
 
@@ -92,7 +210,10 @@ def block_account(account_id: int, client: Client = Depends(get_current_client),
         raise HTTPException(status_code=404, detail="Account not found")
 
     account.blocked = True
+    mark_change(db, "blocked")
     db.commit()
+    account_cache.pop(client.id)
+    account_events.notify()
     return {"message": "Account blocked"}
 
 
@@ -104,24 +225,52 @@ def delete_account(account_id: int, client: Client = Depends(get_current_client)
 
     db.delete(account)
     db.commit()
+    account_cache.pop(client.id)
+    account_events.notify()
     return {"message": "Account deleted"}
 
 
-@app.get("/accounts/all")
-def get_all_accounts(token: str, db: Session = Depends(get_db)):
-    print(f"Verifying token: {token}")
-
-    response = requests.get(f"{AUTH_SERVICE_URL}/verify", headers={"Authorization": f"Bearer {token}"})
-    print(f"Verify response status: {response.status_code}")
-    print(f"Verify response text: {response.text}")
-
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.json())
-
-    user_data = response.json()
-    print(f"User data: {user_data}")
+@app.get("/accounts/all", response_model=List[AccountOut])
+def get_all_accounts(token: str, after_id: int = 0, limit: int = PAGE_SIZE_DEFAULT, stream: bool = False,
+                     db: Session = Depends(get_read_db)):
+    user_data = verify_token(token)
+    logger.debug("Listing all accounts", extra={"username": user_data.get("username"), "after_id": after_id,
+                                               "limit": limit, "stream": stream})
 
     if user_data.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Only admins can view all accounts")
 
-    return db.query(Account).all()
\ No newline at end of file
+    return list_rows(ReadSessionLocal, db, lambda session: session.query(*columns(AccountOut, Account)), Account, after_id, limit, stream)
+
+# Журнал змін для інкрементальної реплікації в admin_service
+@app.get("/accounts/changes")
+def get_account_changes(token: str, after: int = 0, limit: int = 500, db: Session = Depends(get_db)):
+    if verify_token(token)["role"] not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Only admins can read the change feed")
+    return changes_response(db, Account.__tablename__, after, limit)
+
+# Звірка матеріалізованих балансів з журналом проводок
+@app.get("/ledger/reconcile")
+def reconcile_ledger(token: str, full: bool = False):
+    if verify_token(token)["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can reconcile the ledger")
+    return ledger.reconcile(read_engine, full)
+
+
+# Лічильники процесу для бенчмарків і моніторингу
+@app.get("/internal/stats")
+def get_internal_stats(token: str):
+    if verify_token(token)["role"] not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Only services can read stats")
+    return service_stats.collect(outbox=account_events.status, revocations=revocation_sync.status)
+
+
+# Профіль SQL-запитів процесу: відбитки, повільні запити з планами, підозри на N+1
+@app.get("/debug/queries")
+def get_query_profile(token: str, limit: int = 50, sort: str = "total", reset: bool = False):
+    if verify_token(token)["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can read the query profile")
+    profile = query_profiler.report(limit, sort)
+    if reset:
+        query_profiler.reset()
+    return profile
@@ -1,22 +1,71 @@
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import List
+
 from fastapi import FastAPI, HTTPException, Depends
-from sqlalchemy import create_engine
 from sqlalchemy.orm import declarative_base, sessionmaker, Session
 from fastapi.security import HTTPBearer
-import requests
 
 from models import Client, Payment, Account, CreditCard
-
-app = FastAPI()
+from common import migrations
+from common.db import create_engines, database_url
+from common.token_verifier import jwks_sync, verify_token
+from common import http_client
+from common.rate_limit import RateLimitMiddleware
+from common import logging_setup
+from common import tracing
+from common.tracing import TracingMiddleware
+from common.revocations import RevocationSync
+from common.pagination import list_rows, PAGE_SIZE_DEFAULT
+from common import ledger
+from common import query_profiler
+from common import service_stats
+from common.schemas import ClientOut, PaymentOut, AccountOut, CreditCardOut, columns
+from replication import Replicator
+
+
+logging_setup.configure("admin_service")
+logger = logging.getLogger("admin_service")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    replicator.start()
+    jwks_sync.start()
+    revocation_sync.start()
+    yield
+    await replicator.stop()
+    await revocation_sync.stop()
+    await jwks_sync.stop()
+    await http_client.close_clients()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RateLimitMiddleware, concurrency={
+    "GET /clients/": 4, "GET /accounts/": 4, "GET /payments/": 4, "GET /credit-cards/": 4,
+})
+# Зовнішній шар: трасування бачить і відмови обмежувача
+app.add_middleware(TracingMiddleware)
+app.add_route("/metrics", tracing.metrics, include_in_schema=False)
 
 # Налаштування бази даних
-SQLALCHEMY_DATABASE_URL = "sqlite:///./admin.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+SQLALCHEMY_DATABASE_URL = database_url("ADMIN", "sqlite:///./admin.db")
+engine, read_engine = create_engines(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+migrations.upgrade(engine)
+migrations.check_schema(engine)
 security = HTTPBearer()
-AUTH_SERVICE_URL = "http://auth_service:8000"
-ACCOUNT_SERVICE_URL = "http://account_service:8003"
-CARD_SERVICE_URL = "http://credit_card_service:8004"
-PAYMENT_SERVICE_URL = "http://payment_service:8005"
+AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth_service:8000")
+ACCOUNT_SERVICE_URL = os.getenv("ACCOUNT_SERVICE_URL", "http://account_service:8003")
+CARD_SERVICE_URL = os.getenv("CARD_SERVICE_URL", "http://credit_card_service:8004")
+PAYMENT_SERVICE_URL = os.getenv("PAYMENT_SERVICE_URL", "http://payment_service:8005")
+auth_service = http_client.get_client("auth_service", AUTH_SERVICE_URL)
+revocation_sync = RevocationSync(auth_service, "admin_service")
+account_service = http_client.get_client("account_service", ACCOUNT_SERVICE_URL)
+card_service = http_client.get_client("credit_card_service", CARD_SERVICE_URL)
+payment_service = http_client.get_client("payment_service", PAYMENT_SERVICE_URL)
 
 def get_db():
     db = SessionLocal()
@@ -25,89 +74,66 @@ def get_db():
     finally:
         db.close()
 
-def verify_token(token: str):
-    response = requests.get(f"{AUTH_SERVICE_URL}/verify", headers={"Authorization": f"Bearer {token}"})
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail="Invalid token")
-    return response.json()
-
-def sync_all_data(token: str, db: Session = Depends(get_db)):
-    # Синхронізація клієнтів
-    response = requests.get(f"{AUTH_SERVICE_URL}/clients", headers={"Authorization": f"Bearer {token}"})
-    print("Response status (clients):", response.status_code)
-    print("Response text (clients):", response.text)
-
-    if response.status_code == 200:
-        clients_data = response.json()
-        for client_data in clients_data:
-            client = db.query(Client).filter(Client.username == client_data["username"]).first()
-            if not client:
-                client = Client(username=client_data["username"], hashed_password=client_data["hashed_password"])
-                db.add(client)
-        db.commit()
-    else:
-        raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch clients: {response.text}")
-
-    # Синхронізація рахунків
-    print(f"Sending request to ACCOUNT_SERVICE_URL: {ACCOUNT_SERVICE_URL}/accounts/all?token={token}")
-    response = requests.get(f"{ACCOUNT_SERVICE_URL}/accounts/all?token={token}")
-    print(f"Response status (accounts): {response.status_code}")
-    print(f"Response text (accounts): {response.text}")
-
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail="Failed to fetch accounts")
-
-    accounts_data = response.json()
-    for account_data in accounts_data:
-        account = db.query(Account).filter(Account.id == account_data["id"]).first()
-        if not account:
-            account = Account(
-                id=account_data["id"],
-                owner_id=account_data["owner_id"],
-                balance=account_data["balance"],
-                blocked=account_data["blocked"]
-            )
-            db.add(account)
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
-    db.commit()
 
-    # Синхронізація кредитних карток
-    response = requests.get(f"{CARD_SERVICE_URL}/credit-cards/all?token={token}")
-    if response.status_code == 200:
-        cards_data = response.json()
-        for card_data in cards_data:
-            card = db.query(CreditCard).filter(CreditCard.id == card_data["id"]).first()
-            if not card:
-                card = CreditCard(
-                    id=card_data["id"],
-                    account_id=card_data["account_id"],
-                    card_number=card_data["card_number"],
-                    expiration_date=card_data["expiration_date"],
-                    cvv=card_data["cvv"]
-                )
-                db.add(card)
-        db.commit()
-
-    # Синхронізація платежів
-    response = requests.get(f"{PAYMENT_SERVICE_URL}/payments/all?token={token}")
-    if response.status_code == 200:
-        payments_data = response.json()
-        for payment_data in payments_data:
-            payment = db.query(Payment).filter(Payment.id == payment_data["id"]).first()
-            if not payment:
-                payment = Payment(
-                    account_id=payment_data["account_id"],
-                    id=payment_data["id"],
-                    amount=payment_data["amount"]
-                )
-                db.add(payment)
-        db.commit()
-
-    return {"message": "Data synchronized successfully"}
-
-@app.put("/accounts/{account_id}/unblock")
+# Джерела реплікації: (назва, клієнт сервісу, шлях журналу змін, модель)
+SYNC_SOURCES = (
+    ("clients", auth_service, "/clients/changes", Client),
+    ("accounts", account_service, "/accounts/changes", Account),
+    ("credit_cards", card_service, "/credit-cards/changes", CreditCard),
+    ("payments", payment_service, "/payments/changes", Payment),
+)
+
+replicator = Replicator(SessionLocal, SYNC_SOURCES)
+replicator.clear_unpublished_columns()
+
+# Примусове наздоганяння тягне журнали з чотирьох сервісів, тому токен і роль перевіряються до нього
+async def ensure_replica_fresh(max_staleness: float = None, token: str = Depends(security)):
+    if max_staleness is None:
+        return
+    if verify_token(token.credentials).get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can force replica catch-up")
+    await replicator.ensure_fresh(max_staleness)
+
+@app.get("/replication/status")
+def get_replication_status(token: str = Depends(security)):
+    if verify_token(token.credentials).get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return replicator.metrics()
+
+# Лічильники процесу для бенчмарків і моніторингу
+@app.get("/internal/stats")
+def get_internal_stats(token: str = Depends(security)):
+    if verify_token(token.credentials).get("role") not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return service_stats.collect(replication=replicator.status, revocations=revocation_sync.status)
+
+# Профіль SQL-запитів процесу: відбитки, повільні запити з планами, підозри на N+1
+@app.get("/debug/queries")
+def get_query_profile(token: str = Depends(security), limit: int = 50, sort: str = "total", reset: bool = False):
+    if verify_token(token.credentials).get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can read the query profile")
+    profile = query_profiler.report(limit, sort)
+    if reset:
+        query_profiler.reset()
+    return profile
+
+# Власники даних можуть підштовхнути реплікацію одразу після змін
+@app.post("/replication/notify")
+def notify_replication(token: str = Depends(security)):
+    if verify_token(token.credentials).get("role") not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    replicator.notify()
+    return {"message": "Replication scheduled"}
+
+@app.put("/accounts/{account_id}/unblock", dependencies=[Depends(ensure_replica_fresh)])
 def unblock_account(account_id: int, token: str = Depends(security), db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
     user_data = verify_token(token.credentials)
     if user_data.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Unauthorized action")
@@ -120,42 +146,41 @@ def unblock_account(account_id: int, token: str = Depends(security), db: Session
     db.commit()
     return {"message": "Account unblocked"}
 
-@app.get("/clients/")
-def get_clients(token: str = Depends(security), db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
+@app.get("/clients/", response_model=List[ClientOut], dependencies=[Depends(ensure_replica_fresh)])
+def get_clients(after_id: int = 0, limit: int = PAGE_SIZE_DEFAULT, stream: bool = False, token: str = Depends(security), db: Session = Depends(get_read_db)):
     user_data = verify_token(token.credentials)
     if user_data.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
-    return db.query(Client).all()
+    return list_rows(ReadSessionLocal, db, lambda session: session.query(*columns(ClientOut, Client)), Client, after_id, limit, stream)
 
-@app.get("/payments/")
-def get_payments(token: str = Depends(security), db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
+@app.get("/payments/", response_model=List[PaymentOut], dependencies=[Depends(ensure_replica_fresh)])
+def get_payments(after_id: int = 0, limit: int = PAGE_SIZE_DEFAULT, stream: bool = False, token: str = Depends(security), db: Session = Depends(get_read_db)):
     user_data = verify_token(token.credentials)
     if user_data.get("role") == "admin":
-        return db.query(Payment).all()
-    return db.query(Payment).join(Account).filter(Account.owner_id == user_data.get("user_id")).all()
+        return list_rows(ReadSessionLocal, db, lambda session: session.query(*columns(PaymentOut, Payment)), Payment, after_id, limit, stream)
+    return list_rows(ReadSessionLocal, db,
+                     lambda session: session.query(*columns(PaymentOut, Payment)).join(Account, Payment.account_id == Account.id).filter(Account.owner_id == user_data.get("user_id")),
+                     Payment, after_id, limit, stream)
 
-@app.get("/accounts/")
-def get_accounts(token: str = Depends(security), db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
+@app.get("/accounts/", response_model=List[AccountOut], dependencies=[Depends(ensure_replica_fresh)])
+def get_accounts(after_id: int = 0, limit: int = PAGE_SIZE_DEFAULT, stream: bool = False, token: str = Depends(security), db: Session = Depends(get_read_db)):
     user_data = verify_token(token.credentials)
     if user_data.get("role") == "admin":
-        return db.query(Account).all()
-    return db.query(Account).filter(Account.owner_id == user_data.get("user_id")).all()
+        return list_rows(ReadSessionLocal, db, lambda session: session.query(*columns(AccountOut, Account)), Account, after_id, limit, stream)
+    return list_rows(ReadSessionLocal, db,
+                     lambda session: session.query(*columns(AccountOut, Account)).filter(Account.owner_id == user_data.get("user_id")),
+                     Account, after_id, limit, stream)
 
 
-@app.get("/credit-cards/")
-def get_credit_cards(token: str = Depends(security), db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
+@app.get("/credit-cards/", response_model=List[CreditCardOut], dependencies=[Depends(ensure_replica_fresh)])
+def get_credit_cards(after_id: int = 0, limit: int = PAGE_SIZE_DEFAULT, stream: bool = False, token: str = Depends(security), db: Session = Depends(get_read_db)):
     user_data = verify_token(token.credentials)
     if user_data.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
-    return db.query(CreditCard).all()
+    return list_rows(ReadSessionLocal, db, lambda session: session.query(*columns(CreditCardOut, CreditCard)), CreditCard, after_id, limit, stream)
 
-@app.put("/clients/{client_id}")
+@app.put("/clients/{client_id}", dependencies=[Depends(ensure_replica_fresh)])
 def update_client(client_id: int, username: str, password: str, token: str = Depends(security), db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
     user_data = verify_token(token.credentials)
     client = db.query(Client).filter(Client.id == client_id).first()
     if not client:
@@ -166,22 +191,30 @@ def update_client(client_id: int, username: str, password: str, token: str = Dep
     db.refresh(client)
     return {"message": "Client updated"}
 
-@app.put("/accounts/{account_id}")
+@app.put("/accounts/{account_id}", dependencies=[Depends(ensure_replica_fresh)])
 def update_account(account_id: int, new_balance: float, token: str = Depends(security), db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
     account = db.query(Account).filter(Account.id == account_id).first()
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
     if new_balance < 0:
         raise HTTPException(status_code=400, detail="Balance cannot be negative")
+
+    # Ручна зміна балансу фіксується в журналі як коригування на різницю
+    connection = db.connection()
+    ledger.open_accounts(connection, [account.id])
+    delta = ledger.to_minor(new_balance) - ledger.balance_of(connection, account.id)
+    if delta:
+        ledger.post_transfer(connection, [
+            {"account_id": ledger.ADJUSTMENT_ACCOUNT_ID, "amount": -delta},
+            {"account_id": account.id, "amount": delta},
+        ], check_funds=False)
     account.balance = new_balance
     db.commit()
     db.refresh(account)
     return {"message": "Account updated"}
 
-@app.put("/credit-cards/{card_id}")
+@app.put("/credit-cards/{card_id}", dependencies=[Depends(ensure_replica_fresh)])
 def update_credit_card(card_id: int, new_card_number: str, new_expiration_date: str, new_cvv: str, token: str = Depends(security), db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
     card = db.query(CreditCard).filter(CreditCard.id == card_id).first()
     if not card:
         raise HTTPException(status_code=404, detail="Credit card not found")
@@ -192,9 +225,8 @@ def update_credit_card(card_id: int, new_card_number: str, new_expiration_date:
     db.refresh(card)
     return {"message": "Credit card updated"}
 
-@app.put("/payments/{payment_id}")
+@app.put("/payments/{payment_id}", dependencies=[Depends(ensure_replica_fresh)])
 def update_payment(payment_id: int, new_amount: float, token: str = Depends(security), db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
     payment = db.query(Payment).filter(Payment.id == payment_id).first()
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
@@ -205,9 +237,8 @@ def update_payment(payment_id: int, new_amount: float, token: str = Depends(secu
     db.refresh(payment)
     return {"message": "Payment updated"}
 
-@app.delete("/payments/{payment_id}")
+@app.delete("/payments/{payment_id}", dependencies=[Depends(ensure_replica_fresh)])
 def delete_payment(payment_id: int, token: str = Depends(security), db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
     user_data = verify_token(token.credentials)
     if user_data.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
@@ -219,9 +250,8 @@ def delete_payment(payment_id: int, token: str = Depends(security), db: Session
     db.commit()
     return {"message": "Payment deleted"}
 
-@app.delete("/clients/{client_id}")
+@app.delete("/clients/{client_id}", dependencies=[Depends(ensure_replica_fresh)])
 def delete_client(client_id: int, token: str = Depends(security), db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
     user_data = verify_token(token.credentials)
     if user_data.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
@@ -233,9 +263,8 @@ def delete_client(client_id: int, token: str = Depends(security), db: Session =
     db.commit()
     return {"message": "Client deleted"}
 
-@app.delete("/accounts/{account_id}")
+@app.delete("/accounts/{account_id}", dependencies=[Depends(ensure_replica_fresh)])
 def delete_account(account_id: int, token: str = Depends(security), db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
     user_data = verify_token(token.credentials)
     if user_data.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
@@ -246,9 +275,8 @@ def delete_account(account_id: int, token: str = Depends(security), db: Session
     db.commit()
     return {"message": "Account deleted"}
 
-@app.delete("/credit-cards/{card_id}")
+@app.delete("/credit-cards/{card_id}", dependencies=[Depends(ensure_replica_fresh)])
 def delete_credit_card(card_id: int, token: str, db: Session = Depends(get_db)):
-    sync_all_data(token.credentials, db)
     user_data = verify_token(token.credentials)
     if user_data.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Forbidden")
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import time
+
+from fastapi import HTTPException
+from sqlalchemy import or_
+
+from common import http_client
+from common.bulk_upsert import bulk_upsert
+from common.change_feed import unpublished_columns
+from common.token_verifier import create_service_token
+from models import SyncWatermark
+
+REPLICATION_INTERVAL = float(os.getenv("REPLICATION_INTERVAL", "5"))
+REPLICATION_CATCHUP_TIMEOUT = float(os.getenv("REPLICATION_CATCHUP_TIMEOUT", "10"))
+REPLICATION_TOKEN = os.getenv("REPLICATION_TOKEN")
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "500"))
+
+
+# Фонова реплікація журналів змін у локальну БД admin_service
+class Replicator:
+    def __init__(self, session_factory, sources, interval: float = REPLICATION_INTERVAL):
+        self.session_factory = session_factory
+        self.sources = sources
+        self.interval = interval
+        self.status = {source: {"seq": 0, "inserted": 0, "updated": 0, "unchanged": 0,
+                                 "last_success": None, "last_error": None}
+                       for source, *_ in sources}
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def _token(self):
+        return REPLICATION_TOKEN or create_service_token("admin_service")
+
+    # Колонки, яких немає в журналах змін (hashed_password, cvv), могли потрапити в репліку раніше — стираємо
+    def clear_unpublished_columns(self):
+        db = self.session_factory()
+        try:
+            for source, service, path, model in self.sources:
+                columns = unpublished_columns(model.__table__)
+                if columns:
+                    db.query(model).filter(or_(*(model.__table__.c[column].is_not(None) for column in columns))) \
+                        .update({column: None for column in columns}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _apply_page(self, db, source: str, model, page: dict):
+        watermark = db.get(SyncWatermark, source)
+        if watermark is None:
+            watermark = SyncWatermark(source=source, seq=0)
+            db.add(watermark)
+
+        # Для кожного id важливий лише останній стан у сторінці
+        latest = {change["id"]: change for change in page["changes"]}
+        deleted = [id_ for id_, change in latest.items() if change["op"] == "delete"]
+        counts = bulk_upsert(db, model, [change["data"] for change in latest.values() if change["op"] != "delete"])
+        if deleted:
+            db.query(model).filter(model.id.in_(deleted)).delete(synchronize_session=False)
+        watermark.seq = page["next"]
+        db.commit()
+        return watermark.seq, counts
+
+    async def sync_source(self, source: str, service: http_client.ServiceClient, path: str, model, token: str):
+        db = self.session_factory()
+        try:
+            watermark = db.get(SyncWatermark, source)
+            seq = watermark.seq if watermark else 0
+            # Забираємо лише зміни після збереженої позиції, сторінками
+            while True:
+                response = await service.get(path, params={"after": seq, "limit": SYNC_PAGE_SIZE, "token": token},
+                                             headers={"Authorization": f"Bearer {token}"})
+                if response.status_code != 200:
+                    raise HTTPException(status_code=response.status_code,
+                                        detail=f"Failed to fetch {source}: {response.text}")
+
+                page = response.json()
+                seq, counts = await asyncio.to_thread(self._apply_page, db, source, model, page)
+                status = self.status[source]
+                status["seq"] = seq
+                for key, value in counts.items():
+                    status[key] += value
+                if not page["has_more"]:
+                    break
+        finally:
+            db.close()
+
+    async def sync_once(self):
+        async with self._lock:
+            token = self._token()
+            for source, service, path, model in self.sources:
+                try:
+                    await self.sync_source(source, service, path, model, token)
+                except Exception as exc:
+                    self.status[source]["last_error"] = getattr(exc, "detail", str(exc))
+                else:
+                    self.status[source]["last_success"] = time.time()
+                    self.status[source]["last_error"] = None
+
+    def staleness(self) -> float:
+        synced = [status["last_success"] for status in self.status.values()]
+        if None in synced:
+            return float("inf")
+        return time.time() - min(synced)
+
+    # Примусове наздоганяння, лише якщо репліка старша за max_staleness секунд
+    async def ensure_fresh(self, max_staleness: float):
+        if self.staleness() <= max_staleness:
+            return
+        try:
+            await asyncio.wait_for(self.sync_once(), timeout=REPLICATION_CATCHUP_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        if self.staleness() > max_staleness:
+            raise HTTPException(status_code=503, detail="Replica is stale", headers={"Retry-After": str(int(self.interval))})
+
+    def notify(self):
+        self._wakeup.set()
+
+    def metrics(self) -> dict:
+        now = time.time()
+        staleness = self.staleness()
+        return {
+            "interval_seconds": self.interval,
+            "staleness_seconds": None if staleness == float("inf") else staleness,
+            "sources": {
+                source: {**status, "lag_seconds": None if status["last_success"] is None else now - status["last_success"]}
+                for source, status in self.status.items()
+            },
+        }
+
+    async def run(self):
+        while True:
+            await self.sync_once()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -1,22 +1,70 @@
-from fastapi import FastAPI, HTTPException, Depends
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import List
+
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy import create_engine
+from jose import jwt
 from sqlalchemy.orm import sessionmaker, Session
-from datetime import datetime, timedelta
-from jose import JWTError, jwt
 
-from models import Client, Admin, Base
+from models import Client, Admin
+from common import migrations
+from common.db import create_engines, database_url
+from common.token_verifier import jwks_sync, verify_token, create_service_token
+from common import http_client
+from common.rate_limit import RateLimitMiddleware
+from common import logging_setup
+from common import tracing
+from common.tracing import TracingMiddleware
+from common.pagination import list_rows, PAGE_SIZE_DEFAULT
+from common.change_feed import track_changes, backfill_changes, changes_response
+from common.schemas import ClientOut, columns
+from common import query_profiler
+from common import service_stats
+import passwords
+from principals import find_principal, store_password_hash
+import tokens
+
+
+logging_setup.configure("auth_service")
+logger = logging.getLogger("auth_service")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    passwords.start()
+    jwks_sync.start()
+    with SessionLocal() as db:
+        tokens.load_revocations(db)
+    yield
+    passwords.shutdown()
+    await jwks_sync.stop()
+    await http_client.close_clients()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RateLimitMiddleware, routes={"POST /login": (5, 10), "POST /token/refresh": (5, 10)})
+# Зовнішній шар: трасування бачить і відмови обмежувача
+app.add_middleware(TracingMiddleware)
+app.add_route("/metrics", tracing.metrics, include_in_schema=False)
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./auth.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+SQLALCHEMY_DATABASE_URL = database_url("AUTH", "sqlite:///./auth.db")
+engine, read_engine = create_engines(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+migrations.upgrade(engine)
+migrations.check_schema(engine)
+track_changes(SessionLocal, Client)
+backfill_changes(engine, Client)
 
-SECRET_KEY = "super_secret_key"
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60
 ADMIN_SECRET = "my_admin_secret"
+# Сервіси, що кешують профілі клієнтів і мають дізнаватися про їх зміни
+IDENTITY_SUBSCRIBERS = os.getenv(
+    "IDENTITY_SUBSCRIBERS",
+    "http://account_service:8003,http://payment_service:8005,http://credit_card_service:8004",
+).split(",")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
@@ -27,83 +75,182 @@ def get_db():
     finally:
         db.close()
 
-def create_access_token(username: str, role: str, expires_delta: timedelta):
-    to_encode = {"sub": username, "role": role, "exp": datetime.utcnow() + expires_delta}
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def get_read_db():
+    db = ReadSessionLocal()
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username = payload.get("sub")
-        role = payload.get("role")
+        yield db
+    finally:
+        db.close()
 
-        user = db.query(Client).filter(Client.username == username).first() if role == "client" else db.query(Admin).filter(Admin.username == username).first()
-        if user is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
 
-        return user
-    except JWTError:
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    user_data = verify_token(token)
+    username = user_data["username"]
+    role = user_data["role"]
+
+    user = db.query(Client).filter(Client.username == username).first() if role == "client" else db.query(Admin).filter(Admin.username == username).first()
+    if user is None:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+    return user
+
+async def publish_identity_change(username: str, new_username: str):
+    token = create_service_token("auth_service")
+    for subscriber in filter(None, IDENTITY_SUBSCRIBERS):
+        try:
+            await http_client.get_client(subscriber, subscriber).post(
+                "/internal/identity/invalidate",
+                params={"username": username, "new_username": new_username, "token": token})
+        except HTTPException:
+            # Кеш підписника все одно застаріє за TTL
+            pass
+
 @app.get("/verify")
-def verify_token(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def verify(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
     user = get_current_user(token, db)
     return {"username": user.username, "role": "admin" if isinstance(user, Admin) else "client"}
 
+# Ідентичність і профіль користувача за один запит замість /verify + /clients/me
+@app.get("/identity")
+def get_identity(user = Depends(get_current_user)):
+    return {
+        "username": user.username,
+        "role": "admin" if isinstance(user, Admin) else "client",
+        "profile": {"id": user.id, "username": user.username},
+    }
+
+# Робота з сесією синхронна і може чекати на блокування SQLite, тому обробники нижче виконують її в потоці;
+# у циклі подій очікується лише пул bcrypt
+def add_principal(db: Session, model, username: str, hashed_password: str):
+    db.add(model(username=username, hashed_password=hashed_password))
+    db.commit()
+
+
+def complete_login(db: Session, principal, new_hash: str = None) -> dict:
+    if new_hash:
+        # Відкритий пароль або хеш зі старою вартістю замінюється при успішному вході
+        store_password_hash(db, principal, new_hash)
+    return tokens.issue_tokens(db, principal.username, principal.role)
+
+
+def save_client(db: Session, client: Client, username: str, hashed_password: str):
+    old_username = client.username
+    client.username = username
+    client.hashed_password = hashed_password
+    db.commit()
+    db.refresh(client)
+    # Після зміни пароля чи імені старі сесії не можуть оновлюватися
+    tokens.revoke_user_tokens(db, old_username)
+
+
 # Реєстрація клієнта
 @app.post("/clients/register")
-def register_client(username: str, password: str, db: Session = Depends(get_db)):
-    client = Client(username=username, hashed_password=password)  # Без хешування
-    db.add(client)
-    db.commit()
+async def register_client(username: str, password: str, db: Session = Depends(get_db)):
+    hashed_password = await passwords.hash_password(password)
+    await asyncio.to_thread(add_principal, db, Client, username, hashed_password)
     return {"message": "Client registered"}
 
 
 # Реєстрація адміністратора
 @app.post("/admin/register")
-def register_admin(username: str, password: str, admin_secret: str, db: Session = Depends(get_db)):
+async def register_admin(username: str, password: str, admin_secret: str, db: Session = Depends(get_db)):
     if admin_secret != ADMIN_SECRET:
         raise HTTPException(status_code=403, detail="Invalid admin secret")
-    admin = Admin(username=username, hashed_password=password)  # Без хешування
-    db.add(admin)
-    db.commit()
+    hashed_password = await passwords.hash_password(password)
+    await asyncio.to_thread(add_principal, db, Admin, username, hashed_password)
     return {"message": "Admin registered"}
 
 
 # Авторизація
 @app.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(Client).filter(Client.username == form_data.username).first()
-    role = "client"
-    if not user:
-        user = db.query(Admin).filter(Admin.username == form_data.username).first()
-        role = "admin"
-    if not user or form_data.password != user.hashed_password:
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    principal = await asyncio.to_thread(find_principal, db, form_data.username)
+    if principal is None:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
-    access_token = create_access_token(username=user.username, role=role,
-                                       expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    return {"access_token": access_token, "token_type": "bearer"}
+    try:
+        async with passwords.login_slot():
+            valid, new_hash = await passwords.verify_password(form_data.password, principal.hashed_password)
+    except passwords.PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Too many concurrent logins", headers={"Retry-After": "1"})
+    if not valid:
+        raise HTTPException(status_code=401, detail="Incorrect username or password")
+    return await asyncio.to_thread(complete_login, db, principal, new_hash)
+
+
+# Обмін refresh-токена на нову пару без повторного входу
+@app.post("/token/refresh")
+def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
+    try:
+        return tokens.rotate(db, refresh_token)
+    except tokens.RefreshRejected:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+
+# Вихід: access-токен відкликається до кінця строку дії, ланцюжок refresh-токенів — повністю
+@app.post("/logout")
+def logout(refresh_token: str = None, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    verify_token(token)
+    claims = jwt.get_unverified_claims(token)
+    if claims.get("jti"):
+        tokens.revoke_access_token(db, claims)
+    if refresh_token:
+        tokens.revoke_refresh_token(db, refresh_token)
+    return {"message": "Logged out"}
+
+
+# Відкликані токени для реплікації в сервіси, що перевіряють токени локально
+@app.get("/revocations")
+def get_revocations(after: int = 0, limit: int = 1000, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    if verify_token(token)["role"] not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Only services can read revocations")
+    return tokens.revocations_page(db, after, limit)
 
 
 # Отримання інформації про поточного клієнта
-@app.get("/clients/me")
+@app.get("/clients/me", response_model=ClientOut)
 def get_client_me(client: Client = Depends(get_current_user)):
     return client
 
 
 # Оновлення даних клієнта
 @app.put("/clients/{client_id}")
-def update_client(client_id: int, username: str, password: str, client: Client = Depends(get_current_user),
-                  db: Session = Depends(get_db)):
+async def update_client(client_id: int, username: str, password: str, background_tasks: BackgroundTasks,
+                        client: Client = Depends(get_current_user), db: Session = Depends(get_db)):
     if client.id != client_id:
         raise HTTPException(status_code=403, detail="Access denied")
-    client.username = username
-    client.hashed_password = password  # Без хешування
-    db.commit()
-    db.refresh(client)
+    old_username = client.username
+    hashed_password = await passwords.hash_password(password)
+    await asyncio.to_thread(save_client, db, client, username, hashed_password)
+    background_tasks.add_task(publish_identity_change, old_username, username)
     return {"message": "Client updated"}
 
-@app.get("/clients")
-def get_all_clients(db: Session = Depends(get_db)):
-    clients = db.query(Client).all()
-    return clients
\ No newline at end of file
+@app.get("/clients", response_model=List[ClientOut])
+def get_all_clients(after_id: int = 0, limit: int = PAGE_SIZE_DEFAULT, stream: bool = False,
+                    db: Session = Depends(get_read_db)):
+    return list_rows(ReadSessionLocal, db, lambda session: session.query(*columns(ClientOut, Client)), Client, after_id, limit, stream)
+
+# Журнал змін клієнтів для інкрементальної реплікації в admin_service
+@app.get("/clients/changes")
+def get_client_changes(after: int = 0, limit: int = 500, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    if verify_token(token)["role"] not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Only admins can read the change feed")
+    return changes_response(db, Client.__tablename__, after, limit)
+
+
+# Лічильники процесу для бенчмарків і моніторингу
+@app.get("/internal/stats")
+def get_internal_stats(token: str = Depends(oauth2_scheme)):
+    if verify_token(token)["role"] not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Only services can read stats")
+    return service_stats.collect(passwords=passwords.stats)
+
+
+# Профіль SQL-запитів процесу: відбитки, повільні запити з планами, підозри на N+1
+@app.get("/debug/queries")
+def get_query_profile(token: str = Depends(oauth2_scheme), limit: int = 50, sort: str = "total", reset: bool = False):
+    if verify_token(token)["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can read the query profile")
+    profile = query_profiler.report(limit, sort)
+    if reset:
+        query_profiler.reset()
+    return profile
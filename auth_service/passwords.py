@@ -0,0 +1,100 @@
+import asyncio
+import hmac
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+# Скільки входів одночасно чекають на хешування; 0 — удвічі більше за кількість процесів
+LOGIN_CONCURRENCY = int(os.getenv("LOGIN_CONCURRENCY", "0"))
+LOGIN_QUEUE_TIMEOUT = float(os.getenv("LOGIN_QUEUE_TIMEOUT", "2.0"))
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+
+# Лічильники для бенчмарків і метрик
+stats = {"hashes": 0, "verifications": 0, "upgrades": 0, "rejected_logins": 0}
+
+_pool = None
+_slots = None
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+def _secret(password: str) -> bytes:
+    # bcrypt враховує лише перші 72 байти пароля
+    return password.encode()[:72]
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(_secret(password), bcrypt.gensalt(rounds)).decode()
+
+
+# Перевірка і, за потреби, новий хеш: для старих відкритих паролів і хешів з іншою вартістю
+def _verify(password: str, stored: str, rounds: int):
+    if not stored:
+        return False, None
+    if not stored.startswith(BCRYPT_PREFIXES):
+        if not hmac.compare_digest(password.encode(), stored.encode()):
+            return False, None
+        return True, _hash(password, rounds)
+
+    if not bcrypt.checkpw(_secret(password), stored.encode()):
+        return False, None
+    if int(stored.split("$")[2]) != rounds:
+        return True, _hash(password, rounds)
+    return True, None
+
+
+# Хешування займає ~100 мс CPU, тому виконується в окремих процесах, а не в циклі подій чи пулі потоків
+def start(workers: int = PASSWORD_HASH_WORKERS):
+    global _pool, _slots
+    shutdown()
+    _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    _slots = asyncio.Semaphore(LOGIN_CONCURRENCY or workers * 2)
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+async def _run(function, *args):
+    if _pool is None:
+        start()
+    return await asyncio.get_running_loop().run_in_executor(_pool, function, *args)
+
+
+async def hash_password(password: str) -> str:
+    stats["hashes"] += 1
+    return await _run(_hash, password, BCRYPT_ROUNDS)
+
+
+async def verify_password(password: str, stored: str):
+    stats["verifications"] += 1
+    valid, new_hash = await _run(_verify, password, stored, BCRYPT_ROUNDS)
+    if new_hash:
+        stats["upgrades"] += 1
+    return valid, new_hash
+
+
+# Обмежує кількість входів у черзі на хешування; надлишок отримує відмову замість росту затримки
+@asynccontextmanager
+async def login_slot():
+    if _slots is None:
+        start()
+    try:
+        await asyncio.wait_for(_slots.acquire(), LOGIN_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        stats["rejected_logins"] += 1
+        raise PasswordPoolBusy()
+    try:
+        yield
+    finally:
+        _slots.release()
@@ -0,0 +1,27 @@
+from sqlalchemy import bindparam, literal_column, select, union_all, update
+
+from models import Admin, Client
+
+# Порядок задає пріоритет, якщо ім'я є в обох таблицях (як і раніше, спершу клієнт)
+PRINCIPAL_TABLES = (("client", Client), ("admin", Admin))
+
+
+# Один запит UNION ALL за обома таблицями і лише колонки, потрібні для входу — без побудови ORM-об'єктів.
+# Будується один раз: на кожен вхід лише підставляється ім'я.
+PRINCIPAL_QUERY = union_all(*(
+    select(model.id, model.username, model.hashed_password,
+           literal_column(f"'{role}'").label("role"), literal_column(str(rank)).label("rank"))
+    .where(model.username == bindparam("username"))
+    for rank, (role, model) in enumerate(PRINCIPAL_TABLES)
+)).order_by("rank").limit(1)
+
+
+def find_principal(db, username: str):
+    return db.execute(PRINCIPAL_QUERY, {"username": username}).first()
+
+
+def store_password_hash(db, principal, hashed_password: str):
+    model = dict(PRINCIPAL_TABLES)[principal.role]
+    # Хеш не публікується в журнал змін, тож пряме оновлення без after_flush нічого не пропускає
+    db.execute(update(model).where(model.id == principal.id).values(hashed_password=hashed_password))
+    db.commit()
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import secrets
+import time
+import uuid
+
+from sqlalchemy import delete, select, update
+
+from models import RefreshToken, RevokedToken
+from common.db import insert_for
+from common.token_verifier import jti_digest, revoke, sign_token
+
+ACCESS_TOKEN_EXPIRE_MINUTES = float(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = float(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "14"))
+REVOCATION_PAGE_MAX = 5000
+
+refresh_tokens = RefreshToken.__table__
+revoked_tokens = RevokedToken.__table__
+
+
+class RefreshRejected(Exception):
+    pass
+
+
+def _hash(refresh_token: str) -> str:
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+# Короткоживучий access-токен; jti дозволяє відкликати його до закінчення строку
+def create_access_token(username: str, role: str) -> str:
+    expires_at = int(time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    return sign_token({"sub": username, "role": role, "exp": expires_at, "jti": uuid.uuid4().hex})
+
+
+def issue_tokens(db, username: str, role: str, family: str = None) -> dict:
+    refresh_token = secrets.token_urlsafe(32)
+    now = time.time()
+    db.add(RefreshToken(token_hash=_hash(refresh_token), family=family or uuid.uuid4().hex, username=username,
+                        role=role, created_at=now, expires_at=now + REFRESH_TOKEN_EXPIRE_DAYS * 86400))
+    db.commit()
+    return {"access_token": create_access_token(username, role), "refresh_token": refresh_token,
+            "token_type": "bearer", "expires_in": int(ACCESS_TOKEN_EXPIRE_MINUTES * 60)}
+
+
+# Кожен refresh-токен одноразовий: обмінюється на нову пару в тому ж ланцюжку.
+# Повторне пред'явлення вже використаного токена означає витік — відкликається весь ланцюжок.
+def rotate(db, refresh_token: str) -> dict:
+    token_hash = _hash(refresh_token)
+    row = db.execute(select(refresh_tokens).where(refresh_tokens.c.token_hash == token_hash)).first()
+    if row is None or row.revoked or row.expires_at < time.time():
+        raise RefreshRejected()
+
+    # Умовне позначення: з паралельних запитів з тим самим токеном виграє лише один
+    claimed = db.execute(
+        update(refresh_tokens)
+        .where(refresh_tokens.c.token_hash == token_hash, refresh_tokens.c.used_at.is_(None))
+        .values(used_at=time.time())
+    ).rowcount
+    if not claimed:
+        revoke_family(db, row.family)
+        raise RefreshRejected()
+    return issue_tokens(db, row.username, row.role, row.family)
+
+
+def revoke_family(db, family: str):
+    db.execute(update(refresh_tokens).where(refresh_tokens.c.family == family).values(revoked=True))
+    db.commit()
+
+
+def revoke_refresh_token(db, refresh_token: str):
+    row = db.execute(select(refresh_tokens.c.family).where(refresh_tokens.c.token_hash == _hash(refresh_token))).first()
+    if row is not None:
+        revoke_family(db, row.family)
+
+
+def revoke_user_tokens(db, username: str):
+    db.execute(update(refresh_tokens).where(refresh_tokens.c.username == username).values(revoked=True))
+    db.commit()
+
+
+def revoke_access_token(db, claims: dict):
+    digest = jti_digest(claims["jti"])
+    db.execute(delete(revoked_tokens).where(revoked_tokens.c.expires_at < time.time()))
+    stmt = insert_for(db.get_bind())(revoked_tokens).values(jti_hash=digest, expires_at=claims["exp"])
+    db.execute(stmt.on_conflict_do_nothing(index_elements=[revoked_tokens.c.jti_hash]))
+    db.commit()
+    revoke(digest, claims["exp"])
+
+
+# Ще чинні відкликання після курсора — для реплікації в сервіси, що перевіряють токени
+def revocations_page(db, after: int, limit: int) -> dict:
+    limit = max(1, min(limit, REVOCATION_PAGE_MAX))
+    rows = db.execute(
+        select(revoked_tokens.c.id, revoked_tokens.c.jti_hash, revoked_tokens.c.expires_at)
+        .where(revoked_tokens.c.id > after, revoked_tokens.c.expires_at > time.time())
+        .order_by(revoked_tokens.c.id).limit(limit + 1)
+    ).mappings().all()
+    page = [dict(row) for row in rows[:limit]]
+    return {"revocations": page, "next": page[-1]["id"] if page else after, "has_more": len(rows) > limit}
+
+
+def load_revocations(db):
+    for row in db.execute(select(revoked_tokens).where(revoked_tokens.c.expires_at > time.time())):
+        revoke(row.jti_hash, row.expires_at)
@@ -0,0 +1,422 @@
+# Навантажувальний набір для всіх п'яти сервісів без Docker: кожен піднімається через uvicorn на локальному порту
+# з власною базою SQLite у тимчасовому каталозі, адреси один одного отримує через змінні середовища, як у docker-compose.
+# Після наповнення даними сценарії виконуються по черзі; для кожного — пропускна здатність, p50/p95/p99,
+# очікування блокувань БД і кількість викликів між сервісами (з /internal/stats до і після сценарію).
+# Запуск: python benchmarks/cluster.py --clients 200 --seconds 10 --output baseline.json
+#         python benchmarks/cluster.py --baseline baseline.json   # порівняння з попереднім прогоном
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT]
+
+import httpx  # noqa: E402
+
+from common.token_verifier import create_service_token  # noqa: E402
+
+# Порядок запуску: auth першим, admin останнім, бо він одразу починає реплікацію з усіх інших.
+# Значення — (зсув порту як у docker-compose, префікс <NAME>_DATABASE_URL)
+SERVICES = {
+    "auth_service": (0, "AUTH"),
+    "account_service": (3, "ACCOUNT"),
+    "credit_card_service": (4, "CARD"),
+    "payment_service": (5, "PAYMENT"),
+    "admin_service": (2, "ADMIN"),
+}
+SCENARIOS = ("login_storm", "transfer_storm", "admin_listing", "card_crud")
+PASSWORD = "password"
+ADMIN_SECRET = "my_admin_secret"
+STARTUP_TIMEOUT = 60.0
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else (values[0] if values else 0.0)
+
+
+class Cluster:
+    def __init__(self, workdir: str, base_port: int, env: dict):
+        self.workdir = workdir
+        self.urls = {name: f"http://127.0.0.1:{base_port + offset}" for name, (offset, _) in SERVICES.items()}
+        self.env = {**os.environ, "PYTHONPATH": ROOT, **env,
+                    "AUTH_SERVICE_URL": self.urls["auth_service"],
+                    "ACCOUNT_SERVICE_URL": self.urls["account_service"],
+                    "CARD_SERVICE_URL": self.urls["credit_card_service"],
+                    "PAYMENT_SERVICE_URL": self.urls["payment_service"],
+                    "IDENTITY_SUBSCRIBERS": ",".join(self.urls[name] for name in (
+                        "account_service", "payment_service", "credit_card_service")),
+                    "ACCOUNT_EVENT_SUBSCRIBERS": ",".join(self.urls[name] for name in (
+                        "payment_service", "credit_card_service"))}
+        for name, (_, db_name) in SERVICES.items():
+            self.env[f"{db_name}_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, name + '.db')}"
+        self.processes = {}
+
+    def log_path(self, name: str) -> str:
+        return os.path.join(self.workdir, name + ".log")
+
+    async def start(self, client: httpx.AsyncClient):
+        for name, url in self.urls.items():
+            log = open(self.log_path(name), "wb")
+            self.processes[name] = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--port", url.rsplit(":", 1)[1], "--log-level", "warning"],
+                cwd=os.path.join(ROOT, name), env=self.env, stdout=log, stderr=subprocess.STDOUT)
+            await self.wait_ready(client, name)
+
+    async def wait_ready(self, client: httpx.AsyncClient, name: str):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.processes[name].poll() is not None:
+                with open(self.log_path(name)) as log:
+                    raise RuntimeError(f"{name} exited during startup:\n{log.read()[-2000:]}")
+            try:
+                if (await client.get(self.urls[name] + "/openapi.json")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError(f"{name} did not start in {STARTUP_TIMEOUT:.0f}s, see {self.log_path(name)}")
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    async def stats(self, client: httpx.AsyncClient) -> dict:
+        token = create_service_token("benchmark")
+        result = {}
+        for name, url in self.urls.items():
+            # admin і auth читають токен із заголовка, решта — з параметра запиту
+            response = await client.get(url + "/internal/stats", params={"token": token},
+                                        headers={"Authorization": f"Bearer {token}"})
+            response.raise_for_status()
+            result[name] = response.json()
+        return result
+
+
+# Різниця числових лічильників між двома знімками; статуси й мітки часу пропускаються
+def counter_delta(before, after):
+    if isinstance(after, dict):
+        delta = {}
+        for key, value in after.items():
+            nested = counter_delta(before.get(key) if isinstance(before, dict) else None, value)
+            if nested not in (None, {}):
+                delta[key] = nested
+        return delta
+    if isinstance(after, (int, float)) and not isinstance(after, bool):
+        return after - (before if isinstance(before, (int, float)) else 0)
+    return None
+
+
+def summarize_counters(delta: dict) -> dict:
+    db = {"lock_waits": 0, "lock_wait_seconds": 0.0, "lock_errors": 0}
+    rate_limit = {"limited": 0, "shed": 0, "concurrency_rejected": 0}
+    calls = {}
+    for service, counters in delta.items():
+        for key in db:
+            db[key] += counters.get("db", {}).get(key, 0)
+        for key in rate_limit:
+            rate_limit[key] += counters.get("rate_limit", {}).get(key, 0)
+        for target, client_counters in counters.get("http_clients", {}).items():
+            if client_counters.get("requests"):
+                calls[f"{service} -> {target}"] = client_counters["requests"]
+    db["lock_wait_seconds"] = round(db["lock_wait_seconds"], 3)
+    db["transfer_lock_retries"] = delta.get("payment_service", {}).get("transfers", {}).get("lock_retries", 0)
+    return {"db": db, "rate_limit": rate_limit, "inter_service_calls": sum(calls.values()), "calls": calls}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+
+    async def request(self, op: str, client: httpx.AsyncClient, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = str(response.status_code)
+        except httpx.HTTPError as exc:
+            response, status = None, type(exc).__name__
+        self.latencies.setdefault(op, []).append(time.perf_counter() - started)
+        statuses = self.statuses.setdefault(op, {})
+        statuses[status] = statuses.get(status, 0) + 1
+        return response
+
+    def summary(self, elapsed: float) -> dict:
+        def describe(latencies, statuses):
+            ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+            return {"requests": len(latencies), "ok": ok,
+                    "throughput": round(len(latencies) / elapsed, 1), "ok_throughput": round(ok / elapsed, 1),
+                    "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                    "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                    "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+                    "statuses": dict(sorted(statuses.items()))}
+
+        every = [latency for latencies in self.latencies.values() for latency in latencies]
+        merged = {}
+        for statuses in self.statuses.values():
+            for status, count in statuses.items():
+                merged[status] = merged.get(status, 0) + count
+        return {**describe(every, merged), "elapsed": round(elapsed, 2),
+                "ops": {op: describe(self.latencies[op], self.statuses[op]) for op in sorted(self.latencies)}}
+
+
+class Workload:
+    def __init__(self, cluster: Cluster, client: httpx.AsyncClient, args):
+        self.cluster = cluster
+        self.client = client
+        self.args = args
+        self.url = cluster.urls
+        self.users = []  # (username, token, account_id) у порядку створення рахунків
+        self.admin_token = None
+
+    async def _gather(self, coroutines, limit: int = 16):
+        gate = asyncio.Semaphore(limit)
+
+        async def bounded(coroutine):
+            async with gate:
+                return await coroutine
+
+        return await asyncio.gather(*(bounded(coroutine) for coroutine in coroutines))
+
+    async def _ok(self, method: str, url: str, **kwargs) -> httpx.Response:
+        response = await self.client.request(method, url, **kwargs)
+        if response.status_code >= 300:
+            raise RuntimeError(f"{method} {url} -> {response.status_code}: {response.text[:300]}")
+        return response
+
+    async def _login(self, username: str) -> str:
+        response = await self._ok("POST", self.url["auth_service"] + "/login",
+                                  data={"username": username, "password": PASSWORD})
+        return response.json()["access_token"]
+
+    async def _until_ok(self, method: str, url: str, timeout: float = 30.0, **kwargs):
+        # Події рахунків доходять до payment і credit_card асинхронно через outbox
+        deadline = time.monotonic() + timeout
+        while True:
+            response = await self.client.request(method, url, **kwargs)
+            if response.status_code < 300:
+                return response
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{method} {url} -> {response.status_code}: {response.text[:300]}")
+            await asyncio.sleep(0.2)
+
+    async def seed(self):
+        auth = self.url["auth_service"]
+        names = [f"bench{n}" for n in range(self.args.clients)]
+        await self._gather(self._ok("POST", auth + "/clients/register", params={"username": name, "password": PASSWORD})
+                           for name in names)
+        await self._ok("POST", auth + "/admin/register",
+                       params={"username": "bench_admin", "password": PASSWORD, "admin_secret": ADMIN_SECRET})
+        self.admin_token = await self._login("bench_admin")
+        tokens = await self._gather(self._login(name) for name in names)
+
+        # Локальні id клієнтів у кожному сервісі видаються за першим запитом, тож перше звернення —
+        # строго в одному порядку, щоб id збігалися з owner_id рахунків
+        for name, token in zip(names, tokens):
+            response = await self._ok("POST", self.url["account_service"] + "/accounts/", params={"token": token})
+            self.users.append((name, token, response.json()["account_id"]))
+        for _, token, _ in self.users:
+            await self._ok("GET", self.url["payment_service"] + "/payments/", params={"token": token})
+        for _, token, _ in self.users:
+            await self._ok("GET", self.url["credit_card_service"] + "/credit-cards/", params={"token": token})
+
+        await self._gather(self._ok("PUT", self.url["account_service"] + f"/accounts/{account_id}/account_top_up",
+                                    params={"amount": self.args.balance, "token": token})
+                           for _, token, account_id in self.users)
+        _, last_token, last_account = self.users[-1]
+        await self._until_ok("POST", self.url["payment_service"] + "/make_payments/",
+                             params={"to_account_id": self.users[0][2], "amount": 1.0, "token": last_token})
+        await self._until_ok("POST", self.url["credit_card_service"] + "/credit-cards/create",
+                             params={"account_id": last_account, **self._card(random.Random(0)), "token": last_token})
+
+        rng = random.Random(1)
+        await self._gather(self._ok("POST", self.url["payment_service"] + "/make_payments/batch", params={"token": token},
+                                    json=[{"to_account_id": rng.choice(self.users)[2], "amount": 1.0}
+                                          for _ in range(self.args.payments)])
+                           for _, token, _ in self.users if self.args.payments)
+        await self._gather(self._ok("POST", self.url["credit_card_service"] + "/credit-cards/create",
+                                    params={"account_id": account_id, **self._card(rng), "token": token})
+                           for _, token, account_id in self.users[:-1])
+
+    @staticmethod
+    def _card(rng: random.Random) -> dict:
+        return {"card_number": "".join(rng.choice("0123456789") for _ in range(16)),
+                "expiration_date": f"{rng.randint(1, 12):02d}/{rng.randint(27, 32)}", "cvv": f"{rng.randint(0, 999):03d}"}
+
+    async def run(self, name: str, operation, seconds: float, concurrency: int, background=None) -> dict:
+        recorder = Recorder()
+        deadline = time.perf_counter() + seconds
+
+        async def worker(n: int, step):
+            # Свій генератор на сценарій, щоб не повторювати номери карток з наповнення
+            rng = random.Random(f"{name}:{n}")
+            while time.perf_counter() < deadline:
+                await step(rng, recorder)
+
+        started = time.perf_counter()
+        workers = [worker(n, operation) for n in range(concurrency)]
+        if background is not None:
+            workers.append(worker(concurrency, background))
+        await asyncio.gather(*workers)
+        return recorder.summary(time.perf_counter() - started)
+
+    async def login_storm(self, rng, recorder):
+        await recorder.request("login", self.client, "POST", self.url["auth_service"] + "/login",
+                               data={"username": rng.choice(self.users)[0], "password": PASSWORD})
+
+    async def transfer_storm(self, rng, recorder):
+        # Багато відправників на кілька "гарячих" рахунків отримувачів
+        sender = rng.randrange(self.args.hot_accounts, len(self.users))
+        await recorder.request("transfer", self.client, "POST", self.url["payment_service"] + "/make_payments/",
+                               params={"to_account_id": self.users[rng.randrange(self.args.hot_accounts)][2],
+                                       "amount": 1.0, "token": self.users[sender][1]})
+
+    async def admin_listing(self, rng, recorder):
+        path = rng.choice(("/clients/", "/accounts/", "/payments/", "/credit-cards/"))
+        await recorder.request("list " + path, self.client, "GET", self.url["admin_service"] + path,
+                               params={"limit": 100, "after_id": rng.randrange(len(self.users))},
+                               headers={"Authorization": f"Bearer {self.admin_token}"})
+
+    async def growth(self, rng, recorder):
+        # Дані ростуть під час читання списків: перекази реплікуються в admin_service
+        _, token, _ = rng.choice(self.users)
+        await recorder.request("growth transfer", self.client, "POST", self.url["payment_service"] + "/make_payments/",
+                               params={"to_account_id": rng.choice(self.users)[2], "amount": 1.0, "token": token})
+
+    async def card_crud(self, rng, recorder):
+        cards = self.url["credit_card_service"] + "/credit-cards"
+        _, token, account_id = rng.choice(self.users)
+        response = await recorder.request("create", self.client, "POST", cards + "/create",
+                                          params={"account_id": account_id, **self._card(rng), "token": token})
+        await recorder.request("list", self.client, "GET", cards + "/", params={"token": token})
+        if response is None or response.status_code != 200:
+            return
+        card_id = response.json()["id"]
+        card = self._card(rng)
+        await recorder.request("update", self.client, "PUT", cards + f"/{card_id}",
+                               params={"new_card_number": card["card_number"], "new_expiration_date": card["expiration_date"],
+                                       "new_cvv": card["cvv"], "token": token})
+        await recorder.request("delete", self.client, "DELETE", cards + f"/{card_id}", params={"token": token})
+
+    async def scenario(self, name: str) -> dict:
+        background = self.growth if name == "admin_listing" else None
+        before = await self.cluster.stats(self.client)
+        result = await self.run(name, getattr(self, name), self.args.seconds, self.args.concurrency, background)
+        # Фонові задачі (outbox, реплікація) встигають доробити те, що почалося під час сценарію
+        await asyncio.sleep(self.args.settle)
+        after = await self.cluster.stats(self.client)
+        return {**result, **summarize_counters(counter_delta(before, after))}
+
+
+def report(results: dict):
+    print(f"{'scenario':<22}{'req/s':>9}{'ok/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'lock waits':>12}{'lock errs':>10}{'calls':>8}")
+    for name, result in results.items():
+        print(f"{name:<22}{result['throughput']:>9.1f}{result['ok_throughput']:>9.1f}{result['p50_ms']:>9.1f}"
+              f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['db']['lock_waits']:>12}"
+              f"{result['db']['lock_errors']:>10}{result['inter_service_calls']:>8}")
+        for op, summary in result["ops"].items():
+            print(f"  {op:<20}{summary['throughput']:>9.1f}{summary['ok_throughput']:>9.1f}{summary['p50_ms']:>9.1f}"
+                  f"{summary['p95_ms']:>9.1f}{summary['p99_ms']:>9.1f}  {summary['statuses']}")
+
+
+def compare(baseline: dict, results: dict):
+    def change(old, new):
+        return f"{(new - old) / old:+.0%}" if old else "n/a"
+
+    print(f"\ncompared with {baseline.get('commit') or 'baseline'}:")
+    for name, result in results.items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            continue
+        print(f"{name:<22}ok/s {old['ok_throughput']:.1f} -> {result['ok_throughput']:.1f} "
+              f"({change(old['ok_throughput'], result['ok_throughput'])})  "
+              f"p99 {old['p99_ms']:.1f} -> {result['p99_ms']:.1f} ms ({change(old['p99_ms'], result['p99_ms'])})  "
+              f"lock waits {old['db']['lock_waits']} -> {result['db']['lock_waits']}  "
+              f"calls {old['inter_service_calls']} -> {result['inter_service_calls']}")
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main_async(args):
+    workdir = tempfile.mkdtemp(prefix="bench_cluster_")
+    env = {"BCRYPT_ROUNDS": str(args.bcrypt_rounds)}
+    if not args.rate_limits:
+        env["RATE_LIMIT_ENABLED"] = "false"
+    cluster = Cluster(workdir, args.base_port, env)
+    limits = httpx.Limits(max_connections=args.concurrency * 2 + 16, max_keepalive_connections=args.concurrency * 2)
+    try:
+        async with httpx.AsyncClient(timeout=30.0, limits=limits) as client:
+            await cluster.start(client)
+            workload = Workload(cluster, client, args)
+            started = time.perf_counter()
+            await workload.seed()
+            print(f"seeded {args.clients} clients, {args.clients * args.payments} payments "
+                  f"in {time.perf_counter() - started:.1f}s ({workdir})")
+
+            results = {}
+            for name in args.scenarios.split(","):
+                results[name] = await workload.scenario(name)
+    finally:
+        cluster.stop()
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--payments", type=int, default=5, help="seed payments per client")
+    parser.add_argument("--balance", type=float, default=1_000_000.0)
+    parser.add_argument("--hot-accounts", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--settle", type=float, default=1.0)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--rate-limits", action="store_true", help="keep per-client quotas enabled")
+    parser.add_argument("--base-port", type=int, default=18000)
+    parser.add_argument("--output", help="write results as JSON baseline")
+    parser.add_argument("--baseline", help="compare with a previous JSON baseline")
+    parser.add_argument("--keep", action="store_true", help="keep databases and service logs")
+    args = parser.parse_args()
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.clients <= args.hot_accounts:
+        parser.error("--clients must be larger than --hot-accounts")
+
+    results = asyncio.run(main_async(args))
+    report(results)
+    output = {"commit": current_commit(), "created_at": time.time(),
+              "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "keep")},
+              "scenarios": results}
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(json.load(baseline), results)
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(output, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
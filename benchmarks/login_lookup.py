@@ -0,0 +1,102 @@
+# Пошук користувача при вході: два ORM-запити (Client, потім Admin) проти одного UNION ALL за колонками.
+# Навантаження відкрите — запити йдуть із заданою частотою, затримка рахується від запланованого моменту.
+# Запуск: python benchmarks/login_lookup.py --rate 10000 --seconds 5
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "auth_service"), ROOT]
+
+from sqlalchemy import insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from models import Admin, Client  # noqa: E402
+from common import migrations  # noqa: E402
+from common.db import create_engines  # noqa: E402
+from principals import find_principal  # noqa: E402
+
+
+def legacy_lookup(db, username: str):
+    user = db.query(Client).filter(Client.username == username).first()
+    role = "client"
+    if not user:
+        user = db.query(Admin).filter(Admin.username == username).first()
+        role = "admin"
+    return (user, role) if user else None
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else (values[0] if values else 0.0)
+
+
+def seed(engine, clients: int, admins: int):
+    migrations.upgrade(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(Client.__table__), [
+            {"username": f"client{n}", "hashed_password": "x" * 60} for n in range(clients)])
+        connection.execute(insert(Admin.__table__), [
+            {"username": f"admin{n}", "hashed_password": "x" * 60} for n in range(admins)])
+
+
+def run(session_factory, lookup, usernames, rate: float, seconds: float):
+    interval = 1.0 / rate
+    latencies = []
+    with session_factory() as db:
+        started = time.perf_counter()
+        n = 0
+        while True:
+            scheduled = started + n * interval
+            now = time.perf_counter()
+            # Якщо шлях не встигає за частотою, відставання росте до кінця вікна, а не розсмоктується після
+            if max(scheduled, now) - started >= seconds:
+                break
+            if now < scheduled:
+                time.sleep(scheduled - now)
+            lookup(db, usernames[n % len(usernames)])
+            db.rollback()
+            latencies.append(time.perf_counter() - scheduled)
+            n += 1
+        elapsed = time.perf_counter() - started
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=10000)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--admins", type=int, default=100)
+    parser.add_argument("--admin-share", type=float, default=0.2)
+    parser.add_argument("--miss-share", type=float, default=0.1)
+    args = parser.parse_args()
+
+    engine, _ = create_engines(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_auth.db')}")
+    seed(engine, args.clients, args.admins)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    rng = random.Random(1)
+    usernames = []
+    for _ in range(10000):
+        roll = rng.random()
+        if roll < args.miss_share:
+            usernames.append(f"nobody{rng.randrange(10 ** 6)}")
+        elif roll < args.miss_share + args.admin_share:
+            usernames.append(f"admin{rng.randrange(args.admins)}")
+        else:
+            usernames.append(f"client{rng.randrange(args.clients)}")
+
+    print(f"target {args.rate:.0f} lookups/s for {args.seconds:.0f}s, "
+          f"{args.admin_share:.0%} admins, {args.miss_share:.0%} unknown users")
+    for name, lookup in (("two ORM queries", legacy_lookup), ("UNION ALL columns", find_principal)):
+        latencies, elapsed = run(session_factory, lookup, usernames, args.rate, args.seconds)
+        print(f"{name:<18} achieved={len(latencies) / elapsed:8.0f}/s  p50={percentile(latencies, 50) * 1e6:9.0f}us "
+              f"p99={percentile(latencies, 99) * 1e6:9.0f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Злива входів на /login: пропускна здатність і хвіст затримок залежно від кількості процесів хешування.
+# Запуск: python benchmarks/login_storm.py --workers 1,2,4 --users 50 --requests 400 --concurrency 64
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "auth_service"), ROOT]
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else (values[0] if values else 0.0)
+
+
+async def storm(app, users: int, requests: int, concurrency: int):
+    import httpx
+
+    latencies = []
+    statuses = {}
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(client, n: int):
+        async with gate:
+            started = time.perf_counter()
+            response = await client.post("/login", data={"username": f"user{n % users}", "password": "password"})
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://auth", timeout=None) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client, n) for n in range(requests)))
+        elapsed = time.perf_counter() - started
+    return latencies, statuses, elapsed
+
+
+async def warm_up(passwords, workers: int):
+    await asyncio.gather(*(passwords.verify_password("password", "password") for _ in range(workers)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default=",".join(str(n) for n in (1, 2, 4) if n <= (os.cpu_count() or 1)))
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=12)
+    args = parser.parse_args()
+
+    os.environ["AUTH_DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_auth.db')}"
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    import main as auth  # noqa: E402
+    import passwords  # noqa: E402
+
+    hashed = passwords._hash("password", args.rounds)
+    with auth.SessionLocal() as db:
+        db.add_all(auth.Client(username=f"user{n}", hashed_password=hashed) for n in range(args.users))
+        db.commit()
+
+    print(f"bcrypt rounds={args.rounds}, {args.requests} logins, concurrency {args.concurrency}")
+    for workers in (int(value) for value in args.workers.split(",")):
+        passwords.start(workers)
+        # Процеси пулу стартують при першому завданні — прогріваємо їх поза вимірюванням
+        asyncio.run(warm_up(passwords, workers))
+        latencies, statuses, elapsed = asyncio.run(storm(auth.app, args.users, args.requests, args.concurrency))
+        passwords.shutdown()
+        ok = statuses.get(200, 0)
+        print(f"workers={workers:<3} logins/s={ok / elapsed:7.1f}  p50={percentile(latencies, 50) * 1000:7.1f}ms "
+              f"p99={percentile(latencies, 99) * 1000:7.1f}ms  statuses={dict(sorted(statuses.items()))}")
+
+
+if __name__ == "__main__":
+    main()
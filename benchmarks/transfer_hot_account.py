@@ -0,0 +1,82 @@
+# Пропускна здатність переказів на "гарячий" рахунок отримувача.
+# Запуск: python benchmarks/transfer_hot_account.py --senders 200 --threads 16 --seconds 10
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "payment_service")]
+
+from sqlalchemy import insert  # noqa: E402
+
+from models import Account  # noqa: E402
+from common import migrations  # noqa: E402
+from common.db import create_engines  # noqa: E402
+import transfers  # noqa: E402
+
+
+def seed(engine, senders: int):
+    migrations.upgrade(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(Account.__table__), [{"id": 1, "owner_id": 0, "balance": 0.0, "blocked": False}] + [
+            {"id": i + 2, "owner_id": i + 1, "balance": 1_000_000.0, "blocked": False} for i in range(senders)
+        ])
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else (values[0] if values else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--senders", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench_payments.db")
+    engine, _ = create_engines(f"sqlite:///{path}", pool_size=args.threads)
+    seed(engine, args.senders)
+
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + args.seconds
+
+    def worker(index: int):
+        n = 0
+        while time.perf_counter() < deadline:
+            client_id = (index + n * args.threads) % args.senders + 1
+            n += 1
+            started = time.perf_counter()
+            try:
+                transfers.transfer(engine, client_id, 1, 1.0)
+            except Exception as exc:
+                errors.append(repr(exc))
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with engine.connect() as connection:
+        hot_balance = connection.exec_driver_sql("SELECT balance FROM accounts WHERE id = 1").scalar()
+
+    print(f"transfers:      {len(latencies)} in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s)")
+    print(f"latency ms:     p50={percentile(latencies, 50) * 1000:.2f} p95={percentile(latencies, 95) * 1000:.2f} "
+          f"p99={percentile(latencies, 99) * 1000:.2f}")
+    print(f"lock retries:   {transfers.stats['lock_retries']}")
+    print(f"errors:         {len(errors)}")
+    print(f"hot balance ok: {hot_balance == float(len(latencies))}")
+
+
+if __name__ == "__main__":
+    main()
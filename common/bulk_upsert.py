@@ -0,0 +1,48 @@
+from sqlalchemy import or_, select
+
+from common.db import insert_for
+
+BULK_UPSERT_CHUNK_SIZE = 500
+# Обмеження SQLite на кількість параметрів в одному запиті
+SQLITE_MAX_VARIABLES = 32766
+
+
+# Застосовує пачку реплікованих рядків: INSERT ... ON CONFLICT(id) DO UPDATE на кожен шматок.
+# update_columns обмежує, які колонки існуючих рядків можна перезаписувати.
+def bulk_upsert(db, model, rows, update_columns=None, chunk_size: int = BULK_UPSERT_CHUNK_SIZE) -> dict:
+    table = model.__table__
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+
+    # Останній запис для кожного id перемагає
+    latest = {}
+    for row in rows:
+        latest[row["id"]] = {key: value for key, value in row.items() if key in table.c}
+    if not latest:
+        return counts
+
+    columns = list(next(iter(latest.values())).keys())
+    update_columns = [c for c in (update_columns or columns) if c != "id" and c in columns]
+    chunk_size = max(1, min(chunk_size, SQLITE_MAX_VARIABLES // len(columns)))
+    values = [{column: row.get(column) for column in columns} for row in latest.values()]
+
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        ids = [row["id"] for row in chunk]
+        existing = set(db.execute(select(table.c.id).where(table.c.id.in_(ids))).scalars())
+
+        stmt = insert_for(db.get_bind())(table).values(chunk)
+        if update_columns:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.id],
+                set_={column: stmt.excluded[column] for column in update_columns},
+                # Рядки без змін не переписуються і не рахуються як оновлені
+                where=or_(*(table.c[column].is_distinct_from(stmt.excluded[column]) for column in update_columns)),
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=[table.c.id])
+        written = set(db.execute(stmt.returning(table.c.id)).scalars())
+
+        counts["inserted"] += len(written - existing)
+        counts["updated"] += len(written & existing)
+        counts["unchanged"] += len(existing - written)
+    return counts
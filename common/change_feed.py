@@ -0,0 +1,128 @@
+import json
+
+from fastapi import Response
+from pydantic_core import to_json
+from sqlalchemy import event, func, insert, inspect, select, text
+
+from models import ChangeEvent
+from common.schemas import AccountOut, ClientOut, CreditCardOut, PaymentOut
+
+CHANGE_FEED_MAX_LIMIT = 1000
+# Ключ advisory-блокування, яким у PostgreSQL впорядковується запис журналу
+CHANGE_FEED_LOCK_KEY = 7301
+# Колонки, що потрапляють у журнал змін: поля схем відповідей, тож hashed_password і cvv
+# не публікуються і не копіюються в репліки
+FEED_SCHEMAS = {"clients": ClientOut, "accounts": AccountOut, "credit_cards": CreditCardOut, "payments": PaymentOut}
+
+
+def row_to_dict(obj) -> dict:
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs}
+
+
+def feed_row(entity: str, row: dict) -> dict:
+    return {key: row[key] for key in FEED_SCHEMAS[entity].model_fields if key in row}
+
+
+# Колонки таблиці, яких немає в журналі змін
+def unpublished_columns(table) -> list:
+    return [column for column in table.c.keys() if column not in FEED_SCHEMAS[table.name].model_fields]
+
+
+DEFAULT_KINDS = {"insert": "created", "update": "updated", "delete": "deleted"}
+
+
+# PostgreSQL видає seq під час вставки, а не коміту: транзакція з меншим seq могла б закомітитися вже після
+# того, як читач журналу пройшов далі, і її подія загубилася б. Блокування до кінця транзакції робить порядок
+# комітів таким самим, як порядок seq. У SQLite записувач і так один.
+def _lock_feed(connection):
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": CHANGE_FEED_LOCK_KEY})
+
+
+def record_changes(connection, entity: str, rows, op: str, kind: str = None):
+    rows = list(rows)
+    if rows:
+        _lock_feed(connection)
+        connection.execute(insert(ChangeEvent), [
+            {"entity": entity, "entity_id": row["id"], "op": op, "kind": kind or DEFAULT_KINDS[op],
+             "payload": json.dumps(feed_row(entity, row), default=str)}
+            for row in rows
+        ])
+
+
+# Бізнес-тип наступних змін у сесії (наприклад, "topped_up") і додаткові поля події
+def mark_change(session, kind: str, **details):
+    session.info["change_kind"] = kind
+    session.info["change_details"] = details
+
+
+# Пише зміни вказаних моделей у change_events у тій самій транзакції, що й самі зміни
+def track_changes(session_factory, *models):
+    entities = {model: model.__tablename__ for model in models}
+
+    @event.listens_for(session_factory, "after_flush")
+    def _record_flushed_changes(session, flush_context):
+        kind = session.info.pop("change_kind", None)
+        details = session.info.pop("change_details", {})
+        changes = []
+        for op, objects in (("insert", session.new), ("update", session.dirty), ("delete", session.deleted)):
+            for obj in objects:
+                entity = entities.get(type(obj))
+                if entity is None or (op == "update" and not session.is_modified(obj)):
+                    continue
+                changes.append({"entity": entity, "entity_id": obj.id, "op": op, "kind": kind or DEFAULT_KINDS[op],
+                                "payload": json.dumps({**feed_row(entity, row_to_dict(obj)), **details}, default=str)})
+        if changes:
+            _lock_feed(session.connection())
+            session.connection().execute(insert(ChangeEvent), changes)
+
+
+# Рядки, що існували до появи журналу, публікуються один раз як вставки
+def backfill_changes(engine, *models):
+    with engine.begin() as connection:
+        for model in models:
+            entity = model.__tablename__
+            has_events = connection.execute(
+                select(func.count()).select_from(ChangeEvent).where(ChangeEvent.entity == entity)
+            ).scalar()
+            if has_events:
+                continue
+            rows = connection.execute(select(model.__table__).order_by(model.__table__.c.id)).mappings()
+            record_changes(connection, entity, (dict(row) for row in rows), "insert")
+
+
+def _read_events(db, entity: str, after: int, limit: int):
+    limit = max(1, min(limit, CHANGE_FEED_MAX_LIMIT))
+    events = db.execute(
+        select(ChangeEvent.seq, ChangeEvent.op, ChangeEvent.kind, ChangeEvent.entity_id, ChangeEvent.payload)
+        .where(ChangeEvent.entity == entity, ChangeEvent.seq > after)
+        .order_by(ChangeEvent.seq)
+        .limit(limit + 1)
+    ).all()
+    return events[:limit], len(events) > limit
+
+
+def read_changes(db, entity: str, after: int, limit: int) -> dict:
+    events, has_more = _read_events(db, entity, after, limit)
+    return {
+        "changes": [
+            {"seq": e.seq, "op": e.op, "kind": e.kind or DEFAULT_KINDS[e.op], "id": e.entity_id,
+             "data": None if e.op == "delete" else json.loads(e.payload)}
+            for e in events
+        ],
+        "next": events[-1].seq if events else after,
+        "has_more": has_more,
+    }
+
+
+# Та сама сторінка журналу відповіддю HTTP: payload уже збережено як JSON,
+# тому він вставляється в тіло як є, без json.loads і повторного кодування
+def changes_response(db, entity: str, after: int, limit: int) -> Response:
+    events, has_more = _read_events(db, entity, after, limit)
+    changes = b",".join(
+        to_json({"seq": e.seq, "op": e.op, "kind": e.kind or DEFAULT_KINDS[e.op], "id": e.entity_id})[:-1]
+        + b',"data":' + (b"null" if e.op == "delete" else e.payload.encode()) + b"}"
+        for e in events
+    )
+    tail = to_json({"next": events[-1].seq if events else after, "has_more": has_more})
+    return Response(b'{"changes":[' + changes + b"]," + tail[1:], media_type="application/json")
@@ -0,0 +1,153 @@
+import os
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+
+from common import query_profiler
+from common.tracing import instrument_engine
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Кеш скомпільованих запитів SQLAlchemy і підготовлених інструкцій asyncpg
+DB_QUERY_CACHE_SIZE = int(os.getenv("DB_QUERY_CACHE_SIZE", "1000"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+# Очікування BEGIN IMMEDIATE, довше за поріг, рахується як очікування блокування
+DB_LOCK_WAIT_THRESHOLD = float(os.getenv("DB_LOCK_WAIT_THRESHOLD", "0.005"))
+# SQLite: зайнята база; PostgreSQL: взаємне блокування
+LOCK_ERRORS = ("locked", "deadlock detected")
+
+SYNC_DRIVERS = {"sqlite": "sqlite", "postgresql": "postgresql+psycopg2"}
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+# Лічильники для бенчмарків і метрик
+stats = {"lock_waits": 0, "lock_wait_seconds": 0.0, "lock_errors": 0}
+
+
+# URL бази сервісу з <NAME>_DATABASE_URL, інакше локальний файл SQLite
+def database_url(name: str, default: str) -> str:
+    return os.getenv(f"{name}_DATABASE_URL", default)
+
+
+def _with_driver(url, drivers: dict):
+    url = make_url(url)
+    return url.set(drivername=drivers.get(url.get_backend_name(), url.drivername))
+
+
+def insert_for(bind):
+    # INSERT ... ON CONFLICT однаково записується для обох діалектів, але конструктор свій у кожного
+    return postgresql.insert if bind.dialect.name == "postgresql" else sqlite.insert
+
+
+# Транзакція, що одразу бере блокування на запис, щоб не ловити deadlock при апгрейді з читання
+@contextmanager
+def immediate_transaction(engine):
+    with engine.connect() as connection:
+        if connection.dialect.name == "sqlite":
+            started = time.perf_counter()
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            waited = time.perf_counter() - started
+            if waited > DB_LOCK_WAIT_THRESHOLD:
+                stats["lock_waits"] += 1
+                stats["lock_wait_seconds"] += waited
+        else:
+            # У PostgreSQL рядки блокують самі інструкції запису
+            connection.begin()
+        try:
+            yield connection
+        except BaseException:
+            connection.rollback()
+            raise
+        connection.commit()
+
+
+def _count_lock_errors(context):
+    if context.original_exception is not None and any(
+            error in str(context.original_exception) for error in LOCK_ERRORS):
+        stats["lock_errors"] += 1
+
+
+def _sqlite_pragmas(read_only: bool):
+    def apply(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        else:
+            # WAL: читачі не блокують запис і навпаки
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    return apply
+
+
+def _create_sqlite_engine(url, read_only: bool, pool_size: int):
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+        pool_size=pool_size,
+        max_overflow=DB_MAX_OVERFLOW,
+        query_cache_size=DB_QUERY_CACHE_SIZE,
+    )
+    event.listen(engine, "connect", _sqlite_pragmas(read_only))
+    event.listen(engine, "handle_error", _count_lock_errors)
+    return engine
+
+
+# Пара рушіїв: основний для запису і окремий пул лише для читання (списки, звірки)
+def create_engines(url: str, pool_size: int = DB_POOL_SIZE, read_pool_size: int = DB_READ_POOL_SIZE):
+    parsed = _with_driver(url, SYNC_DRIVERS)
+    if parsed.get_backend_name() != "sqlite":
+        engine = create_engine(parsed, pool_size=pool_size, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=True,
+                               pool_recycle=DB_POOL_RECYCLE, query_cache_size=DB_QUERY_CACHE_SIZE)
+        event.listen(engine, "handle_error", _count_lock_errors)
+        instrument_engine(engine, "primary")
+        query_profiler.attach(engine, "primary")
+        return engine, engine
+
+    if parsed.database in (None, "", ":memory:"):
+        engine = create_engine(parsed, connect_args={"check_same_thread": False})
+        instrument_engine(engine, "primary")
+        query_profiler.attach(engine, "primary")
+        return engine, engine
+
+    engine = _create_sqlite_engine(parsed, read_only=False, pool_size=pool_size)
+    read_url = f"sqlite:///file:{parsed.database}?mode=ro&uri=true"
+    read_engine = _create_sqlite_engine(read_url, read_only=True, pool_size=read_pool_size)
+    instrument_engine(engine, "primary")
+    query_profiler.attach(engine, "primary")
+    instrument_engine(read_engine, "read")
+    query_profiler.attach(read_engine, "read")
+    return engine, read_engine
+
+
+# Асинхронний рушій для того ж URL: aiosqlite локально, asyncpg для PostgreSQL
+def create_async_db_engine(url: str, pool_size: int = DB_POOL_SIZE):
+    # asyncio-розширення тягне greenlet, потрібний лише сервісам з асинхронними сесіями
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    parsed = _with_driver(url, ASYNC_DRIVERS)
+    if parsed.get_backend_name() == "sqlite":
+        engine = create_async_engine(parsed, connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+                                     pool_size=pool_size, max_overflow=DB_MAX_OVERFLOW,
+                                     query_cache_size=DB_QUERY_CACHE_SIZE)
+        event.listen(engine.sync_engine, "connect", _sqlite_pragmas(False))
+    else:
+        parsed = parsed.update_query_dict({"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)})
+        engine = create_async_engine(parsed, pool_size=pool_size, max_overflow=DB_MAX_OVERFLOW, pool_pre_ping=True,
+                                     pool_recycle=DB_POOL_RECYCLE, query_cache_size=DB_QUERY_CACHE_SIZE)
+    event.listen(engine.sync_engine, "handle_error", _count_lock_errors)
+    instrument_engine(engine.sync_engine, "async")
+    query_profiler.attach(engine.sync_engine, "async")
+    return engine
@@ -0,0 +1,157 @@
+import asyncio
+import os
+import random
+import re
+import time
+
+import httpx
+from fastapi import HTTPException
+
+from common import tracing
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "5"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "2"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.1"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state != "half-open":
+            return state == "closed"
+        # У стані half-open проходить рівно один пробний запит, решта відхиляються до його результату.
+        # Проба, що так і не повернула результат (скасований запит), не блокує наступну довше за reset_timeout.
+        now = time.monotonic()
+        if self.probe_started_at is not None and now - self.probe_started_at < self.reset_timeout:
+            return False
+        self.probe_started_at = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold or self.state == "half-open":
+            self.opened_at = time.monotonic()
+            self.probe_started_at = None
+
+
+# Ліміти окремого адресата перекривають загальні: AUTH_SERVICE_HTTP_TIMEOUT=10, PAYMENT_SERVICE_HTTP_RETRIES=0.
+# Префікс — ім'я клієнта у верхньому регістрі, де все, крім букв і цифр, замінено на "_"
+def target_setting(name: str, setting: str, default):
+    prefix = re.sub(r"[^0-9A-Za-z]+", "_", name).strip("_").upper()
+    value = os.getenv(f"{prefix}_HTTP_{setting}")
+    return default if value is None else type(default)(value)
+
+
+class ServiceClient:
+    def __init__(self, name: str, base_url: str, max_connections: int = None, max_keepalive: int = None,
+                 timeout: float = None, connect_timeout: float = None, retries: int = None):
+        self.name = name
+        self.base_url = base_url
+        max_connections = max_connections or target_setting(name, "MAX_CONNECTIONS", HTTP_MAX_CONNECTIONS)
+        max_keepalive = max_keepalive or target_setting(name, "MAX_KEEPALIVE", HTTP_MAX_KEEPALIVE)
+        timeout = timeout or target_setting(name, "TIMEOUT", HTTP_TIMEOUT)
+        connect_timeout = connect_timeout or target_setting(name, "CONNECT_TIMEOUT", HTTP_CONNECT_TIMEOUT)
+        self.retries = target_setting(name, "RETRIES", HTTP_RETRIES) if retries is None else retries
+        self.breaker = CircuitBreaker()
+        # Лічильники викликів для бенчмарків і метрик
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "rejected": 0}
+        self._limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self._timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.base_url, limits=self._limits, timeout=self._timeout)
+        return self._client
+
+    async def request(self, method: str, path: str, retry: bool = None, **kwargs) -> httpx.Response:
+        if not self.breaker.allow():
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=503, detail=f"{self.name} is unavailable")
+
+        retries = self.retries if (method.upper() in IDEMPOTENT_METHODS if retry is None else retry) else 0
+        self.stats["requests"] += 1
+        # Id трасування вхідного запиту йде далі, щоб сервіс-адресат записав той самий ланцюжок
+        kwargs["headers"] = {**tracing.trace_headers(), **(kwargs.get("headers") or {})}
+        for attempt in range(retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+            started = time.perf_counter()
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except httpx.TransportError as exc:
+                tracing.record_downstream(self.name, method.upper(), type(exc).__name__, time.perf_counter() - started)
+                self.stats["failures"] += 1
+                self.breaker.record_failure()
+                if attempt == retries or not self.breaker.allow():
+                    raise HTTPException(status_code=503, detail=f"{self.name} is unavailable")
+            else:
+                tracing.record_downstream(self.name, method.upper(), response.status_code, time.perf_counter() - started)
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    return response
+                self.stats["failures"] += 1
+                self.breaker.record_failure()
+                if attempt == retries or not self.breaker.allow():
+                    return response
+            # Експоненційна затримка з джитером, щоб повтори не йшли хвилею
+            await asyncio.sleep(HTTP_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_clients = {}
+
+
+def get_client(name: str, base_url: str) -> ServiceClient:
+    client = _clients.get(name)
+    if client is None:
+        client = _clients[name] = ServiceClient(name, base_url)
+    return client
+
+
+def client_stats() -> dict:
+    return {name: {**client.stats, "breaker": client.breaker.state} for name, client in _clients.items()}
+
+
+async def close_clients():
+    for client in _clients.values():
+        await client.aclose()
+
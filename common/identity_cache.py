@@ -0,0 +1,32 @@
+import hashlib
+import os
+
+from fastapi import HTTPException
+
+from common.cache import TTLCache
+from common.http_client import ServiceClient
+
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", "4096"))
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "60"))
+
+# Профілі з auth_service /identity, ключ — sha256 токена
+_identities = TTLCache(maxsize=IDENTITY_CACHE_SIZE, ttl=IDENTITY_CACHE_TTL)
+
+
+async def get_identity(token: str, auth_service: ServiceClient) -> dict:
+    cache_key = hashlib.sha256(token.encode()).digest()
+    identity = _identities.get(cache_key)
+    if identity is not None:
+        return identity
+
+    response = await auth_service.get("/identity", headers={"Authorization": f"Bearer {token}"})
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.json())
+
+    identity = response.json()
+    _identities.set(cache_key, identity)
+    return identity
+
+
+def invalidate_identity(username: str) -> int:
+    return _identities.pop_where(lambda identity: identity["username"] == username)
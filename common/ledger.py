@@ -0,0 +1,190 @@
+import asyncio
+import os
+import time
+import uuid
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import bindparam, insert, select, text, update
+
+from models import Account, AccountBalance, LedgerEntry
+from common.db import insert_for
+
+LEDGER_SNAPSHOT_INTERVAL = float(os.getenv("LEDGER_SNAPSHOT_INTERVAL", "300"))
+RECONCILE_MAX_MISMATCHES = 100
+
+# Системні рахунки для другої сторони проводок: гроші ззовні, початкові залишки, ручні коригування
+EXTERNAL_ACCOUNT_ID = -1
+OPENING_ACCOUNT_ID = -2
+ADJUSTMENT_ACCOUNT_ID = -3
+
+accounts = Account.__table__
+balances = AccountBalance.__table__
+entries = LedgerEntry.__table__
+
+
+class InsufficientFunds(Exception):
+    def __init__(self, account_id: int):
+        super().__init__(f"Insufficient funds on account {account_id}")
+        self.account_id = account_id
+
+
+def to_minor(amount: float) -> int:
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+# Сума в мінорних одиницях лише тоді, коли вона ціла: 0.001 не має тихо округлюватися до нуля
+def exact_minor(amount: float):
+    minor = Decimal(str(amount)) * 100
+    if not minor.is_finite() or minor != minor.to_integral_value():
+        return None
+    return int(minor)
+
+
+def from_minor(amount: int) -> float:
+    return amount / 100
+
+
+def _append(connection, transfer_id: str, legs, check_funds: bool) -> dict:
+    if sum(leg["amount"] for leg in legs) != 0:
+        raise ValueError("Transfer legs must balance to zero")
+
+    now = time.time()
+    entry_ids = connection.execute(
+        insert(entries).returning(entries.c.id),
+        [{"transfer_id": transfer_id, "account_id": leg["account_id"], "amount": leg["amount"],
+          "payment_id": leg.get("payment_id"), "created_at": now} for leg in legs],
+    ).scalars().all()
+
+    if not check_funds:
+        return _add_to_balances(connection, legs, entry_ids)
+
+    new_balances = {}
+    for leg, entry_id in zip(legs, entry_ids):
+        stmt = update(balances).where(balances.c.account_id == leg["account_id"])
+        # Клієнтський рахунок не може піти в мінус; системні рахунки — можуть
+        if leg["amount"] < 0 and leg["account_id"] > 0:
+            stmt = stmt.where(balances.c.balance >= -leg["amount"])
+        row = connection.execute(
+            stmt.values(balance=balances.c.balance + leg["amount"], last_entry_id=entry_id).returning(balances.c.balance)
+        ).first()
+        if row is None:
+            raise InsufficientFunds(leg["account_id"])
+        new_balances[leg["account_id"]] = row.balance
+    return new_balances
+
+
+# Без перевірки коштів рядки балансів не треба оновлювати по одному: сумарна зміна на рахунок
+# одним executemany і нові баланси одним запитом
+def _add_to_balances(connection, legs, entry_ids) -> dict:
+    deltas = {}
+    for leg, entry_id in zip(legs, entry_ids):
+        amount, _ = deltas.get(leg["account_id"], (0, 0))
+        deltas[leg["account_id"]] = (amount + leg["amount"], entry_id)
+    connection.execute(
+        update(balances).where(balances.c.account_id == bindparam("delta_account_id"))
+        .values(balance=balances.c.balance + bindparam("delta"), last_entry_id=bindparam("entry_id")),
+        [{"delta_account_id": account_id, "delta": amount, "entry_id": entry_id}
+         for account_id, (amount, entry_id) in deltas.items()],
+    )
+    return dict(connection.execute(
+        select(balances.c.account_id, balances.c.balance).where(balances.c.account_id.in_(deltas))
+    ).all())
+
+
+# Рахунки, що існували до журналу, відкриваються проводкою з поточним залишком. Рядок балансу вставляється
+# з ON CONFLICT DO NOTHING: з двох паралельних перших проводок рахунок відкриває лише та, чия вставка пройшла
+def open_accounts(connection, account_ids):
+    account_ids = set(account_ids) | {OPENING_ACCOUNT_ID}
+    stmt = insert_for(connection)(balances).values(
+        [{"account_id": account_id, "balance": 0, "last_entry_id": 0} for account_id in sorted(account_ids)])
+    opened = set(connection.execute(
+        stmt.on_conflict_do_nothing(index_elements=[balances.c.account_id]).returning(balances.c.account_id)
+    ).scalars())
+    if not opened - {OPENING_ACCOUNT_ID}:
+        return
+
+    opening = connection.execute(
+        select(accounts.c.id, accounts.c.balance).where(accounts.c.id.in_([i for i in opened if i > 0]))
+    ).all()
+    for account_id, balance in opening:
+        if balance:
+            _append(connection, f"opening-{account_id}", [
+                {"account_id": OPENING_ACCOUNT_ID, "amount": -to_minor(balance)},
+                {"account_id": account_id, "amount": to_minor(balance)},
+            ], check_funds=False)
+
+
+# Записує переказ у журнал і оновлює матеріалізовані баланси в поточній транзакції.
+# legs: [{"account_id", "amount" (мінорні одиниці), "payment_id"?}], списання йдуть першими.
+def post_transfer(connection, legs, transfer_id: str = None, check_funds: bool = True):
+    open_accounts(connection, {leg["account_id"] for leg in legs})
+    transfer_id = transfer_id or uuid.uuid4().hex
+    return transfer_id, _append(connection, transfer_id, legs, check_funds)
+
+
+# Дзеркалить матеріалізовані баланси у accounts.balance для сумісності API
+def mirror_balances(connection, new_balances: dict):
+    rows = [{"account_id": account_id, "new_balance": from_minor(balance)}
+            for account_id, balance in new_balances.items() if account_id > 0]
+    if rows:
+        connection.execute(
+            update(accounts).where(accounts.c.id == bindparam("account_id")).values(balance=bindparam("new_balance")),
+            rows,
+        )
+
+
+def balance_of(connection, account_id: int) -> int:
+    return connection.execute(select(balances.c.balance).where(balances.c.account_id == account_id)).scalar() or 0
+
+
+def take_snapshots(engine) -> int:
+    with engine.begin() as connection:
+        return connection.execute(text("""
+            INSERT INTO balance_snapshots (account_id, entry_id, balance, taken_at)
+            SELECT b.account_id, b.last_entry_id, b.balance, :now
+            FROM account_balances b
+            WHERE b.last_entry_id > COALESCE(
+                (SELECT MAX(s.entry_id) FROM balance_snapshots s WHERE s.account_id = b.account_id), 0)
+        """), {"now": time.time()}).rowcount
+
+
+# Звірка матеріалізованих балансів з журналом за один потоковий прохід.
+# Без full рахуються лише проводки після останнього знімка кожного рахунку.
+def reconcile(engine, full: bool = False) -> dict:
+    if full:
+        query = text("""
+            SELECT b.account_id, b.balance, COALESCE(j.total, 0) AS journal
+            FROM account_balances b
+            LEFT JOIN (SELECT account_id, SUM(amount) AS total FROM ledger_entries GROUP BY account_id) j
+                ON j.account_id = b.account_id
+        """)
+    else:
+        query = text("""
+            SELECT b.account_id, b.balance,
+                   COALESCE(s.balance, 0) + COALESCE(
+                       (SELECT SUM(e.amount) FROM ledger_entries e
+                        WHERE e.account_id = b.account_id AND e.id > COALESCE(s.entry_id, 0)), 0) AS journal
+            FROM account_balances b
+            LEFT JOIN balance_snapshots s ON s.id = (
+                SELECT MAX(id) FROM balance_snapshots WHERE account_id = b.account_id)
+        """)
+
+    checked = 0
+    mismatches = []
+    with engine.connect() as connection:
+        for row in connection.execution_options(stream_results=True).execute(query):
+            checked += 1
+            if row.balance != row.journal and len(mismatches) < RECONCILE_MAX_MISMATCHES:
+                mismatches.append({"account_id": row.account_id, "materialized": row.balance, "journal": row.journal})
+        unbalanced = connection.execute(text(
+            "SELECT transfer_id FROM ledger_entries GROUP BY transfer_id HAVING SUM(amount) != 0 LIMIT :limit"
+        ), {"limit": RECONCILE_MAX_MISMATCHES}).scalars().all() if full else []
+
+    return {"checked": checked, "mismatches": mismatches, "unbalanced_transfers": unbalanced,
+            "ok": not mismatches and not unbalanced}
+
+
+async def run_snapshots(engine, interval: float = LEDGER_SNAPSHOT_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(take_snapshots, engine)
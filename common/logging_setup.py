@@ -0,0 +1,150 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from common import tracing
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Частка DEBUG-записів, що доходять до виводу; решта відкидається ще до черги
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+# httpx пише кожен виклик між сервісами на INFO
+LOG_LIBRARY_LEVEL = os.getenv("LOG_LIBRARY_LEVEL", "WARNING").upper()
+NOISY_LOGGERS = ("httpx", "httpcore", "asyncio")
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s"
+
+REDACTED = "[REDACTED]"
+REDACT_KEYS = {"token", "access_token", "refresh_token", "authorization", "password", "new_password",
+               "hashed_password", "secret", "admin_secret", "cvv", "new_cvv"}
+_KEYS = "|".join(sorted(REDACT_KEYS, key=len, reverse=True))
+_JWT = re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]*")
+_BEARER = re.compile(r"(?i)(bearer\s+)\S+")
+# token=..., 'cvv': '123', "password": "..." у рядках запитів і repr словників
+_PAIR = re.compile(rf"""(?i)(["']?\b(?:{_KEYS})\b["']?\s*[:=]\s*)(["']?)[^"'&\s,}}]+\2""")
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "trace_id"}
+
+# Лічильники для бенчмарків і метрик
+stats = {"dropped": 0, "sampled_out": 0}
+
+_listener = None
+
+
+def redact_text(text: str) -> str:
+    text = _JWT.sub(REDACTED, text)
+    text = _BEARER.sub(r"\1" + REDACTED, text)
+    return _PAIR.sub(lambda match: match.group(1) + match.group(2) + REDACTED + match.group(2), text)
+
+
+def redact(value, key: str = None):
+    if key is not None and key.lower() in REDACT_KEYS:
+        return REDACTED
+    if isinstance(value, dict):
+        return {name: redact(item, str(name)) for name, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, str):
+        return redact_text(value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "service": self.service,
+            "logger": record.name,
+            "message": redact_text(record.getMessage()),
+        }
+        trace_id = getattr(record, "trace_id", "-")
+        if trace_id != "-":
+            entry["trace_id"] = trace_id
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS:
+                entry[key] = redact(value, key)
+        if record.exc_text:
+            entry["exc"] = redact_text(record.exc_text)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RedactingFilter(logging.Filter):
+    # Для чужих логерів (uvicorn.access пише шлях разом із ?token=...)
+    def filter(self, record) -> bool:
+        record.msg = redact_text(record.getMessage())
+        record.args = None
+        if record.exc_text:
+            record.exc_text = redact_text(record.exc_text)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1 or random.random() < self.rate:
+            return True
+        stats["sampled_out"] += 1
+        return False
+
+
+# Запис лише кладеться в чергу; форматування і вивід — у потоці QueueListener.
+# Переповнена черга не блокує запит: запис відкидається і рахується.
+class NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Контекст запиту (id трасування) і текст винятку фіксуються в потоці, що пише запис
+        record.trace_id = tracing.current_trace_id() or "-"
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            stats["dropped"] += 1
+
+
+# Налаштування кореневого логера сервісу; повторний виклик нічого не змінює
+def configure(service: str):
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter(service))
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+        formatter.converter = time.gmtime
+        output.setFormatter(formatter)
+        output.addFilter(RedactingFilter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(SamplingFilter(LOG_DEBUG_SAMPLE_RATE))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    logging.getLogger("uvicorn.access").addFilter(RedactingFilter())
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(LOG_LIBRARY_LEVEL)
+
+    _listener = QueueListener(handler.queue, output)
+    _listener.start()
+    atexit.register(_listener.stop)
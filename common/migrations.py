@@ -0,0 +1,191 @@
+import json
+import logging
+import re
+import time
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, bindparam, inspect, insert, select, text, update
+
+from models import (Account, Base, ChangeEvent, CreditCard, IdempotencyKey, Payment, PaymentSummary, RefreshToken,
+                    RevokedToken)
+from common.change_feed import FEED_SCHEMAS, feed_row, unpublished_columns
+from common.db import immediate_transaction
+
+logger = logging.getLogger(__name__)
+
+# Таблиця версій живе поза Base, щоб схема моделей її не створювала і не змінювала
+schema_version = Table(
+    "schema_version", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String),
+    Column("applied_at", Float),
+)
+
+
+def _index(model, name: str):
+    return next((index for index in model.__table__.indexes if index.name == name), None)
+
+
+def _baseline(connection):
+    Base.metadata.create_all(connection)
+
+
+def _hot_path_indexes(connection):
+    for model, name in (
+        (Account, "ix_accounts_owner_id"),
+        (Payment, "ix_payments_account_id_id"),
+        (CreditCard, "ix_credit_cards_account_id"),
+        (ChangeEvent, "ix_change_events_entity_seq"),
+    ):
+        index = _index(model, name)
+        # Індекси, замінені пізнішими міграціями, у моделях вже не оголошені
+        if index is not None:
+            index.create(connection, checkfirst=True)
+
+
+def _payment_history(connection):
+    payments = Payment.__table__
+    if "created_at" not in {column["name"] for column in inspect(connection).get_columns(payments.name)}:
+        column_type = payments.c.created_at.type.compile(connection.dialect)
+        connection.exec_driver_sql(f"ALTER TABLE payments ADD COLUMN created_at {column_type}")
+    # Час старих платежів беремо з їхніх проводок у журналі, а без проводок — час міграції, щоб вони
+    # не потрапляли в підсумок за 1970-01
+    connection.execute(text("""
+        UPDATE payments SET created_at = COALESCE(
+            (SELECT MIN(e.created_at) FROM ledger_entries e WHERE e.payment_id = payments.id), :migrated_at)
+        WHERE created_at IS NULL
+    """), {"migrated_at": time.time()})
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_payments_account_id_id")
+    _index(Payment, "ix_payments_account_created").create(connection, checkfirst=True)
+
+    PaymentSummary.__table__.create(connection, checkfirst=True)
+    if connection.dialect.name == "postgresql":
+        period = "to_char(to_timestamp(created_at) AT TIME ZONE 'UTC', 'YYYY-MM')"
+    else:
+        period = "strftime('%Y-%m', created_at, 'unixepoch')"
+    connection.exec_driver_sql(f"""
+        INSERT INTO payment_summaries (account_id, period, count, total_in, total_out)
+        SELECT account_id, {period}, COUNT(*),
+               SUM(CASE WHEN amount > 0 THEN amount ELSE 0 END),
+               SUM(CASE WHEN amount < 0 THEN -amount ELSE 0 END)
+        FROM payments
+        WHERE account_id IS NOT NULL
+        GROUP BY account_id, {period}
+    """)
+
+
+def _token_revocation(connection):
+    Base.metadata.create_all(connection, tables=[RefreshToken.__table__, RevokedToken.__table__])
+
+
+# Події, записані до обмеження колонок журналу, містили hashed_password і cvv
+def _redact_change_feed(connection):
+    events = ChangeEvent.__table__
+    entities = [entity for entity in FEED_SCHEMAS if unpublished_columns(Base.metadata.tables[entity])]
+    rows = connection.execute(
+        select(events.c.seq, events.c.entity, events.c.payload)
+        .where(events.c.entity.in_(entities), events.c.payload.is_not(None))
+    ).all()
+    redacted = []
+    for seq, entity, payload in rows:
+        data = json.loads(payload)
+        published = feed_row(entity, data)
+        if published != data:
+            redacted.append({"event_seq": seq, "new_payload": json.dumps(published, default=str)})
+    if redacted:
+        connection.execute(update(events).where(events.c.seq == bindparam("event_seq"))
+                           .values(payload=bindparam("new_payload")), redacted)
+
+
+# Посилання між таблицями сервісів більше не створюються як обмеження (models.replica_reference),
+# тож у вже створених базах їх знімаємо; SQLite без PRAGMA foreign_keys їх і не перевіряв
+def _drop_replica_foreign_keys(connection):
+    if connection.dialect.name == "sqlite":
+        return
+    inspector = inspect(connection)
+    for table in (Account.__table__, CreditCard.__table__, Payment.__table__):
+        for foreign_key in inspector.get_foreign_keys(table.name):
+            connection.exec_driver_sql(f'ALTER TABLE {table.name} DROP CONSTRAINT "{foreign_key["name"]}"')
+
+
+# Ключі, збережені до цієї міграції, лишаються без хешу і повторюються без перевірки параметрів
+def _idempotency_request_hash(connection):
+    keys = IdempotencyKey.__table__
+    if "request_hash" not in {column["name"] for column in inspect(connection).get_columns(keys.name)}:
+        column_type = keys.c.request_hash.type.compile(connection.dialect)
+        connection.exec_driver_sql(f"ALTER TABLE {keys.name} ADD COLUMN request_hash {column_type}")
+
+
+# Міграції застосовуються по порядку і лише раз; нові додаються в кінець
+MIGRATIONS = (
+    (1, "baseline", _baseline),
+    (2, "hot_path_indexes", _hot_path_indexes),
+    (3, "payment_history", _payment_history),
+    (4, "token_revocation", _token_revocation),
+    (5, "redact_change_feed", _redact_change_feed),
+    (6, "drop_replica_foreign_keys", _drop_replica_foreign_keys),
+    (7, "idempotency_request_hash", _idempotency_request_hash),
+)
+
+
+def current_version(connection) -> int:
+    if not inspect(connection).has_table(schema_version.name):
+        return 0
+    return connection.execute(select(schema_version.c.version).order_by(schema_version.c.version.desc())).scalar() or 0
+
+
+def upgrade(engine) -> int:
+    # Під блокуванням на запис, щоб кілька екземплярів сервісу не застосували ту саму міграцію двічі
+    with immediate_transaction(engine) as connection:
+        schema_version.create(connection, checkfirst=True)
+        applied = set(connection.execute(select(schema_version.c.version)).scalars())
+        for version, name, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            migrate(connection)
+            connection.execute(insert(schema_version).values(version=version, name=name, applied_at=time.time()))
+            logger.info("Applied migration %s: %s", version, name)
+    return MIGRATIONS[-1][0]
+
+
+# Запити гарячих шляхів, план яких перевіряється під час старту
+CRITICAL_QUERIES = {
+    "client_account": select(Account.id).where(Account.owner_id == 1).limit(1),
+    "payment_history": select(Payment.id).join(Account).where(Account.owner_id == 1),
+    "payments_page": select(Payment.id, Payment.amount).where(Payment.account_id == 1, Payment.created_at >= 0)
+    .order_by(Payment.created_at, Payment.id).limit(100),
+    "payment_summary": select(PaymentSummary.period).where(PaymentSummary.account_id == 1, PaymentSummary.period >= "2024-01"),
+    "client_cards": select(CreditCard.id).join(Account).where(Account.owner_id == 1),
+    "change_feed": select(ChangeEvent.seq).where(ChangeEvent.entity == "accounts", ChangeEvent.seq > 0)
+    .order_by(ChangeEvent.seq).limit(500),
+}
+FULL_SCAN = re.compile(r"^SCAN \w+$|Seq Scan")
+
+
+def missing_indexes(connection) -> list:
+    inspector = inspect(connection)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing += [f"{table.name}.{index.name}" for index in table.indexes if index.name not in existing]
+    return missing
+
+
+def explain(connection, query) -> list:
+    sql = str(query.compile(connection, compile_kwargs={"literal_binds": True}))
+    if connection.dialect.name == "sqlite":
+        return [row[3] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+    return [row[0] for row in connection.exec_driver_sql(f"EXPLAIN {sql}")]
+
+
+# Звіт про відсутні індекси і повні проходи таблиць у критичних запитах
+def check_schema(engine) -> dict:
+    with engine.connect() as connection:
+        missing = missing_indexes(connection)
+        plans = {name: explain(connection, query) for name, query in CRITICAL_QUERIES.items()}
+
+    full_scans = sorted(name for name, plan in plans.items() if any(FULL_SCAN.search(step.strip()) for step in plan))
+    for index in missing:
+        logger.warning("Schema check: missing index %s", index)
+    for name in full_scans:
+        logger.warning("Schema check: %s scans a whole table: %s", name, plans[name])
+    return {"missing_indexes": missing, "full_scans": full_scans, "plans": plans}
@@ -0,0 +1,95 @@
+import asyncio
+import os
+
+from fastapi import HTTPException
+
+from common import http_client
+from common.change_feed import read_changes
+from common.token_verifier import create_service_token
+from models import SyncWatermark
+
+OUTBOX_INTERVAL = float(os.getenv("OUTBOX_INTERVAL", "1"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+
+
+# Доставляє події з change_events підписникам; позиція кожного підписника зберігається в sync_watermarks,
+# тому після перезапуску доставка продовжується з місця зупинки (at-least-once)
+class OutboxDispatcher:
+    def __init__(self, session_factory, entity: str, subscribers, path: str, service_name: str,
+                 interval: float = OUTBOX_INTERVAL):
+        self.session_factory = session_factory
+        self.entity = entity
+        self.subscribers = [subscriber for subscriber in subscribers if subscriber]
+        self.path = path
+        self.service_name = service_name
+        self.interval = interval
+        self.status = {subscriber: {"seq": 0, "delivered": 0, "last_error": None} for subscriber in self.subscribers}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def _read_batch(self, source: str):
+        db = self.session_factory()
+        try:
+            watermark = db.get(SyncWatermark, source)
+            return read_changes(db, self.entity, watermark.seq if watermark else 0, OUTBOX_BATCH_SIZE)
+        finally:
+            db.close()
+
+    def _advance(self, source: str, seq: int):
+        db = self.session_factory()
+        try:
+            watermark = db.get(SyncWatermark, source) or SyncWatermark(source=source, seq=0)
+            watermark.seq = seq
+            db.add(watermark)
+            db.commit()
+        finally:
+            db.close()
+
+    async def deliver(self, subscriber: str):
+        source = f"outbox:{self.entity}:{subscriber}"
+        client = http_client.get_client(subscriber, subscriber)
+        while True:
+            batch = await asyncio.to_thread(self._read_batch, source)
+            if not batch["changes"]:
+                return
+            response = await client.post(self.path, json={"events": batch["changes"]},
+                                         params={"token": create_service_token(self.service_name)}, retry=True)
+            if response.status_code >= 300:
+                raise HTTPException(status_code=response.status_code, detail=response.text)
+            await asyncio.to_thread(self._advance, source, batch["next"])
+            self.status[subscriber]["seq"] = batch["next"]
+            self.status[subscriber]["delivered"] += len(batch["changes"])
+            if not batch["has_more"]:
+                return
+
+    async def dispatch_once(self):
+        for subscriber in self.subscribers:
+            try:
+                await self.deliver(subscriber)
+            except Exception as exc:
+                self.status[subscriber]["last_error"] = getattr(exc, "detail", str(exc))
+            else:
+                self.status[subscriber]["last_error"] = None
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            await self.dispatch_once()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
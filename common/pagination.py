@@ -0,0 +1,39 @@
+from fastapi.responses import StreamingResponse
+from pydantic_core import to_json
+
+from common.change_feed import row_to_dict
+
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 1000
+STREAM_BATCH_SIZE = 500
+
+
+def keyset_page(query, model, after_id: int, limit: int):
+    limit = max(1, min(limit, PAGE_SIZE_MAX))
+    return query.filter(model.id > after_id).order_by(model.id).limit(limit).all()
+
+
+# Запити за колонками повертають Row, запити за моделлю — ORM-об'єкти
+def _as_dict(row) -> dict:
+    return row._asdict() if hasattr(row, "_asdict") else row_to_dict(row)
+
+
+# Потокова видача NDJSON: рядки читаються пачками і одразу пишуться у відповідь.
+# Сесія належить генератору, бо залежність get_db закривається раніше за відповідь.
+def stream_ndjson(session_factory, build_query, serialize=_as_dict):
+    def generate():
+        db = session_factory()
+        try:
+            for row in build_query(db).yield_per(STREAM_BATCH_SIZE):
+                yield to_json(serialize(row), fallback=str) + b"\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+def list_rows(session_factory, db, build_query, model, after_id: int = 0, limit: int = PAGE_SIZE_DEFAULT,
+              stream: bool = False):
+    if stream:
+        return stream_ndjson(session_factory, lambda session: build_query(session).filter(model.id > after_id).order_by(model.id))
+    return keyset_page(build_query(db), model, after_id, limit)
@@ -0,0 +1,148 @@
+import functools
+import logging
+import os
+import re
+import threading
+import time
+
+from sqlalchemy import event
+
+from common import tracing
+
+QUERY_PROFILER_ENABLED = os.getenv("QUERY_PROFILER_ENABLED", "true").lower() not in ("0", "false", "no")
+SLOW_QUERY_THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD", "0.1"))
+# Скільки однакових запитів за один вхідний запит вважається N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+QUERY_PROFILE_MAX_FINGERPRINTS = int(os.getenv("QUERY_PROFILE_MAX_FINGERPRINTS", "1000"))
+# Драйвери, на з'єднанні яких можна синхронно виконати EXPLAIN з тими самими параметрами, і які інструкції
+# пояснювати: невдалий EXPLAIN у PostgreSQL зірвав би поточну транзакцію, тому там лише читання
+EXPLAIN_DRIVERS = {
+    "pysqlite": ("EXPLAIN QUERY PLAN ", ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")),
+    "psycopg2": ("EXPLAIN ", ("SELECT", "WITH")),
+}
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"\?|%\(\w+\)s|\$\d+|:\w+")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+
+_lock = threading.Lock()
+_fingerprints = {}
+_n_plus_one = {}
+
+
+# Текст запиту без значень: однакові за формою запити з різними параметрами збігаються
+@functools.lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+    text = _STRING.sub("?", statement)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _IN_LIST.sub("(?+)", text)
+    return _SPACE.sub(" ", text).strip()
+
+
+def _explain(cursor, context, statement: str, parameters) -> list:
+    prefix, verbs = EXPLAIN_DRIVERS.get(context.dialect.driver, (None, ())) if context is not None else (None, ())
+    if prefix is None or not statement.lstrip().upper().startswith(verbs):
+        return None
+    if context.executemany and parameters:
+        parameters = parameters[0]
+    # Окремий курсор того ж з'єднання: результати основного ще не прочитані
+    explain_cursor = cursor.connection.cursor()
+    try:
+        explain_cursor.execute(prefix + statement, parameters or ())
+        rows = explain_cursor.fetchall()
+    except Exception as exc:
+        return [f"EXPLAIN failed: {exc}"]
+    finally:
+        explain_cursor.close()
+    return [row[3] if context.dialect.driver == "pysqlite" else row[0] for row in rows]
+
+
+def _record(engine_name: str, statement: str, seconds: float, cursor, context, parameters):
+    key = (engine_name, fingerprint(statement))
+    slow = seconds >= SLOW_QUERY_THRESHOLD
+    with _lock:
+        entry = _fingerprints.get(key)
+        if entry is None:
+            if len(_fingerprints) >= QUERY_PROFILE_MAX_FINGERPRINTS:
+                return
+            entry = _fingerprints[key] = {"count": 0, "total": 0.0, "max": 0.0, "slow": 0, "plan": None}
+        entry["count"] += 1
+        entry["total"] += seconds
+        entry["max"] = max(entry["max"], seconds)
+        if slow:
+            entry["slow"] += 1
+        explain = slow and entry["plan"] is None
+        if explain:
+            entry["plan"] = []
+
+    if slow:
+        if explain:
+            # План знімається один раз на відбиток, а не на кожен повільний запит
+            entry["plan"] = _explain(cursor, context, statement, parameters)
+        logger.warning("Slow query on %s engine took %.1f ms: %s", engine_name, seconds * 1000, key[1],
+                       extra={"plan": entry["plan"]})
+
+    trace = tracing.current_trace()
+    if trace is not None:
+        count = trace.count_query(key[1])
+        if count >= N_PLUS_ONE_THRESHOLD:
+            _flag_n_plus_one(trace.route, key[1], count)
+
+
+def _flag_n_plus_one(route: str, query: str, count: int):
+    with _lock:
+        entry = _n_plus_one.get((route, query))
+        first = entry is None
+        if first:
+            entry = _n_plus_one[(route, query)] = {"requests": 0, "max_per_request": 0}
+        if count == N_PLUS_ONE_THRESHOLD:
+            entry["requests"] += 1
+        entry["max_per_request"] = max(entry["max_per_request"], count)
+    if first:
+        logger.warning("Possible N+1 query in %s, repeated %d times: %s", route, count, query)
+
+
+# Профілювання всіх інструкцій рушія; для асинхронного рушія — його sync_engine
+def attach(engine, name: str = "db"):
+    if not QUERY_PROFILER_ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["profile_started"].pop()
+        _record(name, statement, seconds, cursor, context, parameters)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("profile_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+def report(limit: int = 50, sort: str = "total") -> dict:
+    with _lock:
+        rows = [{"engine": engine_name, "fingerprint": query, "count": entry["count"],
+                 "total_ms": round(entry["total"] * 1000, 2), "avg_ms": round(entry["total"] / entry["count"] * 1000, 3),
+                 "max_ms": round(entry["max"] * 1000, 2), "slow": entry["slow"], "plan": entry["plan"]}
+                for (engine_name, query), entry in _fingerprints.items()]
+        n_plus_one = [{"route": route, "fingerprint": query, **entry} for (route, query), entry in _n_plus_one.items()]
+    key = {"total": "total_ms", "count": "count", "avg": "avg_ms", "max": "max_ms", "slow": "slow"}.get(sort, "total_ms")
+    rows.sort(key=lambda row: row[key], reverse=True)
+    n_plus_one.sort(key=lambda row: row["max_per_request"], reverse=True)
+    return {"fingerprints": rows[:limit], "n_plus_one": n_plus_one[:limit], "tracked": len(rows),
+            "slow_query_threshold_ms": SLOW_QUERY_THRESHOLD * 1000, "n_plus_one_threshold": N_PLUS_ONE_THRESHOLD}
+
+
+def reset():
+    with _lock:
+        _fingerprints.clear()
+        _n_plus_one.clear()
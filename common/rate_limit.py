@@ -0,0 +1,170 @@
+import asyncio
+import json
+import math
+import os
+import time
+from urllib.parse import parse_qs
+
+from fastapi import HTTPException
+
+from common.cache import TTLCache
+from common.token_verifier import verify_token
+
+
+def _limit(spec: str):
+    # "rate:burst" — токенів за секунду і розмір відра; порожньо — без обмеження
+    if not spec:
+        return None
+    rate, _, burst = spec.partition(":")
+    return float(rate), float(burst or rate)
+
+
+RATE_LIMIT_GLOBAL = _limit(os.getenv("RATE_LIMIT_GLOBAL", "2000:4000"))
+RATE_LIMIT_CLIENT = _limit(os.getenv("RATE_LIMIT_CLIENT", "50:100"))
+# Квоти вимикаються для навантажувальних тестів; обмеження паралельності й скидання навантаження лишаються
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() not in ("0", "false", "no")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Скидання навантаження: забагато запитів у роботі або надто висока середня затримка
+SHED_MAX_IN_FLIGHT = int(os.getenv("SHED_MAX_IN_FLIGHT", "256"))
+SHED_LATENCY = float(os.getenv("SHED_LATENCY", "2.0"))
+SHED_MIN_IN_FLIGHT = int(os.getenv("SHED_MIN_IN_FLIGHT", "16"))
+CONCURRENCY_QUEUE_TIMEOUT = float(os.getenv("CONCURRENCY_QUEUE_TIMEOUT", "1.0"))
+LATENCY_SMOOTHING = 0.1
+
+# Лічильники для бенчмарків і метрик
+stats = {"limited": 0, "shed": 0, "concurrency_rejected": 0}
+
+
+# Відра в пам'яті процесу; запис зникає, коли відро встигло б наповнитися повністю
+class MemoryStore:
+    def __init__(self, maxsize: int = RATE_LIMIT_MAX_KEYS):
+        self._buckets = TTLCache(maxsize=maxsize, ttl=3600)
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key) or (burst, now)
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            self._buckets.set(key, (tokens, now), expires_at=time.time() + burst / rate)
+            return (1 - tokens) / rate
+        self._buckets.set(key, (tokens - 1, now), expires_at=time.time() + burst / rate)
+        return 0.0
+
+
+# Спільні відра в Redis для кількох екземплярів сервісу; оновлення атомарне через Lua-скрипт
+class RedisStore:
+    SCRIPT = """
+    local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = math.min(burst, (tonumber(state[1]) or burst) + (now - (tonumber(state[2]) or now)) * rate)
+    local wait = 0
+    if tokens < 1 then wait = (1 - tokens) / rate else tokens = tokens - 1 end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+    return tostring(wait)
+    """
+
+    def __init__(self, url: str):
+        # Redis потрібен лише з RATE_LIMIT_REDIS_URL
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._script = self._redis.register_script(self.SCRIPT)
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        return float(await self._script(keys=[f"ratelimit:{key}"], args=[rate, burst, time.time()]))
+
+
+def default_store():
+    return RedisStore(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else MemoryStore()
+
+
+# ASGI-посередник: глобальне відро, відро клієнта, відра клієнта на окремих маршрутах,
+# обмеження паралельності дорогих маршрутів і скидання навантаження.
+# routes і concurrency — словники з ключами "МЕТОД /шлях".
+class RateLimitMiddleware:
+    def __init__(self, app, routes: dict = None, concurrency: dict = None, store=None,
+                 global_limit=RATE_LIMIT_GLOBAL, client_limit=RATE_LIMIT_CLIENT):
+        self.app = app
+        self.routes = routes or {}
+        self.concurrency = {route: asyncio.Semaphore(limit) for route, limit in (concurrency or {}).items()}
+        self.store = store or default_store()
+        self.global_limit = global_limit
+        self.client_limit = client_limit
+        self.in_flight = 0
+        self.latency = 0.0
+
+    def _client(self, scope) -> str:
+        token = parse_qs(scope.get("query_string", b"").decode()).get("token", [None])[0]
+        if token is None:
+            for name, value in scope.get("headers", ()):
+                if name == b"authorization" and value[:7].lower() == b"bearer ":
+                    token = value[7:].decode()
+        if token:
+            try:
+                identity = verify_token(token)
+                return f"{identity['role']}:{identity['username']}"
+            except HTTPException:
+                pass
+        # Без чинного токена — за адресою клієнта
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    async def _reject(self, send, status: int, detail: str, retry_after: float):
+        body = json.dumps({"detail": detail}).encode()
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _check_limits(self, route: str, client: str) -> float:
+        # Від найвужчого відра до спільного, щоб клієнт понад квоту не витрачав глобальне
+        checks = [(f"client:{client}", self.client_limit), ("global", self.global_limit)]
+        if route in self.routes:
+            checks.insert(0, (f"route:{route}:{client}", self.routes[route]))
+        for key, limit in checks:
+            if limit is None:
+                continue
+            wait = await self.store.take(key, *limit)
+            if wait > 0:
+                return wait
+        return 0.0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        if self.in_flight >= SHED_MAX_IN_FLIGHT or (
+                self.latency > SHED_LATENCY and self.in_flight >= SHED_MIN_IN_FLIGHT):
+            stats["shed"] += 1
+            return await self._reject(send, 503, "Service overloaded", 1)
+
+        route = f"{scope['method']} {scope['path']}"
+        client = self._client(scope)
+        # Службові виклики між сервісами не обмежуються квотами клієнтів
+        if RATE_LIMIT_ENABLED and not client.startswith("service:"):
+            wait = await self._check_limits(route, client)
+            if wait > 0:
+                stats["limited"] += 1
+                return await self._reject(send, 429, "Too many requests", wait)
+
+        slots = self.concurrency.get(route)
+        if slots is not None:
+            try:
+                await asyncio.wait_for(slots.acquire(), CONCURRENCY_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                stats["concurrency_rejected"] += 1
+                return await self._reject(send, 503, "Too many concurrent requests", 1)
+
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+            self.latency += (time.perf_counter() - started - self.latency) * LATENCY_SMOOTHING
+            if slots is not None:
+                slots.release()
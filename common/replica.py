@@ -0,0 +1,43 @@
+from sqlalchemy import delete, select
+
+from models import ReplicaVersion
+from common.bulk_upsert import bulk_upsert
+from common.db import insert_for
+
+versions = ReplicaVersion.__table__
+
+
+# Застосовує пачку подій реплікації: подія з версією (seq), не новішою за застосовану, пропускається,
+# тож повторна доставка нічого не змінює. Для кожного id лишається остання подія, і всі рядки
+# записуються кількома запитами на пачку, а не запитом на подію.
+# merge отримує нові події рядків, що вже були в репліці, — для змін, яких немає в останньому стані
+# рядка (суми поповнень); нові рядки приходять із повним станом.
+def apply_events(db, model, events, update_columns=None, merge=None) -> int:
+    entity = model.__tablename__
+    table = model.__table__
+    applied_versions = dict(db.execute(
+        select(versions.c.entity_id, versions.c.version)
+        .where(versions.c.entity == entity, versions.c.entity_id.in_({event["id"] for event in events}))
+    ).all())
+    fresh = sorted((event for event in events if event["seq"] > applied_versions.get(event["id"], 0)),
+                   key=lambda event: event["seq"])
+    if not fresh:
+        return 0
+
+    latest = {event["id"]: event for event in fresh}
+    existing = set(db.execute(select(table.c.id).where(table.c.id.in_(latest))).scalars())
+    if merge is not None:
+        merge(db, [event for event in fresh if event["id"] in existing])
+
+    deleted = [id_ for id_, event in latest.items() if event["op"] == "delete"]
+    if deleted:
+        db.execute(delete(table).where(table.c.id.in_(deleted)))
+    bulk_upsert(db, model, [event["data"] for event in latest.values() if event["op"] != "delete"],
+                update_columns=update_columns)
+
+    stmt = insert_for(db.get_bind())(versions).values(
+        [{"entity": entity, "entity_id": id_, "version": event["seq"]} for id_, event in latest.items()])
+    db.execute(stmt.on_conflict_do_update(index_elements=[versions.c.entity, versions.c.entity_id],
+                                          set_={"version": stmt.excluded.version}))
+    db.commit()
+    return len(fresh)
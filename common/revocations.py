@@ -0,0 +1,63 @@
+import asyncio
+import os
+import time
+
+from fastapi import HTTPException
+
+from common import http_client
+from common.token_verifier import create_service_token, prune_revoked, revoke
+
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", "5"))
+REVOCATION_PAGE_SIZE = int(os.getenv("REVOCATION_PAGE_SIZE", "1000"))
+
+
+# Фонове копіювання списку відкликаних токенів з auth_service у локальний набір token_verifier
+class RevocationSync:
+    def __init__(self, auth_service: http_client.ServiceClient, service_name: str,
+                 interval: float = REVOCATION_SYNC_INTERVAL):
+        self.auth_service = auth_service
+        self.service_name = service_name
+        self.interval = interval
+        self.status = {"after": 0, "revoked": 0, "last_success": None, "last_error": None}
+        self._task = None
+
+    async def sync_once(self):
+        token = create_service_token(self.service_name)
+        while True:
+            response = await self.auth_service.get(
+                "/revocations", params={"after": self.status["after"], "limit": REVOCATION_PAGE_SIZE},
+                headers={"Authorization": f"Bearer {token}"})
+            if response.status_code != 200:
+                raise HTTPException(status_code=response.status_code,
+                                    detail=f"Failed to fetch revocations: {response.text}")
+
+            page = response.json()
+            for item in page["revocations"]:
+                revoke(item["jti_hash"], item["expires_at"])
+            self.status["after"] = page["next"]
+            self.status["revoked"] += len(page["revocations"])
+            if not page["has_more"]:
+                break
+        prune_revoked()
+
+    async def run(self):
+        while True:
+            try:
+                await self.sync_once()
+            except Exception as exc:
+                self.status["last_error"] = getattr(exc, "detail", str(exc))
+            else:
+                self.status["last_success"] = time.time()
+                self.status["last_error"] = None
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,40 @@
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict
+
+
+# Відповіді API: лише потрібні колонки, без hashed_password і cvv.
+# from_attributes дозволяє віддавати як рядки запитів за колонками, так і ORM-об'єкти.
+class RowModel(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ClientOut(RowModel):
+    id: int
+    username: str
+
+
+class AccountOut(RowModel):
+    id: int
+    balance: float
+    blocked: bool
+    owner_id: Optional[int] = None
+
+
+class CreditCardOut(RowModel):
+    id: int
+    card_number: str
+    expiration_date: str
+    account_id: Optional[int] = None
+
+
+class PaymentOut(RowModel):
+    id: int
+    account_id: Optional[int] = None
+    amount: float
+    created_at: Optional[float] = None
+
+
+# Колонки моделі в порядку полів схеми — для session.query(*columns(...)) без побудови ORM-об'єктів
+def columns(schema, model) -> list:
+    return [getattr(model, name) for name in schema.model_fields]
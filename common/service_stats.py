@@ -0,0 +1,12 @@
+from common import db, http_client, logging_setup, rate_limit
+
+
+# Лічильники процесу для бенчмарків: спільні модулі плюс те, що передає сам сервіс
+def collect(**sources) -> dict:
+    return {
+        "db": dict(db.stats),
+        "rate_limit": dict(rate_limit.stats),
+        "http_clients": http_client.client_stats(),
+        "logging": dict(logging_setup.stats),
+        **sources,
+    }
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import os
+import time
+
+from fastapi import HTTPException
+from jose import JWTError, jwt
+
+from common import http_client
+from common.cache import TTLCache
+
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "super_secret_key")
+JWT_KEY_ID = os.getenv("JWT_KEY_ID", "k1")
+# Ключі, що були активні до ротації: "kid1:secret1,kid2:secret2"
+JWT_PREVIOUS_KEYS = os.getenv("JWT_PREVIOUS_KEYS", "")
+JWKS_URL = os.getenv("JWKS_URL")
+JWKS_REFRESH_INTERVAL = float(os.getenv("JWKS_REFRESH_INTERVAL", "300"))
+JWKS_MIN_REFRESH_INTERVAL = 10.0
+VERIFY_CACHE_SIZE = int(os.getenv("VERIFY_CACHE_SIZE", "4096"))
+VERIFY_CACHE_TTL = float(os.getenv("VERIFY_CACHE_TTL", "300"))
+
+
+def _parse_keys(spec: str):
+    keys = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kid, _, secret = item.partition(":")
+        keys[kid] = secret
+    return keys
+
+
+_keys = {**_parse_keys(JWT_PREVIOUS_KEYS), JWT_KEY_ID: JWT_SECRET_KEY}
+_jwks = {}
+# Кеш перевірених токенів: ключ — sha256 токена, запис живе не довше за exp
+_verified = TTLCache(maxsize=VERIFY_CACHE_SIZE, ttl=VERIFY_CACHE_TTL)
+# Відкликані токени: хеш jti -> exp. Перевірка — один пошук у словнику, без звернення до auth_service
+_revoked = {}
+
+
+def sign_token(claims: dict) -> str:
+    return jwt.encode(claims, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM, headers={"kid": JWT_KEY_ID})
+
+
+# Короткоживучий токен для службових викликів між сервісами
+def create_service_token(service_name: str, expires_in: int = 300) -> str:
+    return sign_token({"sub": service_name, "role": "service", "exp": int(time.time()) + expires_in})
+
+
+def jti_digest(jti: str) -> str:
+    return hashlib.sha256(jti.encode()).hexdigest()[:32]
+
+
+def revoke(digest: str, expires_at: float):
+    _revoked[digest] = expires_at
+
+
+def is_revoked(digest: str) -> bool:
+    return digest is not None and digest in _revoked
+
+
+# Прострочені токени і так не пройдуть перевірку exp, тож їх можна забути
+def prune_revoked():
+    now = time.time()
+    for digest, expires_at in list(_revoked.items()):
+        if expires_at < now:
+            _revoked.pop(digest, None)
+
+
+# Фонове оновлення JWKS: перевірка токена лише читає словник ключів і ніколи не чекає на мережу
+class JwksSync:
+    def __init__(self, url: str = JWKS_URL, interval: float = JWKS_REFRESH_INTERVAL,
+                 min_interval: float = JWKS_MIN_REFRESH_INTERVAL):
+        self.url = url
+        self.interval = interval
+        self.min_interval = min_interval
+        self.status = {"keys": 0, "last_success": None, "last_error": None}
+        self._task = None
+        self._loop = None
+        self._wanted = None
+
+    async def refresh_once(self):
+        global _jwks
+        response = await http_client.get_client("jwks", self.url).get(self.url)
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch JWKS: {response.text}")
+        keys = {key["kid"]: key for key in response.json().get("keys", []) if "kid" in key}
+        # Заміна одним присвоєнням: паралельна перевірка бачить або старий, або новий набір ключів
+        _jwks = keys
+        self.status["keys"] = len(keys)
+
+    # Невідомий kid: можливо, ключі щойно ротували. Викликається з будь-якого потоку, лише будить фонове завдання
+    def request_refresh(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wanted.set)
+
+    async def run(self):
+        while True:
+            self._wanted.clear()
+            try:
+                await self.refresh_once()
+            except Exception as exc:
+                self.status["last_error"] = getattr(exc, "detail", str(exc))
+            else:
+                self.status["last_success"] = time.time()
+                self.status["last_error"] = None
+            # Позачергові оновлення не частіше за min_interval, хоч би скільки токенів з невідомим kid прийшло
+            await asyncio.sleep(self.min_interval)
+            try:
+                await asyncio.wait_for(self._wanted.wait(), max(self.interval - self.min_interval, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if not self.url:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wanted = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._loop = None
+
+
+jwks_sync = JwksSync()
+
+
+def _resolve_key(kid):
+    if not jwks_sync.url:
+        # Старі токени без kid підписані поточним ключем
+        return _keys.get(kid) if kid is not None else JWT_SECRET_KEY
+
+    key = _jwks.get(kid)
+    if key is None:
+        # Запит отримує 401 одразу, а ключ підтягнеться у фоні
+        jwks_sync.request_refresh()
+    return key
+
+
+def verify_token(token: str) -> dict:
+    cache_key = hashlib.sha256(token.encode()).digest()
+    cached = _verified.get(cache_key)
+    if cached is not None:
+        identity, digest = cached
+        if is_revoked(digest):
+            raise HTTPException(status_code=401, detail="Token revoked")
+        return identity
+
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = _resolve_key(kid)
+        if key is None:
+            raise JWTError("Unknown key id")
+        payload = jwt.decode(token, key, algorithms=[JWT_ALGORITHM], options={"require_exp": True})
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    username = payload.get("sub")
+    role = payload.get("role")
+    if username is None or role not in ("client", "admin", "service"):
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    digest = jti_digest(payload["jti"]) if payload.get("jti") else None
+    if is_revoked(digest):
+        raise HTTPException(status_code=401, detail="Token revoked")
+
+    identity = {"username": username, "role": role}
+    _verified.set(cache_key, (identity, digest), expires_at=min(payload["exp"], time.time() + VERIFY_CACHE_TTL))
+    return identity
@@ -0,0 +1,180 @@
+import contextvars
+import os
+import threading
+import time
+import uuid
+
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import event
+
+TRACE_HEADER = "X-Trace-Id"
+# Межі кошиків гістограм затримок, секунди
+LATENCY_BUCKETS = tuple(float(bound) for bound in os.getenv(
+    "LATENCY_BUCKETS", "0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(","))
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+# Трасування одного вхідного запиту: id, що йде далі в заголовках, і сумарний час за ділянками
+class Trace:
+    def __init__(self, trace_id: str, scope: dict = None):
+        self.trace_id = trace_id
+        self.scope = scope or {}
+        self.spans = {}
+        self.queries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def route(self) -> str:
+        # Після маршрутизації в scope є шаблон шляху; до неї — лише сам шлях
+        route = self.scope.get("route")
+        return f"{self.scope.get('method', '')} {getattr(route, 'path', None) or self.scope.get('path', '')}"
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            count, total = self.spans.get(name, (0, 0.0))
+            self.spans[name] = (count + 1, total + seconds)
+
+    def count_query(self, fingerprint: str) -> int:
+        with self._lock:
+            count = self.queries[fingerprint] = self.queries.get(fingerprint, 0) + 1
+            return count
+
+    def server_timing(self, total: float) -> str:
+        parts = [f"app;dur={total * 1000:.1f}"]
+        with self._lock:
+            for name, (count, seconds) in self.spans.items():
+                parts.append(f'{name};dur={seconds * 1000:.1f};desc="{count}x"')
+        return ", ".join(parts)
+
+
+def current_trace():
+    return _current.get()
+
+
+def current_trace_id():
+    trace = _current.get()
+    return trace.trace_id if trace is not None else None
+
+
+def trace_headers() -> dict:
+    trace = _current.get()
+    return {TRACE_HEADER: trace.trace_id} if trace is not None else {}
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[index] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            label_text = ",".join(f'{key}="{value}"' for key, value in zip(self.labels, labels))
+            prefix = label_text + "," if label_text else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound:g}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-2]}')
+            lines.append(f"{self.name}_count{{{label_text}}} {series[-2]}")
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-1]:.6f}")
+        return lines
+
+
+request_latency = Histogram("http_request_duration_seconds", "Latency of incoming requests by route",
+                            ("method", "route", "status"))
+downstream_latency = Histogram("downstream_request_duration_seconds", "Latency of calls to other services",
+                               ("target", "method", "status"))
+db_latency = Histogram("db_statement_duration_seconds", "Latency of SQL statements", ("engine", "operation"))
+
+
+def record_downstream(target: str, method: str, status, seconds: float):
+    downstream_latency.observe(seconds, target, method, str(status))
+    trace = _current.get()
+    if trace is not None:
+        trace.add(target, seconds)
+
+
+# Час кожної SQL-інструкції через події рушія; для асинхронного рушія — його sync_engine
+def instrument_engine(engine, name: str = "db"):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        seconds = time.perf_counter() - started
+        db_latency.observe(seconds, name, statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "")
+        trace = _current.get()
+        if trace is not None:
+            trace.add("db", seconds)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # Інструкція з помилкою не доходить до after_cursor_execute
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+# ASGI-посередник: id трасування з вхідного заголовка або новий, Server-Timing і X-Trace-Id у відповіді,
+# гістограма затримок за шаблоном маршруту
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-trace-id":
+                trace_id = value.decode()[:64]
+        trace = Trace(trace_id or uuid.uuid4().hex, scope)
+        token = _current.set(trace)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", ()))
+                headers.append((TRACE_HEADER.lower().encode(), trace.trace_id.encode()))
+                headers.append((b"server-timing", trace.server_timing(time.perf_counter() - started).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            # Шаблон шляху, а не сам шлях, щоб id у URL не множили часові ряди
+            path = getattr(route, "path", None) or "unmatched"
+            request_latency.observe(time.perf_counter() - started, scope["method"], path, str(status))
+
+
+def metrics(request):
+    lines = []
+    for histogram in (request_latency, downstream_latency, db_latency):
+        lines.extend(histogram.render())
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
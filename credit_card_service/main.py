@@ -1,20 +1,66 @@
-from fastapi import FastAPI, HTTPException, Depends, Query
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import List
+
+from fastapi import FastAPI, HTTPException, Depends, Query, Body
 from fastapi.params import Security
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String
 from sqlalchemy.orm import declarative_base, sessionmaker, Session, relationship
-import requests
-
-from models import Account, Client, CreditCard, Base
 
-app = FastAPI()
+from models import Account, Client, CreditCard
+from common import migrations
+from common.db import create_engines, database_url
+from common.token_verifier import jwks_sync, verify_token
+from common.identity_cache import get_identity, invalidate_identity
+from common import http_client
+from common.rate_limit import RateLimitMiddleware
+from common import logging_setup
+from common import tracing
+from common.tracing import TracingMiddleware
+from common.revocations import RevocationSync
+from common.replica import apply_events
+from common.pagination import list_rows, PAGE_SIZE_DEFAULT
+from common.change_feed import track_changes, backfill_changes, changes_response
+from common.schemas import CreditCardOut, columns
+from common import query_profiler
+from common import service_stats
+
+
+logging_setup.configure("credit_card_service")
+logger = logging.getLogger("credit_card_service")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    jwks_sync.start()
+    revocation_sync.start()
+    yield
+    await revocation_sync.stop()
+    await jwks_sync.stop()
+    await http_client.close_clients()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RateLimitMiddleware, concurrency={"GET /credit-cards/all": 2})
+# Зовнішній шар: трасування бачить і відмови обмежувача
+app.add_middleware(TracingMiddleware)
+app.add_route("/metrics", tracing.metrics, include_in_schema=False)
 # Налаштування бази даних
-SQLALCHEMY_DATABASE_URL = "sqlite:///./credit_cards.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+SQLALCHEMY_DATABASE_URL = database_url("CARD", "sqlite:///./credit_cards.db")
+engine, read_engine = create_engines(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+migrations.upgrade(engine)
+migrations.check_schema(engine)
+track_changes(SessionLocal, CreditCard)
+backfill_changes(engine, CreditCard)
 #Base = declarative_base()
 
-AUTH_SERVICE_URL = "http://auth_service:8000"
-ACCOUNT_SERVICE_URL = "http://account_service:8003"
+AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth_service:8000")
+auth_service = http_client.get_client("auth_service", AUTH_SERVICE_URL)
+revocation_sync = RevocationSync(auth_service, "credit_card_service")
 #Base.metadata.create_all(bind=engine)
 
 def get_db():
@@ -24,60 +70,62 @@ def get_db():
     finally:
         db.close()
 
-def get_current_client(token: str, db: Session = Depends(get_db)):
-    response = requests.get(f"{AUTH_SERVICE_URL}/verify", headers={"Authorization": f"Bearer {token}"})
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.json())
 
-    user_data = response.json()
+def find_client(db: Session, username: str):
+    return db.query(Client).filter(Client.username == username).first()
 
-    client_response = requests.get(f"{AUTH_SERVICE_URL}/clients/me", headers={"Authorization": f"Bearer {token}"})
 
-    if client_response.status_code != 200:
-        raise HTTPException(status_code=client_response.status_code, detail=client_response.json())
+def add_client(db: Session, username: str):
+    client = Client(username=username)
+    db.add(client)
+    db.commit()
+    db.refresh(client)
+    return client
 
-    client_data = client_response.json()
 
-    client = db.query(Client).filter(Client.username == user_data["username"]).first()
+# Запити до БД синхронні й можуть чекати на блокування SQLite, тому йдуть у потік;
+# у циклі подій очікуємо лише auth_service
+async def get_current_client(token: str, db: Session = Depends(get_db)):
+    user_data = verify_token(token)
 
-    if not client:
-        client = Client(username=client_data["username"], hashed_password=client_data["hashed_password"])
-        db.add(client)
-        db.commit()
-        db.refresh(client)
+    client = await asyncio.to_thread(find_client, db, user_data["username"])
 
-    # Синхронізуємо рахунки клієнта
-    sync_client_accounts(client, token, db)
+    if not client:
+        client_data = (await get_identity(token, auth_service))["profile"]
+        client = await asyncio.to_thread(add_client, db, client_data["username"])
 
     return client
 
 
-def sync_client_accounts(client: Client, token: str, db: Session):
-    response = requests.get(f"{ACCOUNT_SERVICE_URL}/account?token={token}")
-
-    if response.status_code != 200:
-        print("Account service error:", response.status_code, response.text)
-        raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch accounts: {response.text}")
+# Auth_service повідомляє про зміну користувача
+@app.post("/internal/identity/invalidate")
+def invalidate_client_identity(username: str, token: str, new_username: str = None, db: Session = Depends(get_db)):
+    if verify_token(token)["role"] != "service":
+        raise HTTPException(status_code=403, detail="Only services can invalidate identities")
 
-    accounts_data = response.json()
-    print("Received accounts:", accounts_data)
+    invalidate_identity(username)
+    if new_username and new_username != username:
+        db.query(Client).filter(Client.username == username).update({"username": new_username})
+        db.commit()
+    return {"message": "Identity invalidated"}
 
-    for account_data in accounts_data:
-        account = db.query(Account).filter(Account.id == account_data["id"]).first()
 
-        if not account:
-            account = Account(
-                id=account_data["id"],
-                owner_id=account_data["owner_id"],
-                balance=account_data["balance"],
-                blocked=account_data["blocked"]
-            )
-            db.add(account)
+# Події змін рахунків від account_service замість синхронізації на кожному запиті
+@app.post("/internal/events/accounts")
+def receive_account_events(token: str, events: List[dict] = Body(..., embed=True), db: Session = Depends(get_db)):
+    if verify_token(token)["role"] != "service":
+        raise HTTPException(status_code=403, detail="Only services can publish account events")
+    return {"applied": apply_events(db, Account, events)}
 
-    db.commit()
 
-@app.post("/credit-cards/create")
+@app.post("/credit-cards/create", response_model=CreditCardOut)
 def create_credit_card(account_id: int, card_number: str, expiration_date: str, cvv: str,
                        client: Client = Depends(get_current_client), db: Session = Depends(get_db)):
     account = db.query(Account).filter(Account.id == account_id, Account.owner_id == client.id).first()
@@ -89,14 +137,12 @@ def create_credit_card(account_id: int, card_number: str, expiration_date: str,
     db.refresh(card)
     return card
 
-@app.get("/credit-cards/")
-def get_credit_cards(token: str, db: Session = Depends(get_db)):
-    client = get_current_client(token, db)
-    return db.query(CreditCard).join(Account).filter(Account.owner_id == client.id).all()
+@app.get("/credit-cards/", response_model=List[CreditCardOut])
+def get_credit_cards(client: Client = Depends(get_current_client), db: Session = Depends(get_db)):
+    return db.query(*columns(CreditCardOut, CreditCard)).join(Account).filter(Account.owner_id == client.id).all()
 
 @app.delete("/credit-cards/{card_id}")
-def delete_credit_card(card_id: int, token: str, db: Session = Depends(get_db)):
-    client = get_current_client(token, db)
+def delete_credit_card(card_id: int, client: Client = Depends(get_current_client), db: Session = Depends(get_db)):
     card = db.query(CreditCard).filter(CreditCard.id == card_id, CreditCard.account.has(owner_id=client.id)).first()
     if not card:
         raise HTTPException(status_code=404, detail="Credit card not found")
@@ -105,8 +151,8 @@ def delete_credit_card(card_id: int, token: str, db: Session = Depends(get_db)):
     return {"message": "Credit card deleted"}
 
 @app.put("/credit-cards/{card_id}")
-def update_credit_card(card_id: int, new_card_number: str, new_expiration_date: str, new_cvv: str, token: str, db: Session = Depends(get_db)):
-    client = get_current_client(token, db)
+def update_credit_card(card_id: int, new_card_number: str, new_expiration_date: str, new_cvv: str,
+                       client: Client = Depends(get_current_client), db: Session = Depends(get_db)):
     card = db.query(CreditCard).filter(CreditCard.id == card_id, CreditCard.account.has(owner_id=client.id)).first()
     if not card:
         raise HTTPException(status_code=404, detail="Credit card not found")
@@ -118,20 +164,40 @@ def update_credit_card(card_id: int, new_card_number: str, new_expiration_date:
     return {"message": "Credit card updated"}
 
 
-@app.get("/credit-cards/all")
-def get_all_credit_cards(token: str, db: Session = Depends(get_db)):
-    print(f"Verifying token: {token}")
-
-    response = requests.get(f"{AUTH_SERVICE_URL}/verify", headers={"Authorization": f"Bearer {token}"})
-    print(f"Verify response status: {response.status_code}")
-    print(f"Verify response text: {response.text}")
-
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.json())
-
-    user_data = response.json()
+@app.get("/credit-cards/all", response_model=List[CreditCardOut])
+def get_all_credit_cards(token: str, after_id: int = 0, limit: int = PAGE_SIZE_DEFAULT, stream: bool = False,
+                         db: Session = Depends(get_read_db)):
+    user_data = verify_token(token)
+    logger.debug("Listing all credit cards", extra={"username": user_data.get("username"), "after_id": after_id,
+                                                   "limit": limit, "stream": stream})
 
     if user_data.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Only admins can view all cards")
 
-    return db.query(CreditCard).all()
+    return list_rows(ReadSessionLocal, db, lambda session: session.query(*columns(CreditCardOut, CreditCard)), CreditCard, after_id, limit, stream)
+
+# Журнал змін для інкрементальної реплікації в admin_service
+@app.get("/credit-cards/changes")
+def get_credit_card_changes(token: str, after: int = 0, limit: int = 500, db: Session = Depends(get_db)):
+    if verify_token(token)["role"] not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Only admins can read the change feed")
+    return changes_response(db, CreditCard.__tablename__, after, limit)
+
+
+# Лічильники процесу для бенчмарків і моніторингу
+@app.get("/internal/stats")
+def get_internal_stats(token: str):
+    if verify_token(token)["role"] not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Only services can read stats")
+    return service_stats.collect(revocations=revocation_sync.status)
+
+
+# Профіль SQL-запитів процесу: відбитки, повільні запити з планами, підозри на N+1
+@app.get("/debug/queries")
+def get_query_profile(token: str, limit: int = 50, sort: str = "total", reset: bool = False):
+    if verify_token(token)["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can read the query profile")
+    profile = query_profiler.report(limit, sort)
+    if reset:
+        query_profiler.reset()
+    return profile
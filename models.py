@@ -1,8 +1,18 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Boolean
+import time
+
+from sqlalchemy import Column, Integer, String, Float, ForeignKeyConstraint, Boolean, Text, Index
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
 
+
+# Посилання між таблицями різних сервісів. У кожній БД одна зі сторін — репліка, що наповнюється подіями
+# в довільному порядку (рахунок може прийти раніше за власника), тож обмеження в самій БД не створюється,
+# інакше PostgreSQL відхилив би такі події. У метаданих ключ лишається для join і relationship.
+def replica_reference(column: str, target: str):
+    return ForeignKeyConstraint([column], [target]).ddl_if(callable_=lambda *args, **kwargs: False)
+
+
 # Моделі
 class Client(Base):
     __tablename__ = "clients"
@@ -14,10 +24,11 @@ class Client(Base):
 
 class Account(Base):
     __tablename__ = "accounts"
+    __table_args__ = (replica_reference("owner_id", "clients.id"),)
     id = Column(Integer, primary_key=True, index=True)
     balance = Column(Float, default=0.0)
     blocked = Column(Boolean, default=False)
-    owner_id = Column(Integer, ForeignKey("clients.id"))
+    owner_id = Column(Integer, index=True)
     owner = relationship("Client", back_populates="accounts")
     credit_cards = relationship("CreditCard", back_populates="account")
     payments = relationship("Payment", back_populates="account")
@@ -25,22 +36,37 @@ class Account(Base):
 
 class CreditCard(Base):
     __tablename__ = "credit_cards"
+    __table_args__ = (replica_reference("account_id", "accounts.id"),)
     id = Column(Integer, primary_key=True, index=True)
     card_number = Column(String, unique=True)
     expiration_date = Column(String)
     cvv = Column(String)
-    account_id = Column(Integer, ForeignKey("accounts.id"))
+    account_id = Column(Integer, index=True)
     account = relationship("Account", back_populates="credit_cards")
 
 
 class Payment(Base):
     __tablename__ = "payments"
+    # Покривний індекс історії: WHERE account_id = ? AND created_at BETWEEN ... ORDER BY created_at, id
+    __table_args__ = (Index("ix_payments_account_created", "account_id", "created_at", "id", "amount"),
+                      replica_reference("account_id", "accounts.id"))
     id = Column(Integer, primary_key=True, index=True)
-    account_id = Column(Integer, ForeignKey("accounts.id"))
+    account_id = Column(Integer)
     amount = Column(Float)
+    created_at = Column(Float, default=time.time)
     account = relationship("Account", back_populates="payments")
 
 
+# Підсумки платежів рахунку за календарний місяць (UTC), оновлюються разом з кожним переказом
+class PaymentSummary(Base):
+    __tablename__ = "payment_summaries"
+    account_id = Column(Integer, primary_key=True)
+    period = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+    total_in = Column(Float, default=0.0)
+    total_out = Column(Float, default=0.0)
+
+
 class Admin(Base):
     __tablename__ = "admins"
     id = Column(Integer, primary_key=True, index=True)
@@ -48,5 +74,90 @@ class Admin(Base):
     hashed_password = Column(String)
 
 
-# Ініціалізація бази даних
-#Base.metadata.create_all(bind=engine)
+# Журнал змін для інкрементальної реплікації (change feed)
+class ChangeEvent(Base):
+    __tablename__ = "change_events"
+    __table_args__ = (Index("ix_change_events_entity_seq", "entity", "seq"), {"sqlite_autoincrement": True})
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    entity = Column(String, index=True)
+    entity_id = Column(Integer)
+    op = Column(String)
+    kind = Column(String)
+    payload = Column(Text)
+
+
+# Позиція в журналі змін кожного джерела, до якої дані вже репліковано
+class SyncWatermark(Base):
+    __tablename__ = "sync_watermarks"
+    source = Column(String, primary_key=True)
+    seq = Column(Integer, default=0)
+
+
+# Остання застосована версія (seq події) кожного реплікованого рядка
+class ReplicaVersion(Base):
+    __tablename__ = "replica_versions"
+    entity = Column(String, primary_key=True)
+    entity_id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0)
+
+
+# Збережені відповіді на перекази для безпечних повторів клієнта
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    client_id = Column(Integer, primary_key=True)
+    key = Column(String, primary_key=True)
+    # sha256 параметрів першого запиту: той самий ключ з іншим переказом відхиляється, а не повертає чужу відповідь
+    request_hash = Column(String, nullable=True)
+    response = Column(Text)
+
+
+# Журнал проводок у мінорних одиницях: кожен переказ (transfer_id) у сумі дає нуль
+class LedgerEntry(Base):
+    __tablename__ = "ledger_entries"
+    id = Column(Integer, primary_key=True, index=True)
+    transfer_id = Column(String, index=True)
+    account_id = Column(Integer, index=True)
+    amount = Column(Integer)
+    payment_id = Column(Integer, nullable=True)
+    created_at = Column(Float)
+
+
+# Матеріалізований баланс рахунку, оновлюється разом з кожною проводкою
+class AccountBalance(Base):
+    __tablename__ = "account_balances"
+    account_id = Column(Integer, primary_key=True)
+    balance = Column(Integer, default=0)
+    last_entry_id = Column(Integer, default=0)
+
+
+# Періодичні знімки балансів для швидкої звірки
+class BalanceSnapshot(Base):
+    __tablename__ = "balance_snapshots"
+    id = Column(Integer, primary_key=True, index=True)
+    account_id = Column(Integer, index=True)
+    entry_id = Column(Integer)
+    balance = Column(Integer)
+    taken_at = Column(Float)
+
+
+
+# Refresh-токени з ротацією: зберігається лише sha256 токена, family — ланцюжок ротацій одного входу
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+    token_hash = Column(String, primary_key=True)
+    family = Column(String, index=True)
+    username = Column(String, index=True)
+    role = Column(String)
+    created_at = Column(Float)
+    expires_at = Column(Float)
+    used_at = Column(Float, nullable=True)
+    revoked = Column(Boolean, default=False)
+
+
+# Відкликані access-токени (хеш jti) до кінця їхнього строку дії; id — курсор реплікації
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    jti_hash = Column(String, unique=True)
+    expires_at = Column(Float, index=True)
@@ -0,0 +1,99 @@
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select, tuple_
+
+from models import Account, Payment, PaymentSummary
+from common.db import insert_for
+from common.pagination import PAGE_SIZE_MAX
+
+payments = Payment.__table__
+summaries = PaymentSummary.__table__
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def period_of(timestamp: float) -> str:
+    return time.strftime("%Y-%m", time.gmtime(timestamp))
+
+
+def to_timestamp(value: datetime) -> float:
+    # Час без часового поясу вважаємо UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+# Межа to виключна: якщо вона припадає точно на початок місяця, з цього місяця нічого не входить
+def starts_month(value: datetime) -> bool:
+    value = datetime.fromtimestamp(to_timestamp(value), timezone.utc)
+    return value == value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def encode_cursor(row) -> str:
+    return f"{row['created_at']!r}:{row['id']}"
+
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, payment_id = cursor.split(":")
+        return float(created_at), int(payment_id)
+    except ValueError:
+        raise InvalidCursor(cursor)
+
+
+# Підсумки місяця оновлюються в тій самій транзакції, що й платежі
+def record_period_totals(connection, legs, created_at: float):
+    stmt = insert_for(connection)(summaries)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[summaries.c.account_id, summaries.c.period],
+        set_={
+            "count": summaries.c.count + stmt.excluded.count,
+            "total_in": summaries.c.total_in + stmt.excluded.total_in,
+            "total_out": summaries.c.total_out + stmt.excluded.total_out,
+        },
+    )
+    period = period_of(created_at)
+    connection.execute(stmt, [
+        {"account_id": leg["account_id"], "period": period, "count": 1,
+         "total_in": max(leg["amount"], 0.0), "total_out": max(-leg["amount"], 0.0)}
+        for leg in legs
+    ])
+
+
+# Сторінка історії клієнта за покривним індексом (account_id, created_at, id, amount)
+# і готові місячні підсумки за той самий проміжок
+async def payment_history(db, client_id: int, start: datetime = None, end: datetime = None,
+                          limit: int = 100, cursor: str = None) -> dict:
+    limit = max(1, min(limit, PAGE_SIZE_MAX))
+    account_ids = select(Account.id).where(Account.owner_id == client_id).scalar_subquery()
+
+    query = select(payments.c.id, payments.c.account_id, payments.c.amount, payments.c.created_at) \
+        .where(payments.c.account_id.in_(account_ids))
+    totals = select(summaries.c.period, func.sum(summaries.c.count).label("count"),
+                    func.sum(summaries.c.total_in).label("total_in"),
+                    func.sum(summaries.c.total_out).label("total_out")) \
+        .where(summaries.c.account_id.in_(account_ids))
+    if start is not None:
+        query = query.where(payments.c.created_at >= to_timestamp(start))
+        totals = totals.where(summaries.c.period >= period_of(to_timestamp(start)))
+    if end is not None:
+        query = query.where(payments.c.created_at < to_timestamp(end))
+        totals = totals.where(summaries.c.period < period_of(to_timestamp(end)) if starts_month(end)
+                              else summaries.c.period <= period_of(to_timestamp(end)))
+    if cursor:
+        query = query.where(tuple_(payments.c.created_at, payments.c.id) > tuple_(*decode_cursor(cursor)))
+
+    rows = (await db.execute(
+        query.order_by(payments.c.created_at, payments.c.id).limit(limit + 1)
+    )).mappings().all()
+    page = [dict(row) for row in rows[:limit]]
+    summary = (await db.execute(totals.group_by(summaries.c.period).order_by(summaries.c.period))).mappings().all()
+
+    return {
+        "payments": page,
+        "next_cursor": encode_cursor(page[-1]) if len(rows) > limit else None,
+        "summary": [dict(row) for row in summary],
+    }
@@ -1,21 +1,82 @@
-from fastapi import FastAPI, HTTPException, Depends, Query
-import requests
-from sqlalchemy import create_engine
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List
+
+from fastapi import FastAPI, HTTPException, Depends, Query, Header, Body
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.orm import sessionmaker, Session
 
 from models import Payment, Account, Client
-app = FastAPI()
-
-SQLALCHEMY_DATABASE_URL = "sqlite:///./clients_payments.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+from common import migrations
+from common.db import create_engines, create_async_db_engine, database_url
+from common.token_verifier import jwks_sync, verify_token
+from common.identity_cache import get_identity, invalidate_identity
+from common import http_client
+from common.rate_limit import RateLimitMiddleware
+from common import logging_setup
+from common import tracing
+from common.tracing import TracingMiddleware
+from common.revocations import RevocationSync
+from common.replica import apply_events
+from common.pagination import list_rows, PAGE_SIZE_DEFAULT
+from common.change_feed import track_changes, backfill_changes, changes_response
+from common.schemas import PaymentOut, columns
+from common import ledger
+from common import query_profiler
+from common import service_stats
+from history import payment_history, InvalidCursor
+from transfers import transfer, transfer_batch, TransferError
+import transfers
+
+
+logging_setup.configure("payment_service")
+logger = logging.getLogger("payment_service")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    snapshots = asyncio.create_task(ledger.run_snapshots(engine))
+    jwks_sync.start()
+    revocation_sync.start()
+    yield
+    snapshots.cancel()
+    await revocation_sync.stop()
+    await jwks_sync.stop()
+    await http_client.close_clients()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(RateLimitMiddleware,
+                   routes={"POST /make_payments/": (10, 20), "POST /make_payments/batch": (1, 2)},
+                   concurrency={"POST /make_payments/batch": 2, "GET /payments/all": 2, "GET /ledger/reconcile": 1})
+# Зовнішній шар: трасування бачить і відмови обмежувача
+app.add_middleware(TracingMiddleware)
+app.add_route("/metrics", tracing.metrics, include_in_schema=False)
+
+SQLALCHEMY_DATABASE_URL = database_url("PAYMENT", "sqlite:///./clients_payments.db")
+engine, read_engine = create_engines(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+async_engine = create_async_db_engine(SQLALCHEMY_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+migrations.upgrade(engine)
+migrations.check_schema(engine)
+track_changes(SessionLocal, Payment)
+backfill_changes(engine, Payment)
 
 SECRET_KEY = "secret"
 ADMIN_SECRET = "my_admin_secret"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-AUTH_SERVICE_URL = "http://auth_service:8000"
-ACCOUNT_SERVICE_URL = "http://account_service:8003"
+AUTH_SERVICE_URL = os.getenv("AUTH_SERVICE_URL", "http://auth_service:8000")
+auth_service = http_client.get_client("auth_service", AUTH_SERVICE_URL)
+revocation_sync = RevocationSync(auth_service, "payment_service")
+MAX_PAYMENT_BATCH_SIZE = int(os.getenv("MAX_PAYMENT_BATCH_SIZE", "1000"))
 
 def get_db():
     db = SessionLocal()
@@ -24,104 +85,152 @@ def get_db():
     finally:
         db.close()
 
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
-def get_current_client(token: str, db: Session = Depends(get_db)):
-    response = requests.get(f"{AUTH_SERVICE_URL}/verify", headers={"Authorization": f"Bearer {token}"})
+# Асинхронна сесія для читань, що не повинні займати потоки пулу
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.json())
 
-    user_data = response.json()
+def find_client(db: Session, username: str):
+    return db.query(Client).filter(Client.username == username).first()
 
-    client_response = requests.get(f"{AUTH_SERVICE_URL}/clients/me", headers={"Authorization": f"Bearer {token}"})
 
-    if client_response.status_code != 200:
-        raise HTTPException(status_code=client_response.status_code, detail=client_response.json())
+def add_client(db: Session, username: str):
+    client = Client(username=username)
+    db.add(client)
+    db.commit()
+    db.refresh(client)
+    return client
 
-    client_data = client_response.json()
 
-    client = db.query(Client).filter(Client.username == user_data["username"]).first()
+# Запити до БД синхронні й можуть чекати на блокування SQLite, тому йдуть у потік;
+# у циклі подій очікуємо лише auth_service
+async def get_current_client(token: str, db: Session = Depends(get_db)):
+    user_data = verify_token(token)
 
-    if not client:
-        client = Client(username=client_data["username"], hashed_password=client_data["hashed_password"])
-        db.add(client)
-        db.commit()
-        db.refresh(client)
+    client = await asyncio.to_thread(find_client, db, user_data["username"])
 
-    # Синхронізуємо рахунки клієнта
-    sync_client_accounts(client, token, db)
+    if not client:
+        client_data = (await get_identity(token, auth_service))["profile"]
+        client = await asyncio.to_thread(add_client, db, client_data["username"])
 
     return client
 
 
-def sync_client_accounts(client: Client, token: str, db: Session):
-    response = requests.get(f"{ACCOUNT_SERVICE_URL}/account?token={token}")
+# Баланс локальної копії змінюють перекази цього сервісу, тому з account_service переносимо лише поповнення:
+# усі поповнення пачки однією проводкою з зовнішнього рахунку
+def post_top_ups(db: Session, events: list):
+    legs = [{"account_id": event["id"], "amount": ledger.to_minor(event["data"]["amount"])}
+            for event in events if event["kind"] == "topped_up"]
+    if not legs:
+        return
+    legs.insert(0, {"account_id": ledger.EXTERNAL_ACCOUNT_ID, "amount": -sum(leg["amount"] for leg in legs)})
+    _, new_balances = ledger.post_transfer(db.connection(), legs, check_funds=False)
+    ledger.mirror_balances(db.connection(), new_balances)
 
-    if response.status_code != 200:
-        print("Account service error:", response.status_code, response.text)
-        raise HTTPException(status_code=response.status_code, detail=f"Failed to fetch accounts: {response.text}")
 
-    accounts_data = response.json()
-    print("Received accounts:", accounts_data)
+# Auth_service повідомляє про зміну користувача
+@app.post("/internal/identity/invalidate")
+def invalidate_client_identity(username: str, token: str, new_username: str = None, db: Session = Depends(get_db)):
+    if verify_token(token)["role"] != "service":
+        raise HTTPException(status_code=403, detail="Only services can invalidate identities")
 
-    for account_data in accounts_data:
-        account = db.query(Account).filter(Account.id == account_data["id"]).first()
+    invalidate_identity(username)
+    if new_username and new_username != username:
+        db.query(Client).filter(Client.username == username).update({"username": new_username})
+        db.commit()
+    return {"message": "Identity invalidated"}
 
-        if not account:
-            account = Account(
-                id=account_data["id"],
-                owner_id=account_data["owner_id"],
-                balance=account_data["balance"],
-                blocked=account_data["blocked"]
-            )
-            db.add(account)
 
-    db.commit()
+# Події змін рахунків від account_service замість синхронізації на кожному запиті
+@app.post("/internal/events/accounts")
+def receive_account_events(token: str, events: List[dict] = Body(..., embed=True), db: Session = Depends(get_db)):
+    if verify_token(token)["role"] != "service":
+        raise HTTPException(status_code=403, detail="Only services can publish account events")
+    return {"applied": apply_events(db, Account, events, update_columns=["owner_id", "blocked"], merge=post_top_ups)}
 
 
 @app.get("/payments/")
-def get_payments(client: Client = Depends(get_current_client), db: Session = Depends(get_db)):
-    return db.query(Payment).join(Account).filter(Account.owner_id == client.id).all()
+async def get_payments(start: datetime = Query(None, alias="from"), end: datetime = Query(None, alias="to"),
+                       limit: int = PAGE_SIZE_DEFAULT, cursor: str = None,
+                       client: Client = Depends(get_current_client), db: AsyncSession = Depends(get_async_db)):
+    try:
+        return await payment_history(db, client.id, start, end, limit, cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @app.post("/make_payments/")
-def make_payment(to_account_id: int, amount: float, client: Client = Depends(get_current_client),
-                 db: Session = Depends(get_db)):
-    from_account = db.query(Account).filter(Account.owner_id == client.id).first()
-    to_account = db.query(Account).filter(Account.id == to_account_id).first()
-
-    if not from_account:
-        raise HTTPException(status_code=404, detail="Sender account not found")
-    if not to_account:
-        raise HTTPException(status_code=404, detail="Receiver account not found")
-    if from_account.blocked:
-        raise HTTPException(status_code=403, detail="Sender account is blocked")
-    if from_account.balance < amount:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
-
-    from_account.balance -= amount
-    to_account.balance += amount
+async def make_payment(to_account_id: int, amount: float, client: Client = Depends(get_current_client),
+                       idempotency_key: str = Header(None)):
+    try:
+        # Переказ блокує потік на час очікування запису в SQLite, тому виконується поза циклом подій
+        return await asyncio.to_thread(transfer, engine, client.id, to_account_id, amount, idempotency_key)
+    except TransferError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
 
-    payment = Payment(account_id=from_account.id, amount=-amount)  # Відправник
-    db.add(payment)
+class PaymentItem(BaseModel):
+    to_account_id: int
+    amount: float
 
-    payment_received = Payment(account_id=to_account_id, amount=amount)  # Отримувач
-    db.add(payment_received)
 
-    db.commit()
-    db.refresh(payment)
-    db.refresh(payment_received)
-
-    return {"message": "Payment successful", "from_account_balance": from_account.balance,
-            "to_account_balance": to_account.balance}
+# Пакет переказів: одна автентифікація й синхронізація, результат для кожного елемента
+@app.post("/make_payments/batch")
+async def make_payments_batch(items: List[PaymentItem], client: Client = Depends(get_current_client)):
+    if len(items) > MAX_PAYMENT_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {MAX_PAYMENT_BATCH_SIZE} payments")
+    try:
+        results = await asyncio.to_thread(transfer_batch, engine, client.id, [item.model_dump() for item in items])
+    except TransferError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
 
-@app.get("/payments/all")
-def get_all_payments(token: str, db: Session = Depends(get_db)):
-    response = requests.get(f"{AUTH_SERVICE_URL}/verify", headers={"Authorization": f"Bearer {token}"})
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.json())
+    succeeded = sum(1 for result in results if result["status"] == "ok")
+    return {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
 
-    user_data = response.json()
+@app.get("/payments/all", response_model=List[PaymentOut])
+def get_all_payments(token: str, after_id: int = 0, limit: int = PAGE_SIZE_DEFAULT, stream: bool = False,
+                     db: Session = Depends(get_read_db)):
+    user_data = verify_token(token)
     if user_data.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Only admins can view all payments")
 
-    return db.query(Payment).all()
\ No newline at end of file
+    return list_rows(ReadSessionLocal, db, lambda session: session.query(*columns(PaymentOut, Payment)), Payment, after_id, limit, stream)
+
+# Журнал змін для інкрементальної реплікації в admin_service
+@app.get("/payments/changes")
+def get_payment_changes(token: str, after: int = 0, limit: int = 500, db: Session = Depends(get_db)):
+    if verify_token(token)["role"] not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Only admins can read the change feed")
+    return changes_response(db, Payment.__tablename__, after, limit)
+
+# Звірка матеріалізованих балансів з журналом проводок
+@app.get("/ledger/reconcile")
+def reconcile_ledger(token: str, full: bool = False):
+    if verify_token(token)["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can reconcile the ledger")
+    return ledger.reconcile(read_engine, full)
+
+
+# Лічильники процесу для бенчмарків і моніторингу
+@app.get("/internal/stats")
+def get_internal_stats(token: str):
+    if verify_token(token)["role"] not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Only services can read stats")
+    return service_stats.collect(transfers=transfers.stats, revocations=revocation_sync.status)
+
+
+# Профіль SQL-запитів процесу: відбитки, повільні запити з планами, підозри на N+1
+@app.get("/debug/queries")
+def get_query_profile(token: str, limit: int = 50, sort: str = "total", reset: bool = False):
+    if verify_token(token)["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can read the query profile")
+    profile = query_profiler.report(limit, sort)
+    if reset:
+        query_profiler.reset()
+    return profile
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import random
+import time
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import OperationalError
+
+from models import Account, IdempotencyKey, Payment
+from common.change_feed import record_changes
+from common.db import LOCK_ERRORS, immediate_transaction
+from common.ledger import InsufficientFunds, exact_minor, from_minor, mirror_balances, post_transfer
+from history import record_period_totals
+
+TRANSFER_MAX_ATTEMPTS = int(os.getenv("TRANSFER_MAX_ATTEMPTS", "5"))
+TRANSFER_RETRY_DELAY = float(os.getenv("TRANSFER_RETRY_DELAY", "0.01"))
+TRANSFER_BATCH_CHUNK_SIZE = int(os.getenv("TRANSFER_BATCH_CHUNK_SIZE", "200"))
+accounts = Account.__table__
+payments = Payment.__table__
+idempotency_keys = IdempotencyKey.__table__
+
+# Лічильники для бенчмарків і метрик
+stats = {"transfers": 0, "lock_retries": 0, "idempotent_replays": 0}
+
+
+class TransferError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def with_lock_retries(operation):
+    for attempt in range(TRANSFER_MAX_ATTEMPTS):
+        try:
+            return operation()
+        except OperationalError as exc:
+            if not any(error in str(exc.orig) for error in LOCK_ERRORS) or attempt == TRANSFER_MAX_ATTEMPTS - 1:
+                raise
+            stats["lock_retries"] += 1
+            time.sleep(TRANSFER_RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def find_sender(connection, client_id: int):
+    return connection.execute(
+        select(accounts.c.id, accounts.c.blocked).where(accounts.c.owner_id == client_id).limit(1)
+    ).first()
+
+
+# Сума переказу в мінорних одиницях; саме вона йде і в журнал, і в payments
+def validate_amount(amount: float) -> int:
+    minor = exact_minor(amount)
+    if minor is None:
+        raise TransferError(400, "Amount must be a whole number of cents")
+    if minor <= 0:
+        raise TransferError(400, "Amount must be positive")
+    return minor
+
+
+def apply_transfer(connection, sender_id: int, to_account_id: int, minor: int) -> dict:
+    created_at = time.time()
+    amount = from_minor(minor)
+    legs = connection.execute(
+        insert(payments).returning(payments.c.id, payments.c.account_id, payments.c.amount, payments.c.created_at),
+        [{"account_id": sender_id, "amount": -amount, "created_at": created_at},  # Відправник
+         {"account_id": to_account_id, "amount": amount, "created_at": created_at}],  # Отримувач
+    ).mappings().all()
+
+    # Списання лише за умови достатнього балансу — одна атомарна інструкція без гонки читання-запису
+    try:
+        _, new_balances = post_transfer(connection, [
+            {"account_id": sender_id, "amount": -minor, "payment_id": legs[0]["id"]},
+            {"account_id": to_account_id, "amount": minor, "payment_id": legs[1]["id"]},
+        ])
+    except InsufficientFunds:
+        raise TransferError(400, "Insufficient funds")
+    mirror_balances(connection, new_balances)
+    record_period_totals(connection, legs, created_at)
+    record_changes(connection, payments.name, (dict(leg) for leg in legs), "insert")
+
+    stats["transfers"] += 1
+    return {"message": "Payment successful", "from_account_balance": from_minor(new_balances[sender_id]),
+            "to_account_balance": from_minor(new_balances[to_account_id])}
+
+
+def request_hash(to_account_id: int, minor: int) -> str:
+    return hashlib.sha256(json.dumps({"to_account_id": to_account_id, "amount": minor}).encode()).hexdigest()
+
+
+def transfer(engine, client_id: int, to_account_id: int, amount: float, idempotency_key: str = None) -> dict:
+    minor = validate_amount(amount)
+    digest = request_hash(to_account_id, minor)
+
+    def attempt():
+        with immediate_transaction(engine) as connection:
+            if idempotency_key:
+                stored = connection.execute(
+                    select(idempotency_keys.c.request_hash, idempotency_keys.c.response)
+                    .where(idempotency_keys.c.client_id == client_id, idempotency_keys.c.key == idempotency_key)
+                ).first()
+                if stored is not None:
+                    # Повтор з тим самим ключем, але іншим отримувачем чи сумою — помилка клієнта, а не повтор
+                    if stored.request_hash is not None and stored.request_hash != digest:
+                        raise TransferError(422, "Idempotency key was already used with different parameters")
+                    stats["idempotent_replays"] += 1
+                    return json.loads(stored.response)
+
+            sender = find_sender(connection, client_id)
+            if sender is None:
+                raise TransferError(404, "Sender account not found")
+            if connection.execute(select(accounts.c.id).where(accounts.c.id == to_account_id)).first() is None:
+                raise TransferError(404, "Receiver account not found")
+            if sender.blocked:
+                raise TransferError(403, "Sender account is blocked")
+
+            result = apply_transfer(connection, sender.id, to_account_id, minor)
+            if idempotency_key:
+                connection.execute(insert(idempotency_keys).values(
+                    client_id=client_id, key=idempotency_key, request_hash=digest, response=json.dumps(result)))
+            return result
+
+    return with_lock_retries(attempt)
+
+
+# Пакетні перекази: один відправник, кілька транзакцій замість сотень. Відправник і отримувачі
+# перевіряються в кожній транзакції, тож блокування рахунку між шматками зупиняє решту пакета
+def transfer_batch(engine, client_id: int, items) -> list:
+    results = [None] * len(items)
+
+    pending = {}
+    for index, item in enumerate(items):
+        try:
+            pending[index] = validate_amount(item["amount"])
+        except TransferError as exc:
+            results[index] = {"status": "failed", "status_code": exc.status_code, "detail": exc.detail}
+
+    indexes = list(pending)
+    # Навіть без жодного коректного елемента відправник перевіряється, як і для окремого переказу
+    for start in range(0, max(len(indexes), 1), TRANSFER_BATCH_CHUNK_SIZE):
+        chunk = indexes[start:start + TRANSFER_BATCH_CHUNK_SIZE]
+
+        def attempt():
+            chunk_results = {}
+            with immediate_transaction(engine) as connection:
+                sender = find_sender(connection, client_id)
+                if sender is None:
+                    raise TransferError(404, "Sender account not found")
+                if sender.blocked:
+                    raise TransferError(403, "Sender account is blocked")
+                receiver_ids = {items[index]["to_account_id"] for index in chunk}
+                known = set(connection.execute(select(accounts.c.id).where(accounts.c.id.in_(receiver_ids))).scalars())
+
+                for index in chunk:
+                    if items[index]["to_account_id"] not in known:
+                        chunk_results[index] = {"status": "failed", "status_code": 404,
+                                                "detail": "Receiver account not found"}
+                        continue
+                    # Точка збереження: невдалий елемент відкочується, решта пакета комітиться разом
+                    savepoint = connection.begin_nested()
+                    try:
+                        result = apply_transfer(connection, sender.id, items[index]["to_account_id"], pending[index])
+                    except TransferError as exc:
+                        savepoint.rollback()
+                        chunk_results[index] = {"status": "failed", "status_code": exc.status_code, "detail": exc.detail}
+                    else:
+                        savepoint.commit()
+                        chunk_results[index] = {"status": "ok", **result}
+            return chunk_results
+
+        try:
+            chunk_results = with_lock_retries(attempt)
+        except TransferError as exc:
+            # Поки нічого не закомічено, пакет відхиляється цілком; після цього — лише ще не виконані елементи
+            if start == 0:
+                raise
+            chunk_results = {index: {"status": "failed", "status_code": exc.status_code, "detail": exc.detail}
+                             for index in chunk}
+        for index, result in chunk_results.items():
+            results[index] = result
+    return results
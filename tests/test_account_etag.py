@@ -0,0 +1,45 @@
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def service(load_service):
+    module = load_service("account_service", "ACCOUNT")
+    with module.SessionLocal() as db:
+        client = module.add_client(db, "alice")
+        db.expunge(client)
+    module.app.dependency_overrides[module.get_current_client] = lambda: client
+    return module, TestClient(module.app)
+
+
+def test_unchanged_accounts_return_304(service):
+    module, api = service
+    account_id = api.post("/accounts/").json()["account_id"]
+
+    first = api.get("/account")
+    etag = first.headers["ETag"]
+    assert first.json() == [{"id": account_id, "balance": 0.0, "blocked": False, "owner_id": 1}]
+
+    cached = api.get("/account", headers={"If-None-Match": etag})
+    assert (cached.status_code, cached.content, cached.headers["ETag"]) == (304, b"", etag)
+    assert api.get("/account", headers={"If-None-Match": '"stale"'}).status_code == 200
+
+
+# Запис скидає знімок у кеші: наступне читання має нову версію, і старий ETag уже не дає 304
+def test_writes_invalidate_the_snapshot(service):
+    module, api = service
+    account_id = api.post("/accounts/").json()["account_id"]
+    etag = api.get("/account").headers["ETag"]
+
+    api.put(f"/accounts/{account_id}/account_top_up", params={"amount": 12.5})
+    response = api.get("/account", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()[0]["balance"] == 12.5
+
+    etag = response.headers["ETag"]
+    api.put(f"/accounts/{account_id}/block")
+    response = api.get("/account", headers={"If-None-Match": etag})
+    assert (response.status_code, response.json()[0]["blocked"]) == (200, True)
+    assert module.account_cache.get(1)[1] == response.headers["ETag"]
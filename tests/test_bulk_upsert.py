@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from models import Account
+from common.bulk_upsert import bulk_upsert
+
+
+@pytest.fixture
+def session(engine):
+    db = sessionmaker(bind=engine)()
+    yield db
+    db.close()
+
+
+def row(account_id: int, balance: float = 0.0, blocked: bool = False, **extra) -> dict:
+    return {"id": account_id, "balance": balance, "blocked": blocked, "owner_id": account_id, **extra}
+
+
+def stored(db) -> dict:
+    return {account.id: (account.balance, account.blocked)
+            for account in db.execute(select(Account.id, Account.balance, Account.blocked))}
+
+
+@pytest.mark.parametrize("chunk_size", [500, 2])
+def test_counts_inserted_updated_and_unchanged(session, chunk_size):
+    assert bulk_upsert(session, Account, [row(1), row(2), row(3)], chunk_size=chunk_size) == {
+        "inserted": 3, "updated": 0, "unchanged": 0}
+
+    counts = bulk_upsert(session, Account, [
+        row(1, 10.0),
+        row(2),
+        row(3, 5.0),
+        row(3, blocked=True),  # Для одного id перемагає останній рядок пачки
+        row(4, 1.0, email="ignored@example.com"),  # Колонок, яких немає в таблиці, не записуємо
+    ], chunk_size=chunk_size)
+    session.commit()
+
+    assert counts == {"inserted": 1, "updated": 2, "unchanged": 1}
+    assert stored(session) == {1: (10.0, False), 2: (0.0, False), 3: (0.0, True), 4: (1.0, False)}
+    assert bulk_upsert(session, Account, []) == {"inserted": 0, "updated": 0, "unchanged": 0}
+
+
+def test_update_columns_limit_what_existing_rows_get(session):
+    bulk_upsert(session, Account, [row(1, 5.0), row(2, 5.0)])
+
+    counts = bulk_upsert(session, Account, [row(1, 50.0), row(2, 50.0, blocked=True), row(3, 7.0)],
+                         update_columns=["blocked"])
+    session.commit()
+
+    assert counts == {"inserted": 1, "updated": 1, "unchanged": 1}
+    assert stored(session) == {1: (5.0, False), 2: (5.0, True), 3: (7.0, False)}
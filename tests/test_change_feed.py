@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+
+from sqlalchemy import select, text
+from sqlalchemy.orm import sessionmaker
+
+from models import ChangeEvent, Client, CreditCard
+from common import migrations
+from common.change_feed import changes_response, mark_change, read_changes, record_changes, track_changes
+from common.db import create_engines
+
+
+# Пізніший записувач чекає на раніший: читач не бачить події з більшим seq, поки не закомічено меншу
+def test_events_become_visible_in_seq_order(engine):
+    first = engine.connect()
+    transaction = first.begin()
+    record_changes(first, "accounts", [{"id": 1, "balance": 1.0}], "insert")
+
+    second_done = threading.Event()
+
+    def second_writer():
+        with engine.begin() as connection:
+            record_changes(connection, "accounts", [{"id": 2, "balance": 2.0}], "insert")
+        second_done.set()
+
+    thread = threading.Thread(target=second_writer)
+    thread.start()
+    time.sleep(0.3)
+    db = sessionmaker(bind=engine)()
+    try:
+        assert not second_done.is_set()
+        assert read_changes(db, "accounts", 0, 10)["changes"] == []
+    finally:
+        db.close()
+
+    transaction.commit()
+    first.close()
+    thread.join()
+    db = sessionmaker(bind=engine)()
+    try:
+        page = read_changes(db, "accounts", 0, 10)
+    finally:
+        db.close()
+    assert [(change["seq"], change["id"]) for change in page["changes"]] == [(1, 1), (2, 2)]
+
+
+# У журнал потрапляють лише поля схем відповідей: хеш пароля і CVV не публікуються і не реплікуються
+def test_tracked_changes_publish_only_response_fields(engine):
+    SessionLocal = sessionmaker(bind=engine)
+    track_changes(SessionLocal, Client, CreditCard)
+    with SessionLocal() as db:
+        client = Client(username="alice", hashed_password="$2b$12$secret")
+        db.add_all([client, CreditCard(card_number="4111", expiration_date="12/30", cvv="123", account_id=1)])
+        db.commit()
+        mark_change(db, "renamed", previous="alice")
+        client.username = "alice2"
+        db.commit()
+
+        clients = read_changes(db, "clients", 0, 10)["changes"]
+        cards = read_changes(db, "credit_cards", 0, 10)["changes"]
+        response = json.loads(changes_response(db, "clients", 0, 10).body)
+
+    assert [(change["op"], change["kind"], change["data"]) for change in clients] == [
+        ("insert", "created", {"id": 1, "username": "alice"}),
+        ("update", "renamed", {"id": 1, "username": "alice2", "previous": "alice"}),
+    ]
+    assert [change["data"] for change in cards] == [
+        {"id": 1, "card_number": "4111", "expiration_date": "12/30", "account_id": 1}]
+    assert response["changes"] == clients
+
+
+# Події, записані до обмеження колонок журналу, очищуються міграцією
+def test_upgrade_redacts_existing_events(database_url):
+    engine, _ = create_engines(database_url)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE change_events (seq INTEGER PRIMARY KEY, entity VARCHAR, "
+                                "entity_id INTEGER, op VARCHAR, kind VARCHAR, payload TEXT)"))
+        connection.execute(text("INSERT INTO change_events VALUES (:seq, :entity, 1, 'insert', 'created', :payload)"), [
+            {"seq": 1, "entity": "clients",
+             "payload": json.dumps({"id": 1, "username": "alice", "hashed_password": "$2b$12$secret"})},
+            {"seq": 2, "entity": "credit_cards",
+             "payload": json.dumps({"id": 1, "card_number": "4111", "expiration_date": "12/30", "cvv": "123",
+                                    "account_id": 1})},
+        ])
+
+    migrations.upgrade(engine)
+
+    with engine.connect() as connection:
+        payloads = [json.loads(payload) for payload in
+                    connection.execute(select(ChangeEvent.payload).order_by(ChangeEvent.seq)).scalars()]
+        assert payloads == [{"id": 1, "username": "alice"},
+                            {"id": 1, "card_number": "4111", "expiration_date": "12/30", "account_id": 1}]
+    engine.dispose()
@@ -0,0 +1,77 @@
+import asyncio
+import time
+import types
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, text
+
+from models import Payment, PaymentSummary
+from common import migrations
+from common.db import create_async_db_engine, create_engines
+import transfers
+from history import payment_history
+from transfers import transfer
+
+
+def history(database_url, client_id: int = 1, **kwargs) -> dict:
+    async def read():
+        async_engine = create_async_db_engine(database_url)
+        try:
+            async with async_engine.connect() as db:
+                return await payment_history(db, client_id, **kwargs)
+        finally:
+            await async_engine.dispose()
+
+    return asyncio.run(read())
+
+
+def test_payment_history_through_async_engine(database_url, engine, accounts):
+    for amount in (1, 2, 3):
+        transfer(engine, 1, 2, amount)
+
+    first = history(database_url, limit=2)
+    second = history(database_url, limit=2, cursor=first["next_cursor"])
+
+    assert [row["amount"] for row in first["payments"] + second["payments"]] == [-1, -2, -3]
+    assert second["next_cursor"] is None
+    assert [(row["count"], row["total_out"]) for row in first["summary"]] == [(3, 6)]
+
+
+# Межа to виключна і для платежів, і для місячних підсумків: to=1 березня не включає березень
+@pytest.mark.parametrize("end, periods, payments", [
+    (datetime(2026, 3, 1), ["2026-01", "2026-02"], 2),
+    (datetime(2026, 3, 1, tzinfo=timezone(timedelta(hours=-2))), ["2026-01", "2026-02", "2026-03"], 3),
+    (datetime(2026, 3, 1, 0, 0, 1), ["2026-01", "2026-02", "2026-03"], 3),
+    (datetime(2026, 2, 15), ["2026-01", "2026-02"], 1),
+])
+def test_summary_respects_exclusive_end(database_url, engine, accounts, monkeypatch, end, periods, payments):
+    for moment in (datetime(2026, 1, 31, 23, 59, 59), datetime(2026, 2, 28, 12), datetime(2026, 3, 1)):
+        timestamp = moment.replace(tzinfo=timezone.utc).timestamp()
+        monkeypatch.setattr(transfers, "time", types.SimpleNamespace(time=lambda: timestamp, sleep=time.sleep))
+        transfer(engine, 1, 2, 1)
+
+    page = history(database_url, start=datetime(2026, 1, 1), end=end)
+
+    assert [row["period"] for row in page["summary"]] == periods
+    assert len(page["payments"]) == payments
+
+
+# База до міграцій: payments без created_at, частина платежів без рахунку
+def test_upgrade_of_legacy_payments(database_url):
+    engine, _ = create_engines(database_url)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE payments (id INTEGER PRIMARY KEY, account_id INTEGER, amount FLOAT)"))
+        connection.execute(text("INSERT INTO payments (id, account_id, amount) VALUES "
+                                "(1, 1, -5.0), (2, 2, 5.0), (3, NULL, 7.0)"))
+
+    started = time.time()
+    migrations.upgrade(engine)
+
+    with engine.connect() as connection:
+        created = connection.execute(select(Payment.created_at)).scalars().all()
+        assert all(value >= started for value in created)
+        summaries = connection.execute(select(PaymentSummary.account_id, PaymentSummary.period)).all()
+        assert sorted(account_id for account_id, _ in summaries) == [1, 2]
+        assert {period for _, period in summaries} == {time.strftime("%Y-%m", time.gmtime(created[0]))}
+    engine.dispose()
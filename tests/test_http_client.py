@@ -0,0 +1,145 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from common import http_client
+from common.http_client import CircuitBreaker, ServiceClient
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(http_client, "HTTP_RETRY_BACKOFF", 0)
+
+
+def service(handler, **kwargs) -> ServiceClient:
+    client = ServiceClient("account_service", "http://account_service:8003", **kwargs)
+    client._client = httpx.AsyncClient(base_url=client.base_url, transport=httpx.MockTransport(handler))
+    return client
+
+
+def test_breaker_opens_and_admits_one_probe_when_half_open(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(http_client.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    now[0] += 30
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+    now[0] += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow() and breaker.allow()
+
+
+# Проба, що так і не завершилась, не тримає ланцюг закритим для всіх назавжди
+def test_lost_probe_is_replaced_after_reset_timeout(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(http_client.time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+
+    now[0] += 10
+    assert breaker.allow()
+    now[0] += 5
+    assert not breaker.allow()
+    now[0] += 5
+    assert breaker.allow()
+
+
+def test_concurrent_requests_share_a_single_probe():
+    calls = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handler(request):
+            calls.append(request.url.path)
+            await release.wait()
+            return httpx.Response(200, json={"ok": True})
+
+        client = service(handler, retries=0)
+        client.breaker.opened_at = 0.0
+        client.breaker.failures = client.breaker.failure_threshold
+        try:
+            requests = [asyncio.create_task(client.get("/accounts/1")) for _ in range(5)]
+            await asyncio.sleep(0.01)
+            release.set()
+            results = await asyncio.gather(*requests, return_exceptions=True)
+        finally:
+            await client.aclose()
+        return client, results
+
+    client, results = asyncio.run(scenario())
+    assert calls == ["/accounts/1"]
+    assert [getattr(result, "status_code", None) for result in results].count(200) == 1
+    assert [result.status_code for result in results if isinstance(result, HTTPException)] == [503] * 4
+    assert client.stats["rejected"] == 4
+    assert client.breaker.state == "closed"
+
+
+def test_idempotent_requests_are_retried_on_server_errors():
+    statuses = iter([503, 502, 200])
+
+    def handler(request):
+        return httpx.Response(next(statuses))
+
+    async def scenario():
+        client = service(handler, retries=2)
+        try:
+            return client, await client.get("/accounts/1")
+        finally:
+            await client.aclose()
+
+    client, response = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert client.stats == {"requests": 1, "retries": 2, "failures": 2, "rejected": 0}
+    assert client.breaker.state == "closed"
+
+
+def test_post_is_not_retried_and_transport_errors_become_503():
+    calls = []
+
+    def handler(request):
+        calls.append(request.method)
+        raise httpx.ConnectError("connection refused", request=request)
+
+    async def scenario():
+        client = service(handler, retries=2)
+        try:
+            with pytest.raises(HTTPException) as post_error:
+                await client.post("/payments")
+            with pytest.raises(HTTPException) as get_error:
+                await client.get("/accounts/1")
+        finally:
+            await client.aclose()
+        return post_error.value, get_error.value
+
+    post_error, get_error = asyncio.run(scenario())
+    assert calls == ["POST", "GET", "GET", "GET"]
+    assert post_error.status_code == get_error.status_code == 503
+
+
+def test_limits_can_be_set_per_target(monkeypatch):
+    monkeypatch.setenv("PAYMENT_SERVICE_HTTP_TIMEOUT", "30")
+    monkeypatch.setenv("PAYMENT_SERVICE_HTTP_RETRIES", "0")
+    monkeypatch.setenv("HTTP_ACCOUNT_SERVICE_8003_HTTP_MAX_CONNECTIONS", "4")
+
+    payments = ServiceClient("payment_service", "http://payment_service:8005")
+    subscriber = ServiceClient("http://account_service:8003", "http://account_service:8003")
+    auth = ServiceClient("auth_service", "http://auth_service:8001")
+
+    assert (payments._timeout.read, payments.retries) == (30.0, 0)
+    assert subscriber._limits.max_connections == 4
+    assert (auth._timeout.read, auth.retries, auth._limits.max_connections) == (
+        http_client.HTTP_TIMEOUT, http_client.HTTP_RETRIES, http_client.HTTP_MAX_CONNECTIONS)
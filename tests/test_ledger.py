@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+from sqlalchemy import func, insert, select
+
+from models import Account, AccountBalance, LedgerEntry
+from common import ledger
+
+
+@pytest.mark.parametrize("amount, minor", [(12.34, 1234), (0.1, 10), (100, 10000), (0.001, None), (1.005, None),
+                                           (float("nan"), None)])
+def test_exact_minor(amount, minor):
+    assert ledger.exact_minor(amount) == minor
+
+
+def test_transfer_checks_funds_and_balances_to_zero(engine, accounts):
+    with pytest.raises(ledger.InsufficientFunds):
+        with engine.begin() as connection:
+            ledger.post_transfer(connection, [{"account_id": 1, "amount": -10001}, {"account_id": 2, "amount": 10001}])
+    with pytest.raises(ValueError):
+        with engine.begin() as connection:
+            ledger.post_transfer(connection, [{"account_id": 1, "amount": -1}, {"account_id": 2, "amount": 2}])
+    with engine.begin() as connection:
+        _, new_balances = ledger.post_transfer(connection, [{"account_id": 1, "amount": -2500},
+                                                            {"account_id": 2, "amount": 2500}])
+
+    assert new_balances == {1: 7500, 2: 2500}
+    with engine.connect() as connection:
+        assert connection.execute(select(func.sum(LedgerEntry.amount))).scalar() == 0
+    assert ledger.reconcile(engine, full=True)["ok"]
+
+
+# Перші проводки на ще не відкриті рахунки з кількох потоків: рахунок відкривається рівно один раз
+def test_concurrent_first_postings_open_each_account_once(engine):
+    account_ids = list(range(10, 15))
+    with engine.begin() as connection:
+        connection.execute(insert(Account.__table__), [
+            {"id": account_id, "owner_id": account_id, "balance": 5.0, "blocked": False} for account_id in account_ids])
+
+    errors = []
+
+    def top_up():
+        try:
+            for account_id in account_ids:
+                with engine.begin() as connection:
+                    ledger.post_transfer(connection, [
+                        {"account_id": ledger.EXTERNAL_ACCOUNT_ID, "amount": -100},
+                        {"account_id": account_id, "amount": 100},
+                    ], check_funds=False)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=top_up) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with engine.connect() as connection:
+        assert dict(connection.execute(
+            select(AccountBalance.account_id, AccountBalance.balance).where(AccountBalance.account_id.in_(account_ids))
+        ).all()) == {account_id: 500 + 8 * 100 for account_id in account_ids}
+        openings = connection.execute(
+            select(func.count()).select_from(LedgerEntry).where(LedgerEntry.transfer_id.like("opening-%"))
+        ).scalar()
+        assert openings == 2 * len(account_ids)
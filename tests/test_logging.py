@@ -0,0 +1,77 @@
+import json
+import logging
+import queue
+
+import pytest
+
+from common import logging_setup
+from common.logging_setup import REDACTED, JsonFormatter, NonBlockingQueueHandler, SamplingFilter, redact, redact_text
+from common.token_verifier import create_service_token
+
+JWT = create_service_token("payment_service")
+
+
+@pytest.mark.parametrize("text, expected", [
+    (f"GET /accounts/all?token={JWT}&limit=10", f"GET /accounts/all?token={REDACTED}&limit=10"),
+    (f"retrying with Bearer {JWT}", f"retrying with Bearer {REDACTED}"),
+    (f"Authorization: Bearer {JWT}", f"Authorization: {REDACTED} {REDACTED}"),
+    ("Bearer opaque-value", f"Bearer {REDACTED}"),
+    ("{'card_number': '4111', 'cvv': '123'}", f"{{'card_number': '4111', 'cvv': '{REDACTED}'}}"),
+    ('{"username": "alice", "password": "hunter2"}', f'{{"username": "alice", "password": "{REDACTED}"}}'),
+    ("POST /admin/register?username=root&admin_secret=s3cr3t", f"POST /admin/register?username=root&admin_secret={REDACTED}"),
+    ("issued tokens=3 for alice", "issued tokens=3 for alice"),
+])
+def test_redact_text(text, expected):
+    assert redact_text(text) == expected
+
+
+def test_redact_structures_by_key_and_value():
+    assert redact({"username": "alice", "Password": "x", "card": {"cvv": 123, "number": "4111"},
+                   "headers": [f"Bearer {JWT}"], "count": 2}) == {
+        "username": "alice", "Password": REDACTED, "card": {"cvv": REDACTED, "number": "4111"},
+        "headers": [f"Bearer {REDACTED}"], "count": 2}
+
+
+def test_json_formatter_redacts_message_and_extra_fields():
+    record = logging.LogRecord("payment_service", logging.INFO, __file__, 1, "login with token=%s", (JWT,), None)
+    record.password = "hunter2"
+    record.request = {"path": "/clients/me", "authorization": f"Bearer {JWT}"}
+    record.trace_id = "abc123"
+
+    entry = json.loads(JsonFormatter("payment_service").format(record))
+
+    assert entry["message"] == f"login with token={REDACTED}"
+    assert entry["password"] == REDACTED
+    assert entry["request"] == {"path": "/clients/me", "authorization": REDACTED}
+    assert (entry["service"], entry["trace_id"], entry["level"]) == ("payment_service", "abc123", "INFO")
+    assert JWT not in json.dumps(entry)
+
+
+# Повна черга не блокує запит: запис відкидається і рахується
+def test_full_queue_drops_instead_of_blocking(monkeypatch):
+    monkeypatch.setitem(logging_setup.stats, "dropped", 0)
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    logger = logging.getLogger("test_logging.queue")
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        for index in range(3):
+            logger.warning("event %s", index)
+    finally:
+        logger.removeHandler(handler)
+
+    assert handler.queue.get_nowait().getMessage() == "event 0"
+    assert logging_setup.stats["dropped"] == 2
+
+
+def test_debug_records_are_sampled(monkeypatch):
+    monkeypatch.setitem(logging_setup.stats, "sampled_out", 0)
+    sampling = SamplingFilter(0.0)
+
+    def record(level):
+        return logging.LogRecord("test", level, __file__, 1, "message", None, None)
+
+    assert not sampling.filter(record(logging.DEBUG))
+    assert sampling.filter(record(logging.INFO)) and sampling.filter(record(logging.ERROR))
+    assert SamplingFilter(1.0).filter(record(logging.DEBUG))
+    assert logging_setup.stats["sampled_out"] == 1
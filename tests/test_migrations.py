@@ -0,0 +1,53 @@
+from sqlalchemy import inspect, select, text
+
+from models import IdempotencyKey
+from common import migrations
+from common.db import create_engines
+
+
+def test_upgrade_is_applied_once(engine):
+    assert migrations.upgrade(engine) == migrations.MIGRATIONS[-1][0]
+    with engine.connect() as connection:
+        assert migrations.current_version(connection) == migrations.MIGRATIONS[-1][0]
+        versions = connection.execute(select(migrations.schema_version.c.version)).scalars().all()
+        assert sorted(versions) == [version for version, *_ in migrations.MIGRATIONS]
+        assert migrations.missing_indexes(connection) == []
+
+
+# Критичні запити йдуть індексами; на PostgreSQL планувальник обирає Seq Scan для порожніх таблиць
+def test_schema_check_finds_no_full_scans(engine):
+    report = migrations.check_schema(engine)
+    assert report["missing_indexes"] == []
+    assert set(report["plans"]) == set(migrations.CRITICAL_QUERIES)
+    if engine.dialect.name == "sqlite":
+        assert report["full_scans"] == []
+
+
+def test_schema_check_reports_a_dropped_index(engine):
+    with engine.begin() as connection:
+        connection.exec_driver_sql("DROP INDEX ix_accounts_owner_id")
+
+    report = migrations.check_schema(engine)
+    assert report["missing_indexes"] == ["accounts.ix_accounts_owner_id"]
+    if engine.dialect.name == "sqlite":
+        assert "client_account" in report["full_scans"]
+
+
+def test_replica_tables_have_no_foreign_keys(engine):
+    inspector = inspect(engine)
+    for table in ("accounts", "credit_cards", "payments"):
+        assert inspector.get_foreign_keys(table) == []
+
+
+def test_request_hash_is_added_to_existing_idempotency_keys(database_url):
+    engine, _ = create_engines(database_url)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE idempotency_keys (client_id INTEGER, key VARCHAR, response TEXT, "
+                                "PRIMARY KEY (client_id, key))"))
+        connection.execute(text("INSERT INTO idempotency_keys VALUES (1, 'retry-1', '{}')"))
+
+    migrations.upgrade(engine)
+
+    with engine.connect() as connection:
+        assert connection.execute(select(IdempotencyKey.key, IdempotencyKey.request_hash)).all() == [("retry-1", None)]
+    engine.dispose()
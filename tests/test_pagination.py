@@ -0,0 +1,70 @@
+import json
+from typing import List
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from models import Client
+from common import pagination
+from common.pagination import PAGE_SIZE_DEFAULT, list_rows
+from common.schemas import ClientOut, columns
+
+
+# Той самий вигляд, що й /clients у сервісах: сторінка за after_id або потік NDJSON
+@pytest.fixture
+def api(engine, monkeypatch):
+    monkeypatch.setattr(pagination, "STREAM_BATCH_SIZE", 7)
+    with engine.begin() as connection:
+        connection.execute(insert(Client.__table__), [
+            {"id": client_id, "username": f"user{client_id}", "hashed_password": "secret"} for client_id in range(1, 26)])
+    SessionLocal = sessionmaker(bind=engine)
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+
+    @app.get("/clients", response_model=List[ClientOut])
+    def get_all_clients(after_id: int = 0, limit: int = PAGE_SIZE_DEFAULT, stream: bool = False,
+                        db=Depends(get_db)):
+        return list_rows(SessionLocal, db, lambda session: session.query(*columns(ClientOut, Client)), Client,
+                         after_id, limit, stream)
+
+    with TestClient(app) as client:
+        yield client
+
+
+def test_keyset_pages_cover_every_row_once(api):
+    seen = []
+    after_id = 0
+    while True:
+        page = api.get("/clients", params={"after_id": after_id, "limit": 10}).json()
+        if not page:
+            break
+        seen.extend(row["id"] for row in page)
+        after_id = page[-1]["id"]
+
+    assert seen == list(range(1, 26))
+    assert api.get("/clients", params={"after_id": 20}).json()[0] == {"id": 21, "username": "user21"}
+
+
+@pytest.mark.parametrize("limit, size", [(0, 1), (-5, 1), (10_000, 25)])
+def test_limit_is_clamped(api, limit, size):
+    assert len(api.get("/clients", params={"limit": limit}).json()) == size
+
+
+def test_stream_returns_ndjson_after_cursor(api):
+    response = api.get("/clients", params={"stream": True, "after_id": 3})
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["id"] for row in rows] == list(range(4, 26))
+    # Лише колонки схеми відповіді: hashed_password не читається і не віддається
+    assert rows[0] == {"id": 4, "username": "user4"}
@@ -0,0 +1,92 @@
+import asyncio
+
+import bcrypt
+import pytest
+from fastapi.testclient import TestClient
+
+import passwords
+
+
+def test_plaintext_password_is_upgraded_on_successful_login():
+    assert passwords._verify("secret", "secret", 4)[0] is True
+    new_hash = passwords._verify("secret", "secret", 4)[1]
+    assert new_hash.startswith("$2b$04$") and bcrypt.checkpw(b"secret", new_hash.encode())
+
+    assert passwords._verify("wrong", "secret", 4) == (False, None)
+    assert passwords._verify("secret", None, 4) == (False, None)
+
+
+def test_bcrypt_hash_is_rehashed_only_when_cost_changes():
+    stored = passwords._hash("secret", 4)
+
+    assert passwords._verify("secret", stored, 4) == (True, None)
+    assert passwords._verify("wrong", stored, 4) == (False, None)
+    valid, new_hash = passwords._verify("secret", stored, 5)
+    assert valid and new_hash.startswith("$2b$05$")
+
+
+def test_long_passwords_use_the_first_72_bytes():
+    stored = passwords._hash("x" * 72 + "tail", 4)
+    assert passwords._verify("x" * 72 + "other", stored, 4) == (True, None)
+
+
+def test_hashing_runs_in_the_process_pool(monkeypatch):
+    monkeypatch.setattr(passwords, "BCRYPT_ROUNDS", 4)
+
+    async def roundtrip():
+        passwords.start(workers=1)
+        try:
+            stored = await passwords.hash_password("secret")
+            return stored, await passwords.verify_password("secret", stored), await passwords.verify_password("x", stored)
+        finally:
+            passwords.shutdown()
+
+    stored, valid, invalid = asyncio.run(roundtrip())
+    assert stored.startswith("$2b$04$")
+    assert valid == (True, None) and invalid == (False, None)
+
+
+def test_login_slots_reject_when_the_queue_is_full(monkeypatch):
+    monkeypatch.setattr(passwords, "LOGIN_CONCURRENCY", 1)
+    monkeypatch.setattr(passwords, "LOGIN_QUEUE_TIMEOUT", 0.01)
+
+    async def contend():
+        passwords.start(workers=1)
+        try:
+            async with passwords.login_slot():
+                with pytest.raises(passwords.PasswordPoolBusy):
+                    async with passwords.login_slot():
+                        pass
+        finally:
+            passwords.shutdown()
+
+    asyncio.run(contend())
+
+
+# Вхід з відкритим паролем у базі: токени видаються, а пароль замінюється хешем bcrypt
+def test_login_replaces_plaintext_password_with_bcrypt(load_service, monkeypatch):
+    monkeypatch.setattr(passwords, "BCRYPT_ROUNDS", 4)
+    auth = load_service("auth_service", "AUTH")
+    with auth.SessionLocal() as db:
+        db.add(auth.Client(username="alice", hashed_password="secret"))
+        db.commit()
+
+    def stored_hash():
+        with auth.SessionLocal() as db:
+            return db.query(auth.Client.hashed_password).filter(auth.Client.username == "alice").scalar()
+
+    api = TestClient(auth.app)
+    try:
+        assert api.post("/login", data={"username": "alice", "password": "wrong"}).status_code == 401
+        assert stored_hash() == "secret"
+
+        response = api.post("/login", data={"username": "alice", "password": "secret"})
+        assert response.status_code == 200 and response.json()["access_token"]
+        upgraded = stored_hash()
+        assert upgraded.startswith("$2b$04$") and bcrypt.checkpw(b"secret", upgraded.encode())
+
+        assert api.post("/login", data={"username": "alice", "password": "secret"}).status_code == 200
+        assert stored_hash() == upgraded
+        assert api.post("/login", data={"username": "alice", "password": "upgraded"}).status_code == 401
+    finally:
+        passwords.shutdown()
@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import event, insert, select
+from sqlalchemy.orm import sessionmaker
+
+from models import Admin, Client
+from principals import find_principal, store_password_hash
+
+
+@pytest.fixture
+def session(engine):
+    with engine.begin() as connection:
+        connection.execute(insert(Client.__table__), [{"id": 1, "username": "alice", "hashed_password": "client-hash"}])
+        connection.execute(insert(Admin.__table__), [{"id": 1, "username": "alice", "hashed_password": "admin-hash"},
+                                                     {"id": 2, "username": "root", "hashed_password": "root-hash"}])
+    db = sessionmaker(bind=engine)()
+    yield db
+    db.close()
+
+
+# Ім'я в обох таблицях — як і до об'єднання запитів, спершу клієнт
+def test_client_wins_over_admin_with_the_same_name(session):
+    principal = find_principal(session, "alice")
+    assert (principal.id, principal.username, principal.hashed_password, principal.role) == (
+        1, "alice", "client-hash", "client")
+
+    principal = find_principal(session, "root")
+    assert (principal.id, principal.hashed_password, principal.role) == (2, "root-hash", "admin")
+    assert find_principal(session, "nobody") is None
+
+
+def test_lookup_is_a_single_statement(engine, session):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        find_principal(session, "root")
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert len(statements) == 1
+
+
+def test_store_password_hash_updates_only_the_matched_table(session):
+    store_password_hash(session, find_principal(session, "root"), "new-root-hash")
+    store_password_hash(session, find_principal(session, "alice"), "new-client-hash")
+
+    assert dict(session.execute(select(Admin.username, Admin.hashed_password)).all()) == {
+        "alice": "admin-hash", "root": "new-root-hash"}
+    assert session.execute(select(Client.hashed_password)).scalar() == "new-client-hash"
@@ -0,0 +1,111 @@
+import asyncio
+import time
+import types
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from common import rate_limit
+from common.rate_limit import MemoryStore, RateLimitMiddleware
+from common.token_verifier import create_service_token, sign_token
+
+
+def client_token(username: str) -> str:
+    return sign_token({"sub": username, "role": "client", "exp": int(time.time()) + 60})
+
+
+def build(**kwargs):
+    app = FastAPI()
+    release = asyncio.Event()
+
+    @app.get("/items")
+    async def items():
+        return {"ok": True}
+
+    @app.get("/report")
+    async def report():
+        await release.wait()
+        return {"ok": True}
+
+    middleware = RateLimitMiddleware(app, store=MemoryStore(), **{"global_limit": None, "client_limit": None, **kwargs})
+    return middleware, release
+
+
+async def get(middleware, path: str, token: str = None) -> httpx.Response:
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(middleware), base_url="http://service") as client:
+        return await client.get(path, params={"token": token} if token else None)
+
+
+def test_bucket_refills_over_time(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rate_limit, "time", types.SimpleNamespace(monotonic=lambda: now[0], time=time.time))
+    store = MemoryStore()
+
+    async def take():
+        return await store.take("client:alice", 2.0, 2.0)
+
+    assert [asyncio.run(take()) for _ in range(3)] == [0.0, 0.0, 0.5]
+    now[0] += 0.5
+    assert asyncio.run(take()) == 0.0
+    assert asyncio.run(take()) == 0.5
+
+
+def test_each_client_has_its_own_quota():
+    middleware, _ = build(client_limit=(0.001, 2))
+
+    async def scenario():
+        alice, bob = client_token("alice"), client_token("bob")
+        statuses = [(await get(middleware, "/items", alice)).status_code for _ in range(3)]
+        limited = await get(middleware, "/items", alice)
+        return statuses, limited, (await get(middleware, "/items", bob)).status_code, [
+            (await get(middleware, "/items", create_service_token("payment_service"))).status_code for _ in range(5)]
+
+    statuses, limited, bob, service = asyncio.run(scenario())
+    assert statuses == [200, 200, 429]
+    assert limited.json() == {"detail": "Too many requests"} and int(limited.headers["retry-after"]) >= 1
+    assert bob == 200
+    # Службові виклики між сервісами квотами клієнтів не обмежуються
+    assert service == [200] * 5
+
+
+def test_route_limit_is_checked_before_the_client_quota():
+    middleware, _ = build(routes={"GET /items": (0.001, 1)}, client_limit=(0.001, 3))
+
+    async def scenario():
+        # Запит без токена рахується за адресою клієнта
+        return [(await get(middleware, "/items")).status_code for _ in range(2)] + [
+            (await get(middleware, "/report-missing")).status_code]
+
+    assert asyncio.run(scenario()) == [200, 429, 404]
+
+
+@pytest.mark.parametrize("in_flight, latency", [(rate_limit.SHED_MAX_IN_FLIGHT, 0.0),
+                                                (rate_limit.SHED_MIN_IN_FLIGHT, rate_limit.SHED_LATENCY + 1)])
+def test_overload_is_shed_before_any_work(in_flight, latency):
+    middleware, _ = build()
+    middleware.in_flight, middleware.latency = in_flight, latency
+
+    response = asyncio.run(get(middleware, "/items"))
+    assert (response.status_code, response.json()["detail"]) == (503, "Service overloaded")
+
+    middleware.in_flight = rate_limit.SHED_MIN_IN_FLIGHT - 1
+    assert asyncio.run(get(middleware, "/items")).status_code == 200
+
+
+def test_concurrency_limit_rejects_after_queue_timeout(monkeypatch):
+    monkeypatch.setattr(rate_limit, "CONCURRENCY_QUEUE_TIMEOUT", 0.01)
+    middleware, release = build(concurrency={"GET /report": 1})
+
+    async def scenario():
+        first = asyncio.create_task(get(middleware, "/report"))
+        await asyncio.sleep(0.01)
+        second = await get(middleware, "/report")
+        other = await get(middleware, "/items")
+        release.set()
+        return (await first).status_code, second, other.status_code
+
+    first, second, other = asyncio.run(scenario())
+    assert first == 200 and other == 200
+    assert (second.status_code, second.json()["detail"]) == (503, "Too many concurrent requests")
+    assert middleware.in_flight == 0
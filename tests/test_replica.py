@@ -0,0 +1,127 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.orm import sessionmaker
+
+from models import Account, ReplicaVersion
+from common import http_client, migrations, outbox
+from common.change_feed import record_changes
+from common.db import create_engines
+from common.replica import apply_events
+
+
+@pytest.fixture
+def session(engine):
+    db = sessionmaker(bind=engine)()
+    yield db
+    db.close()
+
+
+def account_event(seq: int, account_id: int, op: str = "update", kind: str = None, **data) -> dict:
+    row = {"id": account_id, "balance": 0.0, "blocked": False, "owner_id": account_id, **data}
+    return {"seq": seq, "id": account_id, "op": op, "kind": kind or op, "data": None if op == "delete" else row}
+
+
+def replicated(db) -> dict:
+    return {row.id: (row.balance, row.blocked, row.owner_id)
+            for row in db.execute(select(Account.id, Account.balance, Account.blocked, Account.owner_id))}
+
+
+def test_apply_keeps_last_state_and_ignores_redelivery(session):
+    events = [
+        account_event(1, 1, "insert", balance=10.0),
+        account_event(2, 2, "insert"),
+        account_event(3, 1, blocked=True, balance=10.0),
+        account_event(4, 3, "insert", owner_id=7),  # Власника в репліці ще немає
+        account_event(5, 2, "delete"),
+    ]
+
+    assert apply_events(session, Account, events) == 5
+    assert replicated(session) == {1: (10.0, True, 1), 3: (0.0, False, 7)}
+    assert apply_events(session, Account, events) == 0
+    assert apply_events(session, Account, [account_event(3, 1, blocked=False)]) == 0
+    assert replicated(session) == {1: (10.0, True, 1), 3: (0.0, False, 7)}
+    versions = dict(session.execute(select(ReplicaVersion.entity_id, ReplicaVersion.version)).all())
+    assert versions == {1: 3, 2: 5, 3: 4}
+
+
+def test_update_columns_and_merge_for_existing_rows(session):
+    apply_events(session, Account, [account_event(1, 1, "insert", balance=5.0)])
+    merged = []
+
+    applied = apply_events(session, Account, [
+        account_event(2, 1, kind="topped_up", balance=50.0, amount=45.0),
+        account_event(3, 1, kind="blocked", blocked=True, balance=50.0),
+        account_event(4, 2, "insert", kind="created", balance=1.0),
+    ], update_columns=["owner_id", "blocked"], merge=lambda db, events: merged.extend(events))
+
+    assert applied == 3
+    # Баланс наявного рядка не перезаписується, новий рядок приходить повністю
+    assert replicated(session) == {1: (5.0, True, 1), 2: (1.0, False, 2)}
+    assert [(event["seq"], event["kind"]) for event in merged] == [(2, "topped_up"), (3, "blocked")]
+
+
+def test_batch_does_not_query_per_event(engine, session):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        apply_events(session, Account, [account_event(seq, seq, "insert") for seq in range(1, 201)])
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert len(statements) < 10
+    assert len(replicated(session)) == 200
+
+
+# Outbox доставляє журнал змін у репліку підписника; позиція рухається лише після успішної доставки
+def test_outbox_delivers_changes_at_least_once(engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(http_client, "HTTP_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(outbox, "OUTBOX_BATCH_SIZE", 2)
+    replica_engine, _ = create_engines(f"sqlite:///{tmp_path / 'replica.db'}")
+    migrations.upgrade(replica_engine)
+    replica = sessionmaker(bind=replica_engine)()
+    subscriber = "http://payment_service:8005"
+    available = [False]
+
+    def handler(request):
+        if not available[0]:
+            return httpx.Response(503)
+        return httpx.Response(200, json={"applied": apply_events(replica, Account, json.loads(request.content)["events"])})
+
+    client = http_client.ServiceClient(subscriber, subscriber)
+    client._client = httpx.AsyncClient(base_url=subscriber, transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(http_client._clients, subscriber, client)
+    dispatcher = outbox.OutboxDispatcher(sessionmaker(bind=engine), "accounts", [subscriber],
+                                         "/internal/events/accounts", "account_service")
+
+    with engine.begin() as connection:
+        record_changes(connection, "accounts", [
+            {"id": account_id, "balance": 1.0, "blocked": False, "owner_id": account_id} for account_id in (1, 2, 3)],
+            "insert")
+    asyncio.run(dispatcher.dispatch_once())
+    assert dispatcher.status[subscriber]["seq"] == 0
+    assert dispatcher.status[subscriber]["last_error"] is not None
+    assert replicated(replica) == {}
+
+    available[0] = True
+    with engine.begin() as connection:
+        record_changes(connection, "accounts", [{"id": 2, "balance": 1.0, "blocked": True, "owner_id": 2}], "update",
+                       kind="blocked")
+    asyncio.run(dispatcher.dispatch_once())
+    # Новий диспетчер після перезапуску продовжує з позиції в sync_watermarks і нічого не повторює
+    restarted = outbox.OutboxDispatcher(sessionmaker(bind=engine), "accounts", [subscriber],
+                                        "/internal/events/accounts", "account_service")
+    asyncio.run(restarted.dispatch_once())
+
+    assert dispatcher.status[subscriber] == {"seq": 4, "delivered": 4, "last_error": None}
+    assert restarted.status[subscriber]["delivered"] == 0
+    assert replicated(replica) == {1: (1.0, False, 1), 2: (1.0, True, 2), 3: (1.0, False, 3)}
+    asyncio.run(client.aclose())
+    replica.close()
+    replica_engine.dispose()
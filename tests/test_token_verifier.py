@@ -0,0 +1,103 @@
+import asyncio
+import base64
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+
+from common import http_client, token_verifier
+from common.token_verifier import verify_token
+
+JWKS_URL = "http://auth_service:8001/.well-known/jwks.json"
+
+
+def token(secret: str = token_verifier.JWT_SECRET_KEY, kid: str = token_verifier.JWT_KEY_ID, **claims) -> str:
+    claims = {"sub": "alice", "role": "client", "exp": int(time.time()) + 60, **claims}
+    headers = {"kid": kid} if kid is not None else None
+    return jwt.encode({key: value for key, value in claims.items() if value is not None}, secret,
+                      algorithm=token_verifier.JWT_ALGORITHM, headers=headers)
+
+
+def jwk(kid: str, secret: str) -> dict:
+    return {"kty": "oct", "kid": kid, "alg": "HS256", "k": base64.urlsafe_b64encode(secret.encode()).rstrip(b"=").decode()}
+
+
+def rejected(value: str) -> str:
+    with pytest.raises(HTTPException) as error:
+        verify_token(value)
+    assert error.value.status_code == 401
+    return error.value.detail
+
+
+def test_verifies_signed_tokens():
+    assert verify_token(token_verifier.sign_token({"sub": "bob", "role": "admin", "exp": int(time.time()) + 60})) == {
+        "username": "bob", "role": "admin"}
+    assert verify_token(token_verifier.create_service_token("payment_service")) == {
+        "username": "payment_service", "role": "service"}
+    # Токени, видані до появи kid, підписані поточним ключем
+    assert verify_token(token(kid=None))["username"] == "alice"
+
+
+@pytest.mark.parametrize("claims", [
+    {"exp": int(time.time()) - 1},
+    {"exp": None},
+    {"role": "root"},
+    {"sub": None},
+    {"secret": "not-the-key"},
+])
+def test_rejects_invalid_tokens(claims):
+    assert rejected(token(**claims)) == "Invalid token"
+
+
+# Після ротації токени зі старим kid діють, доки їх ключ лишається в JWT_PREVIOUS_KEYS
+def test_previous_keys_after_rotation(monkeypatch):
+    monkeypatch.setattr(token_verifier, "_keys", {"k0": "old_secret", token_verifier.JWT_KEY_ID: token_verifier.JWT_SECRET_KEY})
+    assert verify_token(token("old_secret", "k0", sub="carol"))["username"] == "carol"
+    assert rejected(token("old_secret", "k9", sub="dave")) == "Invalid token"
+    assert rejected(token("forged", "k0", sub="erin")) == "Invalid token"
+
+
+# Невідомий kid — 401 без звернення до мережі; новий ключ підтягує фонове завдання
+def test_jwks_rotation_refreshes_in_background(monkeypatch):
+    published = [jwk("k1", "first_secret")]
+    fetches = []
+
+    def handler(request):
+        fetches.append(str(request.url))
+        return httpx.Response(200, json={"keys": list(published)})
+
+    service = http_client.ServiceClient("jwks", JWKS_URL)
+    service._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(http_client._clients, "jwks", service)
+    monkeypatch.setattr(token_verifier, "_jwks", {})
+    sync = token_verifier.JwksSync(JWKS_URL, interval=60, min_interval=0)
+    monkeypatch.setattr(token_verifier, "jwks_sync", sync)
+
+    async def wait_for(condition):
+        for _ in range(200):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError("JWKS was not refreshed")
+
+    async def scenario():
+        sync.start()
+        try:
+            await wait_for(lambda: sync.status["keys"] == 1)
+            assert verify_token(token("first_secret", "k1"))["username"] == "alice"
+
+            rotated = token("second_secret", "k2", sub="bob")
+            published.append(jwk("k2", "second_secret"))
+            before = len(fetches)
+            assert rejected(rotated) == "Invalid token"
+            assert len(fetches) == before
+            await wait_for(lambda: sync.status["keys"] == 2)
+            assert verify_token(rotated)["username"] == "bob"
+        finally:
+            await sync.stop()
+            await service.aclose()
+
+    asyncio.run(scenario())
+    assert fetches == [JWKS_URL, JWKS_URL]
@@ -0,0 +1,95 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from models import RevokedToken
+from common import token_verifier
+from common.token_verifier import verify_token
+import tokens
+
+
+@pytest.fixture
+def session(engine, monkeypatch):
+    monkeypatch.setattr(token_verifier, "_revoked", {})
+    db = sessionmaker(bind=engine)()
+    yield db
+    db.close()
+
+
+def test_refresh_token_is_single_use(session):
+    issued = tokens.issue_tokens(session, "alice", "client")
+    rotated = tokens.rotate(session, issued["refresh_token"])
+
+    assert verify_token(rotated["access_token"]) == {"username": "alice", "role": "client"}
+    assert rotated["refresh_token"] != issued["refresh_token"]
+    assert tokens.rotate(session, rotated["refresh_token"])["refresh_token"]
+
+
+# Повторне пред'явлення використаного токена відкликає весь ланцюжок, зокрема вже видану заміну
+def test_reuse_revokes_the_family(session):
+    issued = tokens.issue_tokens(session, "alice", "client")
+    rotated = tokens.rotate(session, issued["refresh_token"])
+    other = tokens.issue_tokens(session, "alice", "client")
+
+    with pytest.raises(tokens.RefreshRejected):
+        tokens.rotate(session, issued["refresh_token"])
+    with pytest.raises(tokens.RefreshRejected):
+        tokens.rotate(session, rotated["refresh_token"])
+    # Інший вхід того ж користувача — окремий ланцюжок
+    assert tokens.rotate(session, other["refresh_token"])
+
+
+def test_expired_unknown_and_revoked_refresh_tokens_are_rejected(session, monkeypatch):
+    monkeypatch.setattr(tokens, "REFRESH_TOKEN_EXPIRE_DAYS", -1)
+    expired = tokens.issue_tokens(session, "alice", "client")
+    monkeypatch.setattr(tokens, "REFRESH_TOKEN_EXPIRE_DAYS", 14)
+    logged_out = tokens.issue_tokens(session, "alice", "client")
+    renamed = tokens.issue_tokens(session, "bob", "client")
+    tokens.revoke_refresh_token(session, logged_out["refresh_token"])
+    tokens.revoke_user_tokens(session, "bob")
+
+    for refresh_token in (expired["refresh_token"], "unknown", logged_out["refresh_token"], renamed["refresh_token"]):
+        with pytest.raises(tokens.RefreshRejected):
+            tokens.rotate(session, refresh_token)
+
+
+def test_revoked_access_token_is_rejected_even_when_cached(session):
+    access_token = tokens.issue_tokens(session, "alice", "client")["access_token"]
+    assert verify_token(access_token)["username"] == "alice"
+
+    tokens.revoke_access_token(session, jwt.get_unverified_claims(access_token))
+    tokens.revoke_access_token(session, jwt.get_unverified_claims(access_token))
+
+    with pytest.raises(HTTPException) as error:
+        verify_token(access_token)
+    assert (error.value.status_code, error.value.detail) == (401, "Token revoked")
+    assert len(token_verifier._revoked) == 1
+
+
+# Сервіси отримують чинні відкликання сторінками і після перезапуску відновлюють набір з бази
+def test_revocations_page_and_reload(session, monkeypatch):
+    now = time.time()
+    session.execute(insert(RevokedToken.__table__), [
+        {"jti_hash": f"digest-{index}", "expires_at": now + 60 if index != 2 else now - 1} for index in range(5)])
+    session.commit()
+
+    first = tokens.revocations_page(session, 0, 2)
+    second = tokens.revocations_page(session, first["next"], 2)
+    assert [row["jti_hash"] for row in first["revocations"]] == ["digest-0", "digest-1"]
+    assert first["has_more"]
+    assert [row["jti_hash"] for row in second["revocations"]] == ["digest-3", "digest-4"]
+    assert not second["has_more"]
+    assert tokens.revocations_page(session, second["next"], 2) == {"revocations": [], "next": second["next"],
+                                                                    "has_more": False}
+
+    tokens.load_revocations(session)
+    assert sorted(token_verifier._revoked) == ["digest-0", "digest-1", "digest-3", "digest-4"]
+    assert token_verifier.is_revoked("digest-0") and not token_verifier.is_revoked(None)
+
+    token_verifier.revoke("digest-old", now - 1)
+    token_verifier.prune_revoked()
+    assert not token_verifier.is_revoked("digest-old")
@@ -0,0 +1,74 @@
+import pytest
+from sqlalchemy import func, select
+
+from models import Account, AccountBalance, Payment
+from common import ledger
+import transfers
+from transfers import TransferError, transfer_batch
+
+
+def balances(engine) -> dict:
+    with engine.connect() as connection:
+        return {
+            "accounts": dict(connection.execute(select(Account.id, Account.balance)).all()),
+            "ledger": {account_id: ledger.from_minor(balance) for account_id, balance in connection.execute(
+                select(AccountBalance.account_id, AccountBalance.balance).where(AccountBalance.account_id > 0))},
+        }
+
+
+def payments(engine) -> int:
+    with engine.connect() as connection:
+        return connection.execute(select(func.count()).select_from(Payment)).scalar()
+
+
+def block_sender(engine):
+    with engine.begin() as connection:
+        connection.execute(Account.__table__.update().where(Account.id == 1).values(blocked=True))
+
+
+def test_batch_rolls_back_only_failed_items(engine, accounts):
+    results = transfer_batch(engine, 1, [
+        {"to_account_id": 2, "amount": 60},
+        {"to_account_id": 2, "amount": 50},  # Після першого лишається 40 — відкочується своєю точкою збереження
+        {"to_account_id": 99, "amount": 1},
+        {"to_account_id": 2, "amount": 0.005},
+        {"to_account_id": 2, "amount": 40},
+    ])
+
+    assert [(result["status"], result.get("status_code")) for result in results] == [
+        ("ok", None), ("failed", 400), ("failed", 404), ("failed", 400), ("ok", None)]
+    assert payments(engine) == 4
+    assert balances(engine) == {"accounts": {1: 0.0, 2: 100.0}, "ledger": {1: 0.0, 2: 100.0}}
+
+
+@pytest.mark.parametrize("client_id, status_code", [(1, 403), (99, 404)])
+def test_batch_checks_sender(engine, accounts, client_id, status_code):
+    block_sender(engine)
+
+    for items in ([{"to_account_id": 2, "amount": 1}], [{"to_account_id": 2, "amount": 0}]):
+        with pytest.raises(TransferError) as error:
+            transfer_batch(engine, client_id, items)
+        assert error.value.status_code == status_code
+    assert payments(engine) == 0
+
+
+# Рахунок заблоковано між транзакціями пакета: вже закомічені перекази лишаються, решта відхиляється
+def test_sender_blocked_mid_batch_stops_remaining_chunks(engine, accounts, monkeypatch):
+    monkeypatch.setattr(transfers, "TRANSFER_BATCH_CHUNK_SIZE", 2)
+    chunks = []
+    with_lock_retries = transfers.with_lock_retries
+
+    def block_after_first_chunk(operation):
+        if chunks:
+            block_sender(engine)
+        chunks.append(operation)
+        return with_lock_retries(operation)
+
+    monkeypatch.setattr(transfers, "with_lock_retries", block_after_first_chunk)
+    results = transfer_batch(engine, 1, [{"to_account_id": 2, "amount": 10} for _ in range(5)])
+
+    assert [(result["status"], result.get("status_code")) for result in results] == [
+        ("ok", None), ("ok", None), ("failed", 403), ("failed", 403), ("failed", 403)]
+    assert len(chunks) == 3
+    assert payments(engine) == 4
+    assert balances(engine)["ledger"] == {1: 80.0, 2: 20.0}
@@ -0,0 +1,104 @@
+import json
+
+import pytest
+from sqlalchemy import func, insert, select
+
+from models import Account, AccountBalance, IdempotencyKey, LedgerEntry, Payment, PaymentSummary
+from common import ledger
+from transfers import TransferError, transfer
+
+
+def balances(engine) -> dict:
+    with engine.connect() as connection:
+        return {
+            "accounts": dict(connection.execute(select(Account.id, Account.balance)).all()),
+            "ledger": {account_id: ledger.from_minor(balance) for account_id, balance in connection.execute(
+                select(AccountBalance.account_id, AccountBalance.balance).where(AccountBalance.account_id > 0))},
+        }
+
+
+def count(engine, model) -> int:
+    with engine.connect() as connection:
+        return connection.execute(select(func.count()).select_from(model)).scalar()
+
+
+def test_transfer_moves_money_and_balances_the_ledger(engine, accounts):
+    result = transfer(engine, 1, 2, 12.34)
+
+    assert result == {"message": "Payment successful", "from_account_balance": 87.66, "to_account_balance": 12.34}
+    assert balances(engine) == {"accounts": {1: 87.66, 2: 12.34}, "ledger": {1: 87.66, 2: 12.34}}
+    with engine.connect() as connection:
+        assert connection.execute(select(func.sum(LedgerEntry.amount))).scalar() == 0
+        assert sorted(connection.execute(select(Payment.account_id, Payment.amount)).all()) == [(1, -12.34), (2, 12.34)]
+        assert sorted(connection.execute(select(PaymentSummary.account_id, PaymentSummary.total_in,
+                                                PaymentSummary.total_out)).all()) == [(1, 0, 12.34), (2, 12.34, 0)]
+
+
+@pytest.mark.parametrize("amount, detail", [
+    (0, "Amount must be positive"),
+    (-5, "Amount must be positive"),
+    (0.001, "Amount must be a whole number of cents"),
+    (float("inf"), "Amount must be a whole number of cents"),
+])
+def test_transfer_rejects_invalid_amounts(engine, accounts, amount, detail):
+    with pytest.raises(TransferError) as error:
+        transfer(engine, 1, 2, amount)
+
+    assert (error.value.status_code, error.value.detail) == (400, detail)
+    assert count(engine, Payment) == 0
+
+
+def test_transfer_without_funds_writes_nothing(engine, accounts):
+    with pytest.raises(TransferError) as error:
+        transfer(engine, 1, 2, 100.01)
+
+    assert error.value.status_code == 400
+    assert count(engine, Payment) == 0
+    assert balances(engine)["ledger"] == {1: 100.0, 2: 0.0}
+
+
+def test_transfer_checks_accounts(engine, accounts):
+    with pytest.raises(TransferError) as error:
+        transfer(engine, 1, 99, 1)
+    assert error.value.status_code == 404
+
+    with engine.begin() as connection:
+        connection.execute(Account.__table__.update().where(Account.id == 1).values(blocked=True))
+    with pytest.raises(TransferError) as error:
+        transfer(engine, 1, 2, 1)
+    assert error.value.status_code == 403
+
+
+def test_idempotent_transfer_is_applied_once(engine, accounts):
+    first = transfer(engine, 1, 2, 10, idempotency_key="retry-1")
+    replay = transfer(engine, 1, 2, 10, idempotency_key="retry-1")
+    other = transfer(engine, 1, 2, 10, idempotency_key="retry-2")
+
+    assert replay == first
+    assert other["from_account_balance"] == 80.0
+    assert count(engine, Payment) == 4
+    assert balances(engine)["ledger"] == {1: 80.0, 2: 20.0}
+
+
+@pytest.mark.parametrize("to_account_id, amount", [(2, 11), (1, 10)])
+def test_idempotency_key_reused_with_other_parameters_is_rejected(engine, accounts, to_account_id, amount):
+    transfer(engine, 1, 2, 10, idempotency_key="retry-1")
+
+    with pytest.raises(TransferError) as error:
+        transfer(engine, 1, to_account_id, amount, idempotency_key="retry-1")
+
+    assert error.value.status_code == 422
+    assert count(engine, Payment) == 2
+    assert balances(engine)["ledger"] == {1: 90.0, 2: 10.0}
+    # Ключ належить клієнтові: той самий ключ іншого клієнта — окремий переказ
+    assert transfer(engine, 2, 1, 1, idempotency_key="retry-1")["from_account_balance"] == 9.0
+
+
+# Ключі, збережені до появи request_hash, повторюються як і раніше
+def test_key_without_request_hash_is_replayed(engine, accounts):
+    with engine.begin() as connection:
+        connection.execute(insert(IdempotencyKey.__table__).values(
+            client_id=1, key="legacy", request_hash=None, response=json.dumps({"message": "Payment successful"})))
+
+    assert transfer(engine, 1, 2, 99, idempotency_key="legacy") == {"message": "Payment successful"}
+    assert count(engine, Payment) == 0